@@ -0,0 +1,395 @@
+"""Local HTTP API for hospital information systems.
+
+Usage:
+  python api.py serve [--host 127.0.0.1] [--port 8502] [--data-dir .]
+  python api.py add-key <phone>     # prints a new API key for an approved hospital/blood bank
+
+Endpoints (all JSON, authenticated with "Authorization: Bearer <key>"):
+  GET  /health
+  GET  /metrics                    Prometheus text format (no key needed, like /health)
+  GET  /requests                   the caller's requests (?status=Pending to filter)
+  POST /requests/batch             {"requests": [{"blood_type", "units", "urgency"}, ...]}
+                                   streams one NDJSON line per request, with its matched donors
+  GET  /requests/<id>/matches      streams the request's matched donors as NDJSON
+  POST /inventory/batch            {"units": [{"blood_type", "units", "expiry", "donor_phone"}, ...]}
+
+POST endpoints accept an "Idempotency-Key" header: a retried call with the
+same key gets the original response back instead of creating duplicates.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import secrets
+from datetime import datetime, date
+from urllib.parse import urlsplit, parse_qs
+from utils import load_data, save_data, load_locations
+from locations import compile_locations, registry_path
+from metrics import render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from core import Repository, BloodHub, DuplicateRequestError, BLOOD_TYPES, URGENCY_LEVELS
+
+API_KEYS_FILE = "api_keys.json"
+IDEMPOTENCY_FILE = "api_idempotency.json"
+# Idempotency keys are remembered this long
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+
+MAX_BATCH_ITEMS = 500
+MAX_BODY_BYTES = 1 << 20
+
+# Same bounds as the UI forms
+REQUEST_UNITS = (1, 10)
+INVENTORY_UNITS = (1, 100)
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def hash_key(api_key):
+    """Keys are stored hashed, so the key file can't be replayed"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def mask_phone(phone):
+    """Same masking as the hospital dashboard's donor tables"""
+    return phone[:3] + "****" + phone[7:] if phone else phone
+
+def check_units(item, bounds):
+    units = item.get("units")
+    if not isinstance(units, int) or isinstance(units, bool) or not bounds[0] <= units <= bounds[1]:
+        raise ValueError(f"units must be an integer {bounds[0]}-{bounds[1]}")
+    return units
+
+def check_blood_type(item):
+    if item.get("blood_type") not in BLOOD_TYPES:
+        raise ValueError(f"blood_type must be one of {', '.join(BLOOD_TYPES)}")
+    return item["blood_type"]
+
+class ApiServer:
+    """asyncio HTTP server over one BloodHub.
+
+    Each call applies the change feed first, runs under a lock (the engine is
+    single-writer) and flushes once at the end, so a batch of N items costs
+    one write per store rather than N. Engine work blocks (the data
+    directory's file lock, fsynced flushes, matching), so it runs on a worker
+    thread: the event loop keeps serving while a Streamlit session holds the
+    data lock. See run_locked.
+    """
+
+    def __init__(self, hub, data_dir="."):
+        self.hub = hub
+        self.repo = hub.repo
+        self.keys_file = f"{data_dir}/{API_KEYS_FILE}"
+        self.idempotency_file = f"{data_dir}/{IDEMPOTENCY_FILE}"
+        self.idempotency = load_data(self.idempotency_file, {})
+        self.lock = asyncio.Lock()
+        self.routes = [
+            ("GET", ("health",), self.health),
+            ("GET", ("metrics",), self.metrics),
+            ("GET", ("requests",), self.list_requests),
+            ("POST", ("requests", "batch"), self.create_requests),
+            ("GET", ("requests", None, "matches"), self.stream_matches),
+            ("POST", ("inventory", "batch"), self.add_inventory),
+        ]
+
+    # ---------- HTTP plumbing ----------
+    async def handle(self, reader, writer):
+        """Serve one request per connection"""
+        try:
+            method, target, headers, body = await self.read_request(reader)
+            url = urlsplit(target)
+            parts = tuple(p for p in url.path.split("/") if p)
+            handler, args = self.route(method, parts)
+            await handler(writer, headers, body, parse_qs(url.query), *args)
+        except HttpError as e:
+            await self.send_json(writer, e.status, {"error": e.message})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            await self.send_json(writer, 500, {"error": str(e)})
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "malformed request line")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    def route(self, method, parts):
+        path_matched = False
+        for route_method, pattern, handler in self.routes:
+            if len(pattern) != len(parts) or any(p is not None and p != q for p, q in zip(pattern, parts)):
+                continue
+            path_matched = True
+            if route_method == method:
+                return handler, [q for p, q in zip(pattern, parts) if p is None]
+        raise HttpError(405 if path_matched else 404, "method not allowed" if path_matched else "not found")
+
+    async def send_json(self, writer, status, payload):
+        body = json.dumps(payload, default=str).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            .encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def start_stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+
+    async def stream_line(self, writer, payload):
+        line = json.dumps(payload, default=str).encode("utf-8") + b"\n"
+        writer.write(f"{len(line):X}\r\n".encode("latin-1") + line + b"\r\n")
+        await writer.drain()
+
+    async def end_stream(self, writer):
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    # ---------- engine calls ----------
+    async def run_locked(self, work, *args):
+        """work(*args) on a worker thread, under self.lock; returns its result or raises its error"""
+        async with self.lock:
+            return await asyncio.to_thread(work, *args)
+
+    # ---------- auth, bodies, idempotency ----------
+    def authenticate(self, headers, roles):
+        """Phone of the approved account behind the bearer key; call through run_locked"""
+        scheme, _, api_key = headers.get("authorization", "").partition(" ")
+        phone = load_data(self.keys_file, {}).get(hash_key(api_key)) if scheme.lower() == "bearer" else None
+        if not phone:
+            raise HttpError(401, "missing or unknown API key")
+        self.repo.poll()
+        user = self.repo["users"].get(phone, {})
+        if user.get("role") not in roles or not self.hub.is_approved(phone):
+            raise HttpError(403, f"only approved {' / '.join(roles)} accounts may call this endpoint")
+        return phone
+
+    def parse_items(self, body, field):
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "body is not valid JSON")
+        items = payload.get(field) if isinstance(payload, dict) else None
+        if not isinstance(items, list) or not items:
+            raise HttpError(400, f'body must be {{"{field}": [...]}} with at least one item')
+        if len(items) > MAX_BATCH_ITEMS:
+            raise HttpError(413, f"at most {MAX_BATCH_ITEMS} items per batch")
+        return items
+
+    def replay(self, headers, phone, endpoint):
+        """(record key, earlier response or None) for the call's Idempotency-Key.
+
+        Call under self.lock, in the same block that does the work and
+        remembers its response: a retry that arrives while the first call
+        is running then waits for the lock and replays that response.
+        """
+        key = headers.get("idempotency-key")
+        if not key:
+            return None, None
+        record_key = f"{phone}|{endpoint}|{key}"
+        now = datetime.now().timestamp()
+        expired = [k for k, v in self.idempotency.items() if now - v["at"] > IDEMPOTENCY_TTL_SECONDS]
+        for k in expired:
+            del self.idempotency[k]
+        previous = self.idempotency.get(record_key)
+        return record_key, previous["response"] if previous else None
+
+    def remember(self, record_key, response):
+        if record_key:
+            self.idempotency[record_key] = {"at": datetime.now().timestamp(), "response": response}
+            save_data(self.idempotency_file, self.idempotency)
+
+    def masked_match(self, match):
+        match = self.hub.describe_match(match)
+        match["phone"] = mask_phone(match["phone"])
+        return match
+
+    # ---------- endpoints ----------
+    async def health(self, writer, headers, body, query):
+        await self.send_json(writer, 200, {"status": "ok"})
+
+    async def metrics(self, writer, headers, body, query):
+        """Prometheus scrape endpoint; like /health it needs no API key"""
+        def work():
+            self.repo.poll()
+            return render_metrics(self.repo).encode("utf-8")
+        body = await self.run_locked(work)
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: {METRICS_CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def list_requests(self, writer, headers, body, query):
+        def work():
+            phone = self.authenticate(headers, ("Hospital",))
+            requests = self.hub.query_requests(requester=phone, statuses=query.get("status"))
+            return [
+                {field: req.get(field) for field in
+                 ("id", "blood_type", "units", "urgency", "status", "created_at", "expires_at", "fulfilled_at")}
+                for req in requests
+            ]
+        summary = await self.run_locked(work)
+        await self.send_json(writer, 200, {"requests": summary})
+
+    async def create_requests(self, writer, headers, body, query):
+        phone = await self.run_locked(self.authenticate, headers, ("Hospital",))
+        items = self.parse_items(body, "requests")
+        lines = []
+        rows = []
+        for index, item in enumerate(items):
+            line = {"index": index, "client_ref": item.get("client_ref") if isinstance(item, dict) else None}
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("each request must be an object")
+                if item.get("urgency") not in URGENCY_LEVELS:
+                    raise ValueError(f"urgency must be one of {', '.join(URGENCY_LEVELS)}")
+                rows.append((check_blood_type(item), check_units(item, REQUEST_UNITS), item["urgency"]))
+            except ValueError as e:
+                line.update(status="error", error=str(e))
+            lines.append(line)
+
+        def work():
+            record_key, previous = self.replay(headers, phone, "requests/batch")
+            if previous is not None:
+                return previous
+            self.repo.poll()
+            try:
+                # One matching pass and one notice per donor for the whole batch
+                results = iter(self.hub.create_requests(phone, rows) if rows else [])
+                for line in lines:
+                    if "status" not in line:
+                        request = next(results)
+                        if isinstance(request, DuplicateRequestError):
+                            line.update(status="error", error=str(request))
+                        else:
+                            line.update(status="created", request_id=request["id"],
+                                        expires_at=request["expires_at"],
+                                        matched_donors=[self.masked_match(d) for d in request["matched_donors"]])
+            finally:
+                # One write per store for the whole batch
+                self.repo.flush()
+            self.remember(record_key, lines)
+            return lines
+        lines = await self.run_locked(work)
+
+        # Only now the 200: a failure above is still answered with a plain error.
+        # If the client disconnects mid-stream, a retry with the same key replays the lines
+        await self.start_stream(writer)
+        for line in lines:
+            await self.stream_line(writer, line)
+        await self.end_stream(writer)
+
+    async def stream_matches(self, writer, headers, body, query, request_id):
+        def work():
+            phone = self.authenticate(headers, ("Hospital", "Blood Bank"))
+            request = self.hub.get_request(int(request_id)) if request_id.isdigit() else None
+            if request is None:
+                raise HttpError(404, f"request {request_id} not found")
+            if self.repo["users"][phone]["role"] == "Hospital" and request["requester"] != phone:
+                raise HttpError(403, "hospitals can only read their own requests")
+            return [self.masked_match(donor) for donor in request["matched_donors"]]
+        donors = await self.run_locked(work)
+        await self.start_stream(writer)
+        for donor in donors:
+            await self.stream_line(writer, donor)
+        await self.end_stream(writer)
+
+    async def add_inventory(self, writer, headers, body, query):
+        phone = await self.run_locked(self.authenticate, headers, ("Hospital", "Blood Bank"))
+        items = self.parse_items(body, "units")
+
+        def work():
+            record_key, previous = self.replay(headers, phone, "inventory/batch")
+            if previous is not None:
+                return previous
+            self.repo.poll()
+            results = []
+            try:
+                for index, item in enumerate(items):
+                    try:
+                        if not isinstance(item, dict):
+                            raise ValueError("each unit must be an object")
+                        expiry = date.fromisoformat(str(item.get("expiry")))
+                        if expiry < date.today():
+                            raise ValueError("expiry is in the past")
+                        donor_phone = item.get("donor_phone") or None
+                        if donor_phone is not None and not (str(donor_phone).isdigit() and len(str(donor_phone)) == 10):
+                            raise ValueError("donor_phone must be a 10-digit number")
+                        inventory_id = self.hub.add_inventory(check_blood_type(item), check_units(item, INVENTORY_UNITS),
+                                                              expiry.isoformat(), phone, donor_phone=donor_phone)
+                        results.append({"index": index, "status": "created", "inventory_id": inventory_id})
+                    except ValueError as e:
+                        results.append({"index": index, "status": "error", "error": str(e)})
+            finally:
+                self.repo.flush()
+            response = {"results": results}
+            self.remember(record_key, response)
+            return response
+        response = await self.run_locked(work)
+        await self.send_json(writer, 200, response)
+
+def build_server(data_dir="."):
+    repo = Repository(data_dir=data_dir).load()
+    hub = BloodHub(repo, compile_locations(load_locations(), registry_path(data_dir)),
+                   send_message=lambda phone, message: print(f"WhatsApp to {phone}: {message}"))
+    return ApiServer(hub, data_dir)
+
+async def serve(host, port, data_dir):
+    api = build_server(data_dir)
+    server = await asyncio.start_server(api.handle, host, port)
+    print(f"BloodHub API listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def add_key(phone, data_dir="."):
+    """Create an API key for an account; only its hash is stored"""
+    users = load_data(f"{data_dir}/users.json", {})
+    if users.get(phone, {}).get("role") not in ("Hospital", "Blood Bank"):
+        raise SystemExit(f"{phone} is not a registered hospital or blood bank")
+    api_key = secrets.token_urlsafe(32)
+    keys_file = f"{data_dir}/{API_KEYS_FILE}"
+    keys = load_data(keys_file, {})
+    keys[hash_key(api_key)] = phone
+    save_data(keys_file, keys)
+    return api_key
+
+def main():
+    parser = argparse.ArgumentParser(description="BloodHub HIS integration API")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_cmd = commands.add_parser("serve")
+    serve_cmd.add_argument("--host", default="127.0.0.1")
+    serve_cmd.add_argument("--port", type=int, default=8502)
+    serve_cmd.add_argument("--data-dir", default=".")
+    key_cmd = commands.add_parser("add-key")
+    key_cmd.add_argument("phone")
+    key_cmd.add_argument("--data-dir", default=".")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port, args.data_dir))
+    else:
+        print(add_key(args.phone, args.data_dir))
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,25 @@
 import streamlit as st
 import random
 import base64
-import csv
-import io
 from datetime import datetime, timedelta
 import pandas as pd
-from utils import load_data, save_data, load_locations
+import functools
+import json
+import os
+from utils import load_locations
+from volunteer_import import import_volunteers
+from locations import compile_locations, registry_path, child_names, location_path, assign_location_ids, get_location_name
+from location_search import build_search_index, search_locations, location_lineage
+from snapshots import available as snapshots_available, snapshot_due, run_snapshot, start_snapshot, load_manifest, export_csv, csv_export_path, SOURCE_FILES as SNAPSHOT_SOURCE_FILES
+from images import process_image
+from perf import timed, timing_report, io_report, reset as reset_perf, ENABLED as PERF_ENABLED
+from memory import track_session, report as memory_report, start_tracing, stop_tracing, take_snapshot, tracing, traced_memory, top_allocations, snapshot_diff, REPORT_PATH as MEMORY_REPORT_PATH
+from metrics import METRICS_FILE, METRICS_PORT, metrics_file_due, write_metrics_file, start_http_server as start_metrics_server
+from rollups import summarize, latency_histogram, iter_rollup_rows, LATENCY_STAGES
+from core import Repository, BloodHub, DuplicateRequestError, StoreCorruptError, rematch_open_requests, BLOOD_TYPES, URGENCY_LEVELS, REQUEST_STATUSES, REQUEST_SORTS, ORGANIZATION_TYPES
+from core.wal import start_checkpoint
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.errors import StreamlitAPIException
 import time
 
 # ================== CONSTANTS ==================
@@ -63,54 +77,86 @@ KERALA_BLOOD_BANKS = [
     "General Hospital Blood Bank, Thalassery"
 ]
 
-BLOOD_TYPES = ["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"]
-URGENCY_LEVELS = {
-    "Normal": {"timeout": 120, "search_radius": "Taluk", "notification": "🔵"},
-    "Urgent": {"timeout": 45, "search_radius": "District", "notification": "🟠"},
-    "Critical": {"timeout": 15, "search_radius": "FullState", "notification": "🔴"}
-}
+# Directory holding the store files (load tests and benchmarks point this at generated data)
+DATA_DIR = os.environ.get("BLOODHUB_DATA_DIR", ".")
 
 # Load Kerala locations from updated JSON
 KERALA_LOCATIONS = load_locations()
+# Integer-coded district/taluk/village table; records store and compare these IDs
+LOCATION_TABLE = compile_locations(KERALA_LOCATIONS, registry_path(DATA_DIR))
+LOCATION_SEARCH = build_search_index(LOCATION_TABLE)
+
+REQUEST_PAGE_SIZE = 10
+# If set, outgoing WhatsApp messages are also appended to this file as NDJSON (local stand-in for the gateway)
+NOTIFY_LOG = os.environ.get("BLOODHUB_NOTIFY_LOG")
+SNAPSHOT_SOURCES = {table: os.path.join(DATA_DIR, filename) for table, filename in SNAPSHOT_SOURCE_FILES.items()}
+
+# Columns shown in the admin user table; blobs (certificates) and notification lists stay out
+USER_TABLE_COLUMNS = [
+    "phone", "role", "name", "district", "taluk", "village", "approved", "profile",
+    "blood_group", "points", "last_donation_date", "organization_type", "email", "employee_id"
+]
+
+# Seconds between background refreshes of live dashboard sections
+LIVE_REFRESH_SECONDS = int(os.environ.get("BLOODHUB_REFRESH_SECONDS", "5"))
+# Requests changed by another session are flagged as new for this long
+RECENT_CHANGE_SECONDS = 60
 
 # ================== HELPER FUNCTIONS ==================
-def has_profile(phone):
-    """Check if user has completed their profile"""
-    return st.session_state.users.get(phone, {}).get("profile", False)
+def poll_changes():
+    """Apply other sessions' writes from the change feed and remember which requests they touched"""
+    changed = REPO.poll()
+    now = time.time()
+    recent = st.session_state.setdefault("recent_requests", {})
+    for request_id in changed.get("requests", ()):
+        if request_id is not None:
+            recent[request_id] = now
+    for request_id in [r for r, seen in recent.items() if now - seen > RECENT_CHANGE_SECONDS]:
+        del recent[request_id]
+    return changed
 
-def is_approved(phone):
-    """Check if user is approved by admin"""
-    user = st.session_state.users.get(phone, {})
-    if user.get("role") in ["Hospital", "Blood Bank"]:
-        return user.get("approved", False)
-    return True  # Always approved for other roles
+def latest_transfer(transfer):
+    """The current copy of a transfer; call inside REPO.transaction after its poll"""
+    return next((t for t in st.session_state.transfers if t["id"] == transfer["id"]), transfer)
 
-def donor_in_cooldown(phone):
-    """Check if donor is in cooldown period"""
-    if st.session_state.red_alert:
-        return False  # Bypass cooldown during red alert
-    
-    donor = st.session_state.users.get(phone, {})
-    if donor.get("cooldown_override", False):
-        return False
-    
-    last_donation = donor.get("last_donation_date")
-    if not last_donation:
-        return False
-    
-    if isinstance(last_donation, str):
-        last_donation = datetime.fromisoformat(last_donation)
-    
-    return (datetime.now() - last_donation).days < 90
+def new_badge(request):
+    """Marker for requests another session created or changed in the last minute"""
+    return "🆕 " if request["id"] in st.session_state.get("recent_requests", {}) else ""
+
+def live_fragment(render):
+    """Turn a dashboard section into a fragment that follows the change feed.
+
+    The fragment reruns on its own every LIVE_REFRESH_SECONDS; a stat() of the
+    change log is all the poll costs until another session writes, and then
+    only the changed records are applied. Its buttons call rerun_fragment()
+    instead of re-executing the whole page.
+    """
+    @st.fragment(run_every=LIVE_REFRESH_SECONDS)
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        poll_changes()
+        try:
+            render(*args, **kwargs)
+        finally:
+            # Fragment reruns skip main(), so flush here as well
+            REPO.flush()
+    return wrapper
+
+def rerun_fragment():
+    """Rerun just the current fragment; the whole page if the fragment is running as part of it.
+
+    Streamlit only allows a fragment-scoped rerun during a fragment rerun, and
+    a click can arrive with a full rerun instead (always so under AppTest).
+    """
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
 
 def generate_otp():
     """Generate a 6-digit OTP"""
     return str(random.randint(100000, 999999))
 
-def get_location_name(district, taluk, village):
-    """Get formatted location name"""
-    return f"{village}, {taluk}, {district}" if village else f"{taluk}, {district}"
-
 def get_request_timeout(urgency):
     """Get timeout duration for a request"""
     return URGENCY_LEVELS[urgency]["timeout"]
@@ -123,29 +169,17 @@ def format_timedelta(delta):
     minutes, seconds = divmod(remainder, 60)
     return f"{hours}h {minutes}m"
 
-def display_image(image_data):
-    """Display image from base64 string"""
-    if image_data:
-        st.image(f"data:image;base64,{image_data}", 
-                caption="Certificate/Test Report", 
-                width=300)
-
-def clean_expired_inventory():
-    """Remove expired blood units from inventory"""
-    now = datetime.now().date()
-    cleaned_inventory = []
-    
-    for item in st.session_state.inventory:
-        if "expiry" in item:
-            expiry_date = datetime.fromisoformat(item["expiry"]).date()
-            if expiry_date >= now:
-                cleaned_inventory.append(item)
-    
-    if len(cleaned_inventory) != len(st.session_state.inventory):
-        st.session_state.inventory = cleaned_inventory
-        save_data("inventory.json", st.session_state.inventory)
-        return True
-    return False
+def display_image(image_data, thumbnail=None, key=None):
+    """Display a base64 image as its thumbnail, with the full image behind a toggle when key is given"""
+    if not image_data:
+        return
+    if not thumbnail:
+        # Records from before thumbnails were generated
+        st.image(base64.b64decode(image_data), caption="Certificate/Test Report", width=300)
+        return
+    st.image(base64.b64decode(thumbnail), caption="Certificate/Test Report")
+    if key and st.toggle("Show full image", key=key):
+        st.image(base64.b64decode(image_data))
 
 def get_donor_badge(points):
     """Determine donor badge based on points"""
@@ -157,32 +191,6 @@ def get_donor_badge(points):
         return "🥉 Bronze", "#CD7F32", "Donated at least once"
     return "🌟 New Donor", "#1E90FF", "Just getting started"
 
-def notify_admins(message):
-    """Store notification for admins"""
-    for phone, user in st.session_state.users.items():
-        if user.get("role") == "Admin":
-            if "notifications" not in user:
-                user["notifications"] = []
-            user["notifications"].append({
-                "message": message,
-                "timestamp": datetime.now().isoformat(),
-                "read": False
-            })
-    save_data("users.json", st.session_state.users)
-
-def check_inventory_alerts():
-    """Check inventory levels and notify admins if low"""
-    inventory_df = pd.DataFrame(st.session_state.inventory)
-    if inventory_df.empty:
-        return
-    
-    # Group by blood type and sum units
-    inventory_by_type = inventory_df.groupby("blood_type")["units"].sum().reset_index()
-    
-    for _, row in inventory_by_type.iterrows():
-        if row["units"] < 5:  # Threshold for low inventory
-            notify_admins(f"⚠️ Low inventory for {row['blood_type']} - only {row['units']} units left")
-
 def generate_inventory_forecast():
     """Generate fake inventory forecast data"""
     forecast = []
@@ -209,23 +217,137 @@ def send_whatsapp_notification(phone, message):
     """Simulate sending WhatsApp notification (Twilio integration would go here)"""
     # In a real implementation, this would use the Twilio API
     st.info(f"WhatsApp notification sent to {phone}: {message}")
+    if NOTIFY_LOG:
+        with open(NOTIFY_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"phone": phone, "message": message, "at": datetime.now().isoformat()}) + "\n")
     return True
 
-def generate_unique_id(prefix):
-    """Generate unique ID for inventory items"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    random_str = ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
-    return f"{prefix}-{timestamp}-{random_str}"
+def request_board_filters(key, statuses=None):
+    """Render status/urgency/sort controls for a request board"""
+    cols = st.columns(3)
+    selected_statuses = None
+    if statuses:
+        selected_statuses = cols[0].multiselect("Status", statuses, default=statuses, key=f"{key}_status")
+    urgencies = cols[1].multiselect("Urgency", list(URGENCY_LEVELS), default=list(URGENCY_LEVELS), key=f"{key}_urgency")
+    sort_by = cols[2].selectbox("Sort by", list(REQUEST_SORTS), key=f"{key}_sort")
+    return selected_statuses, urgencies, sort_by
+
+def paginate(items, key, page_size=REQUEST_PAGE_SIZE):
+    """Render a page picker and return only the items on the selected page"""
+    pages = max(1, -(-len(items) // page_size))
+    page = 1
+    if pages > 1:
+        page_key = f"{key}_page"
+        # Clamp a stale page number before the widget reads it (e.g. after filtering)
+        if st.session_state.get(page_key, 1) > pages:
+            st.session_state[page_key] = pages
+        page = st.number_input(f"Page (1-{pages})", min_value=1, max_value=pages, step=1, key=page_key)
+    start = (page - 1) * page_size
+    if items:
+        st.caption(f"Showing {start + 1}-{min(start + page_size, len(items))} of {len(items)}")
+    return items[start:start + page_size]
+
+def apply_location_suggestion(key, options):
+    """Fill the district/taluk/village pickers from the chosen search suggestion"""
+    location_id = options.get(st.session_state[f"{key}_suggestion"])
+    if location_id:
+        district, taluk, village = location_lineage(LOCATION_TABLE, location_id)
+        st.session_state[f"{key}_district"] = district
+        st.session_state[f"{key}_taluk"] = taluk
+        st.session_state[f"{key}_village"] = village
+
+def location_picker(key):
+    """Searchable district → taluk → village selectboxes backed by the compiled location table"""
+    query = st.text_input("🔎 Search village or taluk", key=f"{key}_search", placeholder="e.g. Tiruvalla")
+    if query:
+        options = {
+            get_location_name(*reversed(location_lineage(LOCATION_TABLE, location_id))): location_id
+            for location_id, _ in search_locations(LOCATION_SEARCH, query, limit=8)
+        }
+        if options:
+            st.selectbox("Suggestions", [""] + list(options), key=f"{key}_suggestion",
+                         on_change=apply_location_suggestion, args=(key, options))
+        else:
+            st.caption("No matching places")
+    
+    district = st.selectbox("District", child_names(LOCATION_TABLE), key=f"{key}_district")
+    district_id = LOCATION_TABLE["path_ids"].get(location_path(district))
+    taluks = child_names(LOCATION_TABLE, district_id)
+    # Drop a selection left over from another district/taluk before the widget reads it
+    if st.session_state.get(f"{key}_taluk") not in taluks:
+        st.session_state.pop(f"{key}_taluk", None)
+    taluk = st.selectbox("Taluk", taluks, key=f"{key}_taluk")
+    taluk_id = LOCATION_TABLE["path_ids"].get(location_path(district, taluk))
+    villages = [""] + child_names(LOCATION_TABLE, taluk_id)
+    if st.session_state.get(f"{key}_village") not in villages:
+        st.session_state.pop(f"{key}_village", None)
+    village = st.selectbox("Village", villages, key=f"{key}_village")
+    return district, taluk, village
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def build_user_table(version, _users):
+    """Admin user table for one users-store version, shared read-only across sessions"""
+    return pd.DataFrame(
+        [[phone] + [info.get(column) for column in USER_TABLE_COLUMNS[1:]] for phone, info in _users.items()],
+        columns=USER_TABLE_COLUMNS
+    )
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def build_request_analytics(version, _rollups):
+    """Admin charts for one rollups-store version; cost depends on the rollup size, not the request history"""
+    by_hour = {int(hour): count for hour, count in summarize(_rollups, "hour").items()}
+    by_district = {
+        LOCATION_TABLE["names"].get(int(district_id), "Unknown") if district_id.isdigit() else "Unknown": count
+        for district_id, count in summarize(_rollups, "district_id").items()
+    }
+    return {
+        "by_hour": pd.Series(by_hour, dtype=int).sort_index(),
+        "by_blood_type": pd.Series(summarize(_rollups, "blood_type"), dtype=int).sort_values(ascending=False),
+        "by_district": pd.Series(by_district, dtype=int).sort_values(ascending=False),
+        "pending": summarize(_rollups, "status").get("Pending", 0),
+        "latency": {
+            stage: pd.Series(dict(latency_histogram(_rollups, stage)), dtype=int)
+            for stage in LATENCY_STAGES
+        },
+        "csv": pd.DataFrame(list(iter_rollup_rows(_rollups))).to_csv(index=False).encode("utf-8")
+    }
 
 # ================== CORE FUNCTIONS ==================
+# The engine keeps its stores in st.session_state, which always resolves to the current session
+REPO = Repository(st.session_state, data_dir=DATA_DIR)
+HUB = BloodHub(REPO, LOCATION_TABLE, send_message=send_whatsapp_notification)
+
+def session_mapping(state):
+    """A tracked SessionState as a plain {key: value} dict"""
+    return state.filtered_state
+
+def memory_page():
+    return "application/json", json.dumps(memory_report(as_mapping=session_mapping), default=str)
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_endpoint(port):
+    """One /metrics endpoint per server process, with its own change-feed-synced copy of the stores"""
+    return start_metrics_server(port, repo_factory=lambda: Repository(data_dir=DATA_DIR).load(),
+                                routes={MEMORY_REPORT_PATH: memory_page})
+
+def track_memory():
+    """Register this browser session with the memory report"""
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        # ctx.session_state is a wrapper rebuilt on every rerun; track the SessionState it wraps
+        track_session(ctx.session_id, getattr(ctx.session_state, "_state", ctx.session_state))
+
 def init_session_state():
     """Initialize all session state variables"""
+    # Parse each store once per session rather than on every rerun
+    try:
+        REPO.load()
+    except StoreCorruptError as error:
+        # Nothing to rebuild it from; running on would show (and save) the store as empty
+        st.error(f"⚠️ {error}. Restore it from a backup, then reload the page.")
+        st.stop()
+    
     defaults = {
-        "users": load_data("users.json", {}),
-        "requests": load_data("requests.json", []),
-        "inventory": load_data("inventory.json", []),
-        "red_alert": load_data("red_alert.json", False),
-        "request_counter": load_data("request_counter.json", 0),
         "stage": "enter_phone",
         "logged_in": False,
         "phone": "",
@@ -238,205 +360,15 @@ def init_session_state():
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
-
-def find_matching_donors(request):
-    """Hierarchical donor matching: Village → Taluk → District → State"""
-    matched_donors = []
-    req_district = request["district"]
-    req_taluk = request["taluk"]
-    req_village = request.get("village", "")
-    search_scope = URGENCY_LEVELS[request["urgency"]]["search_radius"]
-    
-    for phone, user in st.session_state.users.items():
-        if user.get("role") != "Donor" or user.get("blood_group") != request["blood_type"]:
-            continue
-            
-        if donor_in_cooldown(phone):
-            continue
-            
-        # Skip if not in the same district unless search_scope is FullState
-        if search_scope != "FullState" and user.get("district") != req_district:
-            continue
-            
-        # Check Village level
-        if search_scope == "Taluk" and req_village and user.get("village") == req_village:
-            distance = "0-5km"
-            priority = 1
-        # Check Taluk level
-        elif search_scope == "Taluk" and user.get("taluk") == req_taluk:
-            distance = "5-10km"
-            priority = 2
-        # District level
-        elif search_scope == "District" and user.get("district") == req_district:
-            distance = "10-20km"
-            priority = 3
-        # Full state
-        else:
-            distance = "20+ km"
-            priority = 4
-            
-        matched_donors.append({
-            "phone": phone,
-            "name": user.get("name", ""),
-            "location": get_location_name(user.get("district", ""), user.get("taluk", ""), user.get("village", "")),
-            "distance": distance,
-            "priority": priority
-        })
-    
-    # Sort by priority (closest first)
-    matched_donors.sort(key=lambda x: x["priority"])
-    return matched_donors
-
-def create_blood_request(requester_phone, blood_type, units, urgency):
-    """Create a new blood request with atomic locking"""
-    # Check for duplicate requests
-    now = datetime.now()
-    for req in st.session_state.requests:
-        if (req["requester"] == requester_phone and 
-            req["blood_type"] == blood_type and 
-            req["status"] == "Pending" and 
-            (now - datetime.fromisoformat(req["created_at"])).total_seconds() < 3600):  # 1 hour cooldown
-            st.error("You already have a pending request for this blood type. Please wait before creating a new one.")
-            return None
-    
-    requester = st.session_state.users.get(requester_phone, {})
-    new_request = {
-        "id": st.session_state.request_counter + 1,
-        "requester": requester_phone,
-        "blood_type": blood_type,
-        "units": units,
-        "urgency": urgency,
-        "status": "Pending",
-        "district": requester.get("district", ""),
-        "taluk": requester.get("taluk", ""),
-        "village": requester.get("village", ""),
-        "created_at": datetime.now().isoformat(),
-        "expires_at": (datetime.now() + timedelta(minutes=URGENCY_LEVELS[urgency]["timeout"])).isoformat(),
-        "matched_donors": [],
-        "pledged_donors": [],  # Donors who have pledged to donate
-        "inventory_ids": [],    # Stores inventory IDs for fulfilled units
-        "test_results": {}      # Stores test results keyed by inventory ID
-    }
-    
-    st.session_state.requests.append(new_request)
-    st.session_state.request_counter += 1
-    
-    # Find matching donors
-    new_request["matched_donors"] = find_matching_donors(new_request)
-    
-    save_data("requests.json", st.session_state.requests)
-    save_data("request_counter.json", st.session_state.request_counter)
-    
-    # Notify donors if critical
-    if urgency == "Critical":
-        notify_donors(new_request["id"])
-    
-    # Notify nearby blood banks if hospital creates request
-    if st.session_state.users.get(requester_phone, {}).get("role") == "Hospital":
-        notify_nearby_blood_banks(new_request["id"])
-    
-    return new_request["id"]
-
-def notify_donors(request_id):
-    """Notify matched donors about a critical request"""
-    request = next((r for r in st.session_state.requests if r["id"] == request_id), None)
-    if not request:
-        return
-    
-    for donor in request["matched_donors"]:
-        donor_phone = donor["phone"]
-        donor_user = st.session_state.users.get(donor_phone, {})
-        if "notifications" not in donor_user:
-            donor_user["notifications"] = []
-        
-        notification = {
-            "type": "critical_request",
-            "request_id": request_id,
-            "blood_type": request["blood_type"],
-            "units": request["units"],
-            "location": get_location_name(request["district"], request["taluk"], request.get("village", "")),
-            "timestamp": datetime.now().isoformat(),
-            "read": False
-        }
-        
-        donor_user["notifications"].append(notification)
-        
-        # Send WhatsApp notification
-        message = (f"URGENT: Blood request for {request['blood_type']} at {notification['location']}. "
-                  f"{request['units']} units needed. Please check the Kerala Blood Hub app to pledge.")
-        send_whatsapp_notification(donor_phone, message)
     
-    save_data("users.json", st.session_state.users)
-
-def notify_nearby_blood_banks(request_id):
-    """Notify nearby blood banks about a hospital request"""
-    request = next((r for r in st.session_state.requests if r["id"] == request_id), None)
-    if not request:
-        return
+    track_memory()
+    if METRICS_PORT:
+        start_metrics_endpoint(int(METRICS_PORT))
     
-    for phone, user in st.session_state.users.items():
-        if (user.get("role") == "Blood Bank" and 
-            user.get("district") == request["district"] and 
-            user.get("approved", False)):
-            
-            if "notifications" not in user:
-                user["notifications"] = []
-                
-            user["notifications"].append({
-                "type": "hospital_request",
-                "request_id": request_id,
-                "blood_type": request["blood_type"],
-                "units": request["units"],
-                "location": get_location_name(request["district"], request["taluk"], request.get("village", "")),
-                "timestamp": datetime.now().isoformat(),
-                "read": False
-            })
-    
-    save_data("users.json", st.session_state.users)
-
-def add_to_inventory(request_id, donor_phone, units=1, test_report=None):
-    """Add donated blood to inventory with tracking"""
-    request = next((r for r in st.session_state.requests if r["id"] == request_id), None)
-    if not request:
-        return False
-    
-    donor = st.session_state.users.get(donor_phone, {})
-    
-    # Generate unique inventory IDs for each unit
-    inventory_ids = []
-    for i in range(units):
-        inventory_id = generate_unique_id("INV")
-        st.session_state.inventory.append({
-            "id": inventory_id,
-            "blood_type": donor.get("blood_group", ""),
-            "units": 1,  # Each donation is 1 unit
-            "expiry": (datetime.now() + timedelta(days=42)).isoformat(),  # 6-week expiry
-            "added_by": st.session_state.phone,  # Blood bank/hospital that processed it
-            "added_at": datetime.now().isoformat(),
-            "donor_phone": donor_phone,
-            "request_id": request_id,
-            "test_report": test_report  # Base64 of test result if provided
-        })
-        inventory_ids.append(inventory_id)
-        request["inventory_ids"].append(inventory_id)
-    
-    # Store test result if provided
-    if test_report:
-        request["test_results"][inventory_id] = test_report
-    
-    # Update request status
-    if len(request["inventory_ids"]) >= request["units"]:
-        request["status"] = "Fulfilled"
-    
-    # Update donor points
-    donor["points"] = donor.get("points", 0) + (10 * units)
-    donor["last_donation_date"] = datetime.now().isoformat()
-    
-    save_data("inventory.json", st.session_state.inventory)
-    save_data("requests.json", st.session_state.requests)
-    save_data("users.json", st.session_state.users)
-    
-    return True
+    # A no-op once the data directory is at the current migration version
+    if not st.session_state.get("migrations_checked"):
+        HUB.run_migrations()
+        st.session_state.migrations_checked = True
 
 # ================== UI COMPONENTS ==================
 def show_header():
@@ -519,7 +451,7 @@ def phone_login():
                 user_data = st.session_state.users[phone]
                 
                 # If user has completed profile, log them in directly
-                if has_profile(phone):
+                if HUB.has_profile(phone):
                     st.session_state.update({
                         "logged_in": True,
                         "phone": phone,
@@ -543,8 +475,7 @@ def phone_login():
                     "otp": otp,
                     "stage": "enter_otp"
                 })
-                st.session_state.users[phone] = {"role": role}
-                save_data("users.json", st.session_state.users)
+                HUB.register_user(phone, role)
                 st.success(f"OTP sent to {phone}: {st.session_state.otp}")
         else:
             st.error("Please enter a valid 10-digit mobile number")
@@ -556,7 +487,7 @@ def otp_verification():
     
     if st.button("Verify", type="primary"):
         if user_otp == st.session_state.otp:
-            if not has_profile(st.session_state.phone):
+            if not HUB.has_profile(st.session_state.phone):
                 st.session_state.stage = "complete_profile"
                 st.success("OTP verified! Complete your profile")
             else:
@@ -584,21 +515,14 @@ def complete_profile():
         
     else:
         # Location selection for non-admins
-        district = st.selectbox("District", list(KERALA_LOCATIONS.keys()))
-        district_data = KERALA_LOCATIONS.get(district, {})
-        taluks = district_data.get("taluks", [])
-        taluk = st.selectbox("Taluk", taluks)
-        
-        # Get villages for selected taluk
-        villages_dict = district_data.get("villages", {})
-        villages = villages_dict.get(taluk, [])
-        village = st.selectbox("Village", [""] + villages)
+        district, taluk, village = location_picker("profile")
         
         user_data.update({
             "district": district, 
             "taluk": taluk,
             "village": village if village else None
         })
+        assign_location_ids(LOCATION_TABLE, user_data)
         
         # Role-specific fields
         if st.session_state.role in ["Hospital", "Blood Bank"]:
@@ -622,8 +546,8 @@ def complete_profile():
             )
             
             if certificate is not None:
-                # Store as base64 string
-                user_data["certificate"] = base64.b64encode(certificate.getvalue()).decode("utf-8")
+                # Store a size-capped copy plus a thumbnail for the approval list
+                user_data["certificate"], user_data["certificate_thumbnail"] = process_image(certificate.getvalue())
                 st.success("Certificate uploaded successfully!")
             
             # Initially not approved
@@ -674,17 +598,19 @@ def complete_profile():
             
         elif st.session_state.role == "Organization":
             user_data["name"] = st.text_input("Organization Name")
-            user_data["organization_type"] = st.selectbox(
-                "Organization Type", 
-                ["NGO", "NSS", "NCC", "Red Cross", "Educational Institution", "Other"]
-            )
+            user_data["organization_type"] = st.selectbox("Organization Type", ORGANIZATION_TYPES)
     
     if st.button("Save Profile", type="primary"):
         if st.session_state.role == "Donor" and not st.session_state.get("declaration", False):
             st.error("You must accept the health declaration to register as a donor")
         else:
-            user_data["profile"] = True
-            save_data("users.json", st.session_state.users)
+            with REPO.transaction(poll_changes):
+                # The poll may have swapped in a newer copy of the record (a notification, say): keep the form's fields
+                user = st.session_state.users[phone]
+                if user is not user_data:
+                    user.update((key, value) for key, value in user_data.items() if key != "notifications")
+                user["profile"] = True
+                REPO.mark_dirty("users", phone)
             
             if st.session_state.role in ["Hospital", "Blood Bank"]:
                 st.success("✅ Profile submitted for admin approval. You'll be notified when approved.")
@@ -706,7 +632,33 @@ def show_dashboard():
         st.warning("⚠️ Your account is pending admin approval. You cannot create requests until approved.")
         return
     
-    # Check for notifications
+    show_notifications()
+    
+    if st.session_state.role == "Hospital":
+        show_hospital_dashboard()
+    elif st.session_state.role == "Blood Bank":
+        show_blood_bank_dashboard()
+    elif st.session_state.role == "Donor":
+        show_donor_dashboard()
+    elif st.session_state.role == "Organization":
+        show_organization_dashboard()
+    elif st.session_state.role == "Admin":
+        show_admin_dashboard()
+    
+    # Single logout button at the end
+    st.divider()
+    if st.button("Logout", key="logout", use_container_width=True, type="primary"):
+        for key in ["logged_in", "phone", "role", "otp", "focus_request"]:
+            if key in st.session_state:
+                del st.session_state[key]
+        st.session_state.stage = "enter_phone"
+        st.rerun()
+
+@live_fragment
+@timed()
+def show_notifications():
+    """Unread notifications for the logged-in user, refreshed in place"""
+    user = st.session_state.users.get(st.session_state.phone, {})
     if user.get("notifications"):
         unread = sum(1 for n in user["notifications"] if not n.get("read", False))
         if unread > 0:
@@ -721,9 +673,13 @@ def show_dashboard():
                         cols[1].write(f"**Critical Blood Request!**")
                         cols[1].write(f"Type: {note['blood_type']} | Units: {note['units']}")
                         cols[1].write(f"Location: {note['location']}")
+                        if note.get("request_ids"):
+                            cols[1].write(f"Requests: {', '.join(f'#{i}' for i in note['request_ids'])}")
+                        if note.get("volunteers"):
+                            cols[1].write(f"Matching volunteers: {', '.join(note['volunteers'])}")
                         if cols[1].button("View Request", key=f"view_req_{note['request_id']}"):
-                            note["read"] = True
-                            save_data("users.json", st.session_state.users)
+                            with REPO.transaction(poll_changes):
+                                HUB.mark_notifications_read(st.session_state.phone, [i])
                             # Focus on request in donor dashboard
                             st.session_state.focus_request = note["request_id"]
                             st.rerun()
@@ -732,9 +688,11 @@ def show_dashboard():
                         cols[1].write(f"**Hospital Blood Request**")
                         cols[1].write(f"Type: {note['blood_type']} | Units: {note['units']}")
                         cols[1].write(f"Location: {note['location']}")
+                        if note.get("request_ids"):
+                            cols[1].write(f"Requests: {', '.join(f'#{i}' for i in note['request_ids'])}")
                         if cols[1].button("View Request", key=f"view_hosp_req_{note['request_id']}"):
-                            note["read"] = True
-                            save_data("users.json", st.session_state.users)
+                            with REPO.transaction(poll_changes):
+                                HUB.mark_notifications_read(st.session_state.phone, [i])
                             st.session_state.focus_request = note["request_id"]
                             st.rerun()
                     else:
@@ -744,31 +702,11 @@ def show_dashboard():
                     st.divider()
                     
                 if st.button("Mark all as read"):
-                    for note in user["notifications"]:
-                        note["read"] = True
-                    save_data("users.json", st.session_state.users)
-                    st.rerun()
-    
-    if st.session_state.role == "Hospital":
-        show_hospital_dashboard()
-    elif st.session_state.role == "Blood Bank":
-        show_blood_bank_dashboard()
-    elif st.session_state.role == "Donor":
-        show_donor_dashboard()
-    elif st.session_state.role == "Organization":
-        show_organization_dashboard()
-    elif st.session_state.role == "Admin":
-        show_admin_dashboard()
-    
-    # Single logout button at the end
-    st.divider()
-    if st.button("Logout", key="logout", use_container_width=True, type="primary"):
-        for key in ["logged_in", "phone", "role", "otp", "focus_request"]:
-            if key in st.session_state:
-                del st.session_state[key]
-        st.session_state.stage = "enter_phone"
-        st.rerun()
+                    with REPO.transaction(poll_changes):
+                        HUB.mark_notifications_read(st.session_state.phone)
+                    rerun_fragment()
 
+@timed()
 def show_hospital_dashboard():
     st.markdown('<h3 class="section-title">🏥 Hospital Dashboard</h3>', unsafe_allow_html=True)
     user = st.session_state.users.get(st.session_state.phone, {})
@@ -782,24 +720,32 @@ def show_hospital_dashboard():
         submitted = st.form_submit_button("Submit Request", type="primary")
         
         if submitted:
-            request_id = create_blood_request(st.session_state.phone, blood_type, units, urgency)
-            if request_id:
-                st.success(f"✅ Request #{request_id} created successfully! Matching donors...")
+            try:
+                request = HUB.create_request(st.session_state.phone, blood_type, units, urgency)
+                st.success(f"✅ Request #{request['id']} created successfully! Matching donors...")
                 st.balloons()
+            except DuplicateRequestError as e:
+                st.error(str(e))
+    
+    with st.expander("🚑 Bulk Requests (mass-casualty)"):
+        show_bulk_request_form()
     
     st.divider()
     st.write("### 📋 Your Active Requests")
-    hospital_requests = [r for r in st.session_state.requests if r.get("requester") == st.session_state.phone]
+    statuses, urgencies, sort_by = request_board_filters("hospital_board", REQUEST_STATUSES)
+    hospital_requests = HUB.query_requests(
+        requester=st.session_state.phone, statuses=statuses, urgencies=urgencies, sort_by=sort_by
+    )
     
     if not hospital_requests:
         st.info("No active requests")
     else:
-        for req in sorted(hospital_requests, key=lambda x: x["created_at"], reverse=True):
+        for req in paginate(hospital_requests, "hospital_board"):
             created_time = datetime.fromisoformat(req["created_at"])
             expires_time = datetime.fromisoformat(req["expires_at"])
             time_left = expires_time - datetime.now()
             
-            with st.expander(f"Request #{req['id']}: {req['units']} units {req['blood_type']} "
+            with st.expander(f"{new_badge(req)}Request #{req['id']}: {req['units']} units {req['blood_type']} "
                             f"{URGENCY_LEVELS[req['urgency']]['notification']} {req['urgency']} - {req['status']}"):
                 cols = st.columns(2)
                 cols[0].metric("Created", created_time.strftime("%d %b %Y, %H:%M"))
@@ -810,8 +756,10 @@ def show_hospital_dashboard():
                 if req["status"] == "Pending":
                     st.warning("Awaiting donor response")
                     if st.button(f"Cancel Request", key=f"cancel_{req['id']}"):
-                        req["status"] = "Cancelled"
-                        save_data("requests.json", st.session_state.requests)
+                        with REPO.transaction(poll_changes):
+                            cancelled = HUB.cancel_request(HUB.get_request(req["id"]))
+                        if not cancelled:
+                            st.warning("This request has moved on and can no longer be cancelled")
                         st.rerun()
                 elif req["status"] == "Partially Fulfilled":
                     st.warning("Partially fulfilled - still need donors")
@@ -827,16 +775,19 @@ def show_hospital_dashboard():
                                                   type=["png"], 
                                                   key=f"test_report_{req['id']}")
                     
-                    units_to_add = st.number_input("Units to Add", 1, req["units"], 1)
+                    units_to_add = st.number_input("Units to Add", 1, req["units"], 1, key=f"units_to_add_{req['id']}")
                     
                     if st.button(f"Add to Inventory", key=f"fulfill_{req['id']}"):
-                        # Convert test report to base64 if provided
-                        test_report_base64 = None
+                        # Compress test report and make its thumbnail if provided
+                        test_report_base64, test_report_thumbnail = None, None
                         if test_report:
-                            test_report_base64 = base64.b64encode(test_report.getvalue()).decode("utf-8")
+                            test_report_base64, test_report_thumbnail = process_image(test_report.getvalue())
                         
                         # Add to inventory
-                        if add_to_inventory(req["id"], donor_phone, units_to_add, test_report_base64):
+                        with REPO.transaction(poll_changes):
+                            added = HUB.add_to_inventory(req["id"], donor_phone, st.session_state.phone, units_to_add,
+                                                         test_report_base64, test_report_thumbnail)
+                        if added:
                             st.success("Blood added to inventory successfully!")
                             st.balloons()
                             st.rerun()
@@ -850,48 +801,110 @@ def show_hospital_dashboard():
                 st.write(f"**Matched Donors:** {len(req['matched_donors'])}")
                 st.write(f"**Pledged Donors:** {len(req['pledged_donors'])}")
                 
-                if req["matched_donors"]:
+                # Donor tables are only built for requests the user opens
+                show_donors = (req["matched_donors"] or req["pledged_donors"]) and st.toggle(
+                    "Show donor details", key=f"donor_details_{req['id']}"
+                )
+                
+                if show_donors and req["matched_donors"]:
                     st.write("#### Potential Donors")
-                    df = pd.DataFrame(req["matched_donors"])
+                    df = pd.DataFrame([HUB.describe_match(donor) for donor in req["matched_donors"]])
                     # Include phone number for hospitals/blood banks
                     df["phone"] = df["phone"].apply(lambda x: x[:3] + "****" + x[7:])
                     st.dataframe(df.drop(columns=['priority']))
                 
-                if req["pledged_donors"]:
+                if show_donors and req["pledged_donors"]:
                     st.write("#### Committed Donors")
                     df = pd.DataFrame(req["pledged_donors"])
                     df["phone"] = df["phone"].apply(lambda x: x[:3] + "****" + x[7:])
                     st.dataframe(df)
 
+def parse_request_rows(rows_df):
+    """(blood_type, units, urgency) rows from a bulk request table, with one merged row per blood type.
+
+    Returns (rows, errors); blank rows are skipped, and rows repeating a blood
+    type are added up and keep the highest urgency, since only one pending
+    request per blood type is allowed. The sum must stay within the 10 units
+    a single request can ask for.
+    """
+    merged = {}
+    errors = []
+    urgency_order = list(URGENCY_LEVELS)
+    urgency_names = {name.lower(): name for name in urgency_order}
+    for number, row in enumerate(rows_df.fillna("").to_dict("records"), start=1):
+        blood_type = str(row.get("blood_type", "")).strip().upper()
+        units = str(row.get("units", "")).strip()
+        urgency = urgency_names.get(str(row.get("urgency", "")).strip().lower())
+        if not (blood_type or units):
+            continue
+        try:
+            count = float(units)
+        except ValueError:
+            count = 0.0
+        if blood_type not in BLOOD_TYPES:
+            errors.append(f"Row {number}: unknown blood type '{row.get('blood_type', '')}'")
+        elif not count.is_integer() or not 1 <= count <= 10:
+            errors.append(f"Row {number}: units must be a whole number from 1 to 10")
+        elif urgency is None:
+            errors.append(f"Row {number}: urgency must be one of {', '.join(urgency_order)}")
+        elif blood_type in merged:
+            _, total, current = merged[blood_type]
+            if total + count > 10:
+                errors.append(f"Row {number}: {blood_type} rows add up to {total + int(count)} units; "
+                              "one request can ask for at most 10")
+            else:
+                merged[blood_type] = (blood_type, total + int(count), max(current, urgency, key=urgency_order.index))
+        else:
+            merged[blood_type] = (blood_type, int(count), urgency)
+    return list(merged.values()), errors
+
+def show_bulk_request_form():
+    """Many requests in one submission: typed into a table or uploaded as CSV, matched and saved together"""
+    st.caption("One row per blood type; rows for the same blood type are merged, up to 10 units. "
+               "CSV columns: blood_type, units, urgency")
+    csv_file = st.file_uploader("Upload CSV", type=["csv"], key="bulk_request_csv")
+    if csv_file is not None:
+        rows_df = pd.read_csv(csv_file, dtype=str).rename(columns=lambda c: c.strip().lower())
+        rows_df = rows_df.reindex(columns=["blood_type", "units", "urgency"])
+    else:
+        rows_df = pd.DataFrame({"blood_type": ["O+"], "units": ["1"], "urgency": ["Urgent"]})
+    
+    edited_df = st.data_editor(
+        rows_df.fillna(""), num_rows="dynamic", use_container_width=True,
+        key=f"bulk_request_rows_{csv_file.name if csv_file is not None else 'manual'}",
+        column_config={
+            "blood_type": st.column_config.SelectboxColumn("Blood Type", options=BLOOD_TYPES),
+            "units": st.column_config.TextColumn("Units"),
+            "urgency": st.column_config.SelectboxColumn("Urgency", options=list(URGENCY_LEVELS))
+        }
+    )
+    
+    if st.button("Submit All Requests", type="primary", key="submit_bulk_requests"):
+        rows, errors = parse_request_rows(edited_df)
+        for error in errors:
+            st.error(error)
+        if errors or not rows:
+            if not errors:
+                st.warning("Add at least one request")
+            return
+        results = HUB.create_requests(st.session_state.phone, rows)
+        created = [r for r in results if not isinstance(r, DuplicateRequestError)]
+        skipped = [row[0] for row, r in zip(rows, results) if isinstance(r, DuplicateRequestError)]
+        if created:
+            ids = ", ".join(f"#{request['id']}" for request in created)
+            st.success(f"✅ {len(created)} requests created: {ids}. Matching donors...")
+        if skipped:
+            st.warning(f"Skipped {', '.join(skipped)}: you already have a recent pending request for "
+                       f"{'this blood type' if len(skipped) == 1 else 'these blood types'}")
+
+@timed()
 def show_blood_bank_dashboard():
     st.markdown('<h3 class="section-title">🏪 Blood Bank Dashboard</h3>', unsafe_allow_html=True)
     user = st.session_state.users.get(st.session_state.phone, {})
     
-    # Clean expired inventory
-    if clean_expired_inventory():
-        st.warning("Expired blood units have been removed from inventory")
+    show_inventory_summary()
     
-    # Inventory management
-    st.write("### 🩸 Blood Inventory")
-    if not st.session_state.inventory:
-        st.info("No inventory items")
-    else:
-        # Convert to DataFrame for better display
-        inventory_df = pd.DataFrame(st.session_state.inventory)
-        if 'expiry' in inventory_df.columns:
-            inventory_df['expiry'] = pd.to_datetime(inventory_df['expiry']).dt.date
-        
-        # Sort by expiry date (soonest first)
-        inventory_df = inventory_df.sort_values(by=['blood_type', 'expiry'])
-        
-        # Show summary by blood type
-        st.write("#### Inventory Summary")
-        summary = inventory_df.groupby('blood_type')['units'].sum().reset_index()
-        st.bar_chart(summary.set_index('blood_type'))
-        
-        st.write("#### Detailed Inventory")
-        st.dataframe(inventory_df)
-        
+    if st.session_state.inventory:
         # Inventory search
         st.write("### 🔍 Inventory Search")
         search_id = st.text_input("Enter Inventory ID")
@@ -905,7 +918,7 @@ def show_blood_bank_dashboard():
                     donor = st.session_state.users.get(item["donor_phone"], {})
                     st.write(f"**Donor:** {donor.get('name', 'Unknown')} ({item['donor_phone']})")
                 if item.get("test_report"):
-                    display_image(item["test_report"])
+                    display_image(item["test_report"], item.get("test_report_thumbnail"), key=f"full_report_{item['id']}")
                 if item.get("request_id"):
                     st.write(f"**Request ID:** {item['request_id']}")
             else:
@@ -950,116 +963,160 @@ def show_blood_bank_dashboard():
         test_report = st.file_uploader("Test Report (optional)", type=["png", "jpg"])
         if existing_item and existing_item.get("test_report"):
             st.write("Existing test report:")
-            display_image(existing_item["test_report"])
+            display_image(existing_item["test_report"], existing_item.get("test_report_thumbnail"))
         
         if st.form_submit_button("Add Inventory", type="primary"):
-            # Generate unique inventory ID
-            inventory_id = generate_unique_id("INV")
-            
             # Process test report
-            test_report_base64 = None
+            test_report_base64, test_report_thumbnail = None, None
             if test_report:
-                test_report_base64 = base64.b64encode(test_report.getvalue()).decode("utf-8")
+                test_report_base64, test_report_thumbnail = process_image(test_report.getvalue())
             elif existing_item and existing_item.get("test_report"):
                 test_report_base64 = existing_item["test_report"]
+                test_report_thumbnail = existing_item.get("test_report_thumbnail")
             
-            st.session_state.inventory.append({
-                "id": inventory_id,
-                "blood_type": blood_type,
-                "units": units,
-                "expiry": expiry.isoformat(),
-                "added_by": st.session_state.phone,
-                "added_at": datetime.now().isoformat(),
-                "donor_phone": donor_phone if donor_phone else None,
-                "test_report": test_report_base64
-            })
-            save_data("inventory.json", st.session_state.inventory)
+            inventory_id = HUB.add_inventory(
+                blood_type, units, expiry.isoformat(), st.session_state.phone,
+                donor_phone=donor_phone if donor_phone else None,
+                test_report=test_report_base64, test_report_thumbnail=test_report_thumbnail
+            )
             st.success(f"Inventory updated! ID: {inventory_id}")
             st.rerun()
     
     st.divider()
+    show_incoming_requests()
+    
+    st.divider()
+    show_district_allocation()
+
+@live_fragment
+@timed()
+def show_inventory_summary():
+    """Blood bank stock summary and detail table, refreshed in place"""
+    # Clean expired inventory
+    if HUB.clean_expired_inventory():
+        st.warning("Expired blood units have been removed from inventory")
+    
+    # Inventory management
+    st.write("### 🩸 Blood Inventory")
+    if not st.session_state.inventory:
+        st.info("No inventory items")
+    else:
+        # Convert to DataFrame for better display
+        inventory_df = pd.DataFrame([dict(item) for item in st.session_state.inventory])
+        if 'expiry' in inventory_df.columns:
+            inventory_df['expiry'] = pd.to_datetime(inventory_df['expiry']).dt.date
+        
+        # Sort by expiry date (soonest first)
+        inventory_df = inventory_df.sort_values(by=['blood_type', 'expiry'])
+        
+        # Show summary by blood type
+        st.write("#### Inventory Summary")
+        summary = inventory_df.groupby('blood_type')['units'].sum().reset_index()
+        st.bar_chart(summary.set_index('blood_type'))
+        
+        st.write("#### Detailed Inventory")
+        st.dataframe(inventory_df)
+
+@live_fragment
+@timed()
+def show_incoming_requests():
+    """Pending requests board for blood banks, refreshed in place"""
     st.write("### 📥 Incoming Requests")
-    pending_requests = [r for r in st.session_state.requests if r.get("status") == "Pending"]
+    _, urgencies, sort_by = request_board_filters("blood_bank_board")
+    pending_requests = HUB.query_requests(statuses=["Pending"], urgencies=urgencies, sort_by=sort_by)
+    
+    # Units on hand per blood type, summed once instead of once per request
+    available_by_type = HUB.available_units()
     
     if not pending_requests:
         st.info("No pending requests")
     else:
-        for req in pending_requests:
+        for req in paginate(pending_requests, "blood_bank_board"):
             requester = st.session_state.users.get(req["requester"], {})
-            with st.expander(f"Request #{req['id']}: {req['units']} units {req['blood_type']} from {requester.get('name', 'Unknown')}"):
+            with st.expander(f"{new_badge(req)}Request #{req['id']}: {req['units']} units {req['blood_type']} from {requester.get('name', 'Unknown')}"):
                 st.write(f"**Urgency:** {req['urgency']} {URGENCY_LEVELS[req['urgency']]['notification']}")
                 st.write(f"**Location:** {get_location_name(req['district'], req['taluk'], req.get('village', ''))}")
                 st.write(f"**Time Left:** {format_timedelta(datetime.fromisoformat(req['expires_at']) - datetime.now())}")
                 
                 # Check if blood bank has matching inventory
-                available_units = sum(
-                    item["units"] for item in st.session_state.inventory 
-                    if item.get("blood_type") == req["blood_type"]
-                )
+                available_units = available_by_type.get(req["blood_type"], 0)
                 
                 if available_units >= req["units"]:
                     if st.button(f"Fulfill Request", key=f"fulfill_{req['id']}"):
-                        # Update inventory
-                        remaining = req["units"]
-                        new_inventory = []
-                        for item in st.session_state.inventory:
-                            if item.get("blood_type") == req["blood_type"] and remaining > 0:
-                                if item["units"] <= remaining:
-                                    remaining -= item["units"]
-                                    # Skip adding to new inventory (fully consumed)
-                                else:
-                                    item["units"] -= remaining
-                                    remaining = 0
-                                    new_inventory.append(item)
-                            else:
-                                new_inventory.append(item)
-                        
-                        st.session_state.inventory = new_inventory
-                        
-                        # Update request
-                        req["status"] = "Fulfilled"
-                        req["fulfilled_by"] = st.session_state.phone
-                        req["fulfilled_at"] = datetime.now().isoformat()
-                        
-                        save_data("requests.json", st.session_state.requests)
-                        save_data("inventory.json", st.session_state.inventory)
-                        st.success("Request fulfilled!")
-                        st.rerun()
+                        with REPO.transaction(poll_changes):
+                            issued = HUB.fulfil_from_stock(HUB.get_request(req["id"]), st.session_state.phone)
+                        if issued:
+                            st.success("Request fulfilled!")
+                        else:
+                            st.warning("This request was taken care of elsewhere, or the stock is gone")
+                        rerun_fragment()
                 else:
                     st.warning(f"Only {available_units} units available (needed: {req['units']})")
                     if available_units > 0:
                         if st.button(f"Partially Fulfill ({available_units} units)", key=f"partial_{req['id']}"):
-                            # Update inventory
-                            remaining = available_units
-                            new_inventory = []
-                            for item in st.session_state.inventory:
-                                if item.get("blood_type") == req["blood_type"] and remaining > 0:
-                                    if item["units"] <= remaining:
-                                        remaining -= item["units"]
-                                        # Skip adding to new inventory (fully consumed)
-                                    else:
-                                        item["units"] -= remaining
-                                        remaining = 0
-                                        new_inventory.append(item)
-                                else:
-                                    new_inventory.append(item)
-                            
-                            st.session_state.inventory = new_inventory
-                            
-                            # Update request
-                            if available_units >= req["units"]:
-                                req["status"] = "Fulfilled"
+                            with REPO.transaction(poll_changes):
+                                issued = HUB.fulfil_from_stock(HUB.get_request(req["id"]), st.session_state.phone)
+                            if issued:
+                                st.success("Partially fulfilled request!")
                             else:
-                                req["status"] = "Partially Fulfilled"
-                                req["fulfilled_units"] = available_units
-                            req["fulfilled_by"] = st.session_state.phone
-                            req["fulfilled_at"] = datetime.now().isoformat()
-                            
-                            save_data("requests.json", st.session_state.requests)
-                            save_data("inventory.json", st.session_state.inventory)
-                            st.success("Partially fulfilled request!")
-                            st.rerun()
+                                st.warning("This request was taken care of elsewhere, or the stock is gone")
+                            rerun_fragment()
 
+@live_fragment
+@timed()
+def show_district_allocation():
+    """District transfer plan across every approved blood bank, and this bank's legs to confirm"""
+    st.write("### 🚚 District Allocation")
+    user = st.session_state.users.get(st.session_state.phone, {})
+    district_id = user.get("district_id")
+    st.caption("Plans every open request in your district against all approved blood banks' stock: "
+               "closest banks and soonest-expiring units first, most urgent requests first when stock is short.")
+    
+    if st.button("Plan district transfers", help="Replaces your district's unconfirmed plan"):
+        with REPO.transaction(poll_changes):
+            transfers = HUB.plan_district_allocation(district_id)
+        if transfers:
+            st.success(f"Planned {len(transfers)} transfer(s) covering {sum(t['units'] for t in transfers)} units")
+        else:
+            st.info("No stock can be moved to the open requests in your district")
+    
+    district_plan = HUB.open_transfers(district_id=district_id)
+    if district_plan:
+        st.write("#### Unconfirmed plan for your district")
+        plan_df = pd.DataFrame([{
+            "Request": f"#{t['request_id']}",
+            "Blood Type": t["blood_type"],
+            "Units": t["units"],
+            "From": st.session_state.users.get(t["from_bank"], {}).get("name", t["from_bank"]),
+            "Distance": t["distance"],
+            "Expires": t["expiry"][:10]
+        } for t in district_plan])
+        st.dataframe(plan_df, use_container_width=True, hide_index=True)
+    
+    st.write("#### Transfers awaiting your confirmation")
+    outgoing = HUB.open_transfers(bank=st.session_state.phone)
+    if not outgoing:
+        st.info("No transfers waiting for your confirmation")
+    for transfer in outgoing:
+        hospital = st.session_state.users.get(transfer["to"], {})
+        cols = st.columns([6, 1, 1])
+        cols[0].write(f"**{transfer['units']} × {transfer['blood_type']}** ({transfer['inventory_id']}, "
+                      f"expires {transfer['expiry'][:10]}) → {hospital.get('name', 'Unknown')} "
+                      f"for Request #{transfer['request_id']} · {transfer['distance']}")
+        if cols[1].button("Confirm", key=f"confirm_transfer_{transfer['id']}"):
+            with REPO.transaction(poll_changes):
+                confirmed = HUB.confirm_transfer(latest_transfer(transfer), st.session_state.phone)
+            if confirmed:
+                st.success("Transfer confirmed!")
+            else:
+                st.warning("The stock or the request changed since planning; transfer cancelled")
+            rerun_fragment()
+        if cols[2].button("Decline", key=f"decline_transfer_{transfer['id']}"):
+            with REPO.transaction(poll_changes):
+                HUB.decline_transfer(latest_transfer(transfer), st.session_state.phone)
+            rerun_fragment()
+
+@timed()
 def show_donor_dashboard():
     st.markdown('<h3 class="section-title">🧑‍⚕️ Donor Dashboard</h3>', unsafe_allow_html=True)
     user = st.session_state.users.get(st.session_state.phone, {})
@@ -1109,15 +1166,25 @@ def show_donor_dashboard():
     
     # Active requests
     st.divider()
+    show_nearby_requests()
+
+@live_fragment
+@timed()
+def show_nearby_requests():
+    """Pending requests matching the donor's blood group and district, refreshed in place"""
+    user = st.session_state.users.get(st.session_state.phone, {})
+    
     st.write("### 📋 Blood Requests Near You")
     
     # Get requests in same district first
-    eligible_requests = [
-        r for r in st.session_state.requests 
-        if r.get("status") == "Pending" and 
-        r.get("blood_type") == user.get("blood_group") and
-        r.get("district") == user.get("district")
-    ]
+    _, urgencies, sort_by = request_board_filters("donor_board")
+    eligible_requests = HUB.query_requests(
+        statuses=["Pending"],
+        district_id=user.get("district_id"),
+        blood_type=user.get("blood_group"),
+        urgencies=urgencies,
+        sort_by=sort_by
+    )
     
     # Focus on specific request if notification clicked
     focus_request = st.session_state.get("focus_request")
@@ -1131,7 +1198,7 @@ def show_donor_dashboard():
     if not eligible_requests:
         st.info("No matching requests in your district")
     else:
-        for req in eligible_requests:
+        for req in paginate(eligible_requests, "donor_board"):
             requester = st.session_state.users.get(req["requester"], {})
             created_time = datetime.fromisoformat(req["created_at"])
             expires_time = datetime.fromisoformat(req["expires_at"])
@@ -1141,7 +1208,7 @@ def show_donor_dashboard():
             is_focused = focus_request == req["id"]
             is_critical = req["urgency"] == "Critical"
             
-            expander_title = f"Request #{req['id']}: {req['units']} units {req['blood_type']} ({req['urgency']})"
+            expander_title = f"{new_badge(req)}Request #{req['id']}: {req['units']} units {req['blood_type']} ({req['urgency']})"
             if is_focused or is_critical:
                 expander_title = f"{URGENCY_LEVELS[req['urgency']]['notification']} {expander_title}"
             
@@ -1154,11 +1221,11 @@ def show_donor_dashboard():
                 
                 # Calculate distance
                 distance = "Unknown"
-                if user.get("village") == req.get("village") and req.get("village"):
+                if user.get("village_id") == req.get("village_id") and req.get("village_id"):
                     distance = "0-5 km (Same Village)"
-                elif user.get("taluk") == req.get("taluk"):
+                elif user.get("taluk_id") == req.get("taluk_id"):
                     distance = "5-10 km (Same Taluk)"
-                elif user.get("district") == req.get("district"):
+                elif user.get("district_id") == req.get("district_id"):
                     distance = "10-20 km (Same District)"
                 else:
                     distance = "20+ km"
@@ -1172,34 +1239,27 @@ def show_donor_dashboard():
                 if already_pledged:
                     st.success("✅ You have pledged to donate for this request")
                     if st.button("Withdraw Pledge", key=f"withdraw_{req['id']}"):
-                        req["pledged_donors"] = [d for d in req["pledged_donors"] if d.get("phone") != st.session_state.phone]
-                        save_data("requests.json", st.session_state.requests)
+                        with REPO.transaction(poll_changes):
+                            HUB.withdraw_pledge(HUB.get_request(req["id"]), st.session_state.phone)
                         st.success("Pledge withdrawn")
-                        st.rerun()
-                elif donor_in_cooldown(st.session_state.phone) and not st.session_state.red_alert:
+                        rerun_fragment()
+                elif HUB.donor_in_cooldown(st.session_state.phone) and not st.session_state.red_alert:
                     last_donation = datetime.fromisoformat(user.get("last_donation_date", datetime.now().isoformat()))
                     days_since = (datetime.now() - last_donation).days
                     st.warning(f"You are in cooldown period. Eligible in {90 - days_since} days.")
                 else:
                     if st.button("Pledge to Donate", key=f"pledge_{req['id']}"):
-                        if "pledged_donors" not in req:
-                            req["pledged_donors"] = []
-                            
-                        req["pledged_donors"].append({
-                            "phone": st.session_state.phone,
-                            "name": user.get("name", ""),
-                            "pledged_at": datetime.now().isoformat()
-                        })
-                        
-                        # Update request status if enough donors
-                        if len(req["pledged_donors"]) >= req["units"]:
-                            req["status"] = "Accepted"
-                        
-                        save_data("requests.json", st.session_state.requests)
-                        st.success("Thank you for pledging to donate!")
-                        st.balloons()
-                        st.rerun()
+                        # Accepts the request once enough donors have pledged
+                        with REPO.transaction(poll_changes):
+                            pledged = HUB.pledge(HUB.get_request(req["id"]), st.session_state.phone)
+                        if pledged:
+                            st.success("Thank you for pledging to donate!")
+                            st.balloons()
+                        else:
+                            st.warning("This request no longer needs pledges")
+                        rerun_fragment()
 
+@timed()
 def show_organization_dashboard():
     st.markdown('<h3 class="section-title">🏢 Organization Dashboard</h3>', unsafe_allow_html=True)
     user = st.session_state.users.get(st.session_state.phone, {})
@@ -1220,88 +1280,51 @@ def show_organization_dashboard():
         
         csv_file = st.file_uploader("Upload CSV file", type=["csv"])
         
-        if csv_file is not None:
+        if csv_file is not None and st.button("Import Volunteers", key="import_volunteers"):
+            progress = st.empty()
+            
+            def commit_batch(records, rows_seen):
+                HUB.add_volunteers(st.session_state.phone, records)
+                progress.info(f"Processed {rows_seen} rows...")
+            
             try:
-                # Read and parse CSV
-                csv_data = csv_file.read().decode("utf-8")
-                csv_reader = csv.DictReader(io.StringIO(csv_data))
-                
-                # Initialize volunteers list if needed
-                if "volunteers" not in user:
-                    user["volunteers"] = []
-                
-                added_count = 0
-                for row in csv_reader:
-                    # Validate required fields
-                    required_fields = ["name", "age", "address", "district", 
-                                     "taluk", "village", "blood_group", "height_cm", 
-                                     "weight_kg", "chronic_disease"]
-                    
-                    if not all(field in row for field in required_fields):
-                        st.error("CSV is missing required columns")
-                        break
-                    
-                    # Validate district and taluk
-                    district = row["district"]
-                    taluk = row["taluk"]
-                    village = row["village"]
-                    
-                    if district not in KERALA_LOCATIONS:
-                        st.error(f"Invalid district: {district}")
-                        break
-                        
-                    district_data = KERALA_LOCATIONS.get(district, {})
-                    if taluk not in district_data.get("taluks", []):
-                        st.error(f"Invalid taluk: {taluk} for district {district}")
-                        break
-                    
-                    # Get villages for taluk
-                    villages_dict = district_data.get("villages", {})
-                    villages = villages_dict.get(taluk, [])
-                    if village not in villages:
-                        st.error(f"Invalid village: {village} for taluk {taluk}")
-                        break
-                    
-                    # Add volunteer
-                    user["volunteers"].append({
-                        "name": row["name"],
-                        "age": int(row["age"]),
-                        "address": row["address"],
-                        "district": district,
-                        "taluk": taluk,
-                        "village": village,
-                        "blood_group": row["blood_group"],
-                        "height_cm": int(row["height_cm"]),
-                        "weight_kg": int(row["weight_kg"]),
-                        "chronic_disease": row["chronic_disease"],
-                        "disease_details": row.get("disease_details", ""),
-                        "added_at": datetime.now().isoformat()
-                    })
-                    added_count += 1
-                
-                if added_count > 0:
-                    save_data("users.json", st.session_state.users)
-                    st.success(f"✅ Successfully added {added_count} volunteers!")
-                    st.rerun()
-                
+                added_count, error_report = import_volunteers(
+                    csv_file, LOCATION_TABLE, BLOOD_TYPES, commit_batch, LOCATION_SEARCH
+                )
+                st.session_state.volunteer_import_result = {
+                    "added": added_count,
+                    "rejected": int((error_report["status"] == "rejected").sum()),
+                    "corrected": int((error_report["status"] == "corrected").sum()),
+                    "report": error_report.to_csv(index=False).encode("utf-8")
+                }
             except Exception as e:
                 st.error(f"Error processing CSV: {str(e)}")
+            progress.empty()
+        
+        result = st.session_state.get("volunteer_import_result")
+        if result:
+            if result["added"]:
+                st.success(f"✅ Successfully added {result['added']} volunteers!")
+            if result["corrected"]:
+                st.info(f"{result['corrected']} rows had misspelt place names corrected")
+            if result["rejected"]:
+                st.warning(f"{result['rejected']} rows were rejected")
+            if result["rejected"] or result["corrected"]:
+                st.download_button(
+                    "Download import report",
+                    result["report"],
+                    file_name="volunteer_import_errors.csv",
+                    mime="text/csv"
+                )
     
     # Add volunteer form
+    st.write("#### ➕ Add Single Volunteer")
+    # Location pickers live outside the form so search and the cascading lists update immediately
+    district, taluk, village = location_picker("volunteer")
     with st.form("add_volunteer_form"):
-        st.write("#### ➕ Add Single Volunteer")
         name = st.text_input("Volunteer Name")
         age = st.number_input("Age", 18, 100, 25)
         address = st.text_input("Address")
-        district = st.selectbox("District", list(KERALA_LOCATIONS.keys()))
-        district_data = KERALA_LOCATIONS.get(district, {})
-        taluks = district_data.get("taluks", [])
-        taluk = st.selectbox("Taluk", taluks)
-        
-        # Get villages for selected taluk
-        villages_dict = district_data.get("villages", {})
-        villages = villages_dict.get(taluk, [])
-        village = st.selectbox("Village", [""] + villages)
         
         blood_group = st.selectbox("Blood Group", BLOOD_TYPES)
         height_cm = st.number_input("Height (cm)", 140, 220, 170)
@@ -1312,10 +1335,7 @@ def show_organization_dashboard():
             disease_details = st.text_input("Disease Details")
         
         if st.form_submit_button("Add Volunteer", type="primary"):
-            if "volunteers" not in user:
-                user["volunteers"] = []
-                
-            user["volunteers"].append({
+            HUB.add_volunteers(st.session_state.phone, [{
                 "name": name,
                 "age": age,
                 "address": address,
@@ -1328,22 +1348,22 @@ def show_organization_dashboard():
                 "chronic_disease": chronic_disease,
                 "disease_details": disease_details,
                 "added_at": datetime.now().isoformat()
-            })
+            }])
             
-            save_data("users.json", st.session_state.users)
             st.success("Volunteer added!")
             st.rerun()
     
     # Display volunteers
-    if user.get("volunteers"):
+    volunteers = HUB.organization_volunteers(st.session_state.phone)
+    if volunteers:
         st.write("#### 📋 Volunteer List")
-        volunteer_df = pd.DataFrame(user["volunteers"])
+        volunteer_df = pd.DataFrame(volunteers).drop(columns=["organization"])
         st.dataframe(volunteer_df)
         
         # Statistics
         st.write("#### 📊 Volunteer Statistics")
         cols = st.columns(3)
-        cols[0].metric("Total Volunteers", len(user["volunteers"]))
+        cols[0].metric("Total Volunteers", len(volunteers))
         
         if not volunteer_df.empty:
             cols[1].metric("Most Common Blood Type", volunteer_df["blood_group"].mode()[0])
@@ -1353,13 +1373,14 @@ def show_organization_dashboard():
     else:
         st.info("No volunteers added yet")
 
+@timed()
 def show_admin_dashboard():
     st.markdown('<h3 class="section-title">👑 Admin Dashboard</h3>', unsafe_allow_html=True)
     
     # Check inventory alerts periodically (every 5 minutes)
     last_check = datetime.fromisoformat(st.session_state.last_inventory_check)
     if (datetime.now() - last_check).total_seconds() > 300:  # 5 minutes
-        check_inventory_alerts()
+        HUB.check_inventory_alerts()
         st.session_state.last_inventory_check = datetime.now().isoformat()
     
     # Pending approvals
@@ -1379,31 +1400,30 @@ def show_admin_dashboard():
                 
                 # Display certificate if available
                 if user.get("certificate"):
-                    display_image(user["certificate"])
+                    display_image(user["certificate"], user.get("certificate_thumbnail"), key=f"full_certificate_{phone}")
                 else:
                     st.warning("No certificate uploaded")
                 
                 # Approval buttons
                 cols = st.columns(2)
                 if cols[0].button("Approve", key=f"approve_{phone}"):
-                    user["approved"] = True
-                    save_data("users.json", st.session_state.users)
+                    with REPO.transaction(poll_changes):
+                        HUB.approve_user(phone)
                     st.success(f"{user.get('name', 'User')} approved successfully!")
                     st.rerun()
                 
                 if cols[1].button("Reject", key=f"reject_{phone}"):
-                    st.session_state.users.pop(phone)
-                    save_data("users.json", st.session_state.users)
+                    with REPO.transaction(poll_changes):
+                        HUB.reject_user(phone)
                     st.success(f"{user.get('name', 'User')} rejected and removed!")
                     st.rerun()
     
+    # Tables and charts below are cached per store version and shared by all admin sessions
+    users_df = build_user_table(REPO.shared_version("users"), st.session_state.users)
+    analytics = build_request_analytics(REPO.shared_version("rollups"), st.session_state.rollups)
+    
     # User management
     st.write("### 👥 User Management")
-    users_df = pd.DataFrame([
-        {"phone": phone, **info} 
-        for phone, info in st.session_state.users.items()
-    ])
-    
     if not users_df.empty:
         st.dataframe(users_df)
     else:
@@ -1412,25 +1432,36 @@ def show_admin_dashboard():
     # System status
     st.write("### ⚙️ System Status")
     cols = st.columns(3)
-    cols[0].metric("Total Users", len(st.session_state.users))
-    cols[1].metric("Active Requests", len([r for r in st.session_state.requests if r.get("status") == "Pending"]))
-    cols[2].metric("Blood Banks", len([u for u in st.session_state.users.values() if u.get("role") == "Blood Bank"]))
+    cols[0].metric("Total Users", len(users_df))
+    cols[1].metric("Active Requests", analytics["pending"])
+    cols[2].metric("Blood Banks", int((users_df["role"] == "Blood Bank").sum()))
     
     # Red alert control
     st.write("### 🚨 Red Alert System")
     if st.session_state.red_alert:
         st.error("RED ALERT ACTIVE - All cooldowns suspended")
         if st.button("Deactivate Red Alert"):
-            st.session_state.red_alert = False
-            save_data("red_alert.json", st.session_state.red_alert)
+            with REPO.transaction(poll_changes):
+                HUB.set_red_alert(False)
             st.rerun()
     else:
         st.success("System operating normally")
         if st.button("Activate Red Alert"):
-            st.session_state.red_alert = True
-            save_data("red_alert.json", st.session_state.red_alert)
+            progress = st.progress(0.0, "Rematching open requests...")
+            # One transaction: requests created before it are rematched below, requests created after it see the flag
+            with REPO.transaction(poll_changes):
+                HUB.set_red_alert(True)
+                # Donors in cooldown are eligible now: rematch every open request against them
+                st.session_state.red_alert_rematch = rematch_open_requests(
+                    HUB, progress=lambda done, total: progress.progress(done / total, f"Rematched {done}/{total} districts")
+                )
             st.rerun()
     
+    rematch = st.session_state.get("red_alert_rematch")
+    if rematch and st.session_state.red_alert:
+        st.info(f"Rematched {rematch['rematched']} of {rematch['requests']} open requests: "
+                f"{rematch['new_matches']} new donor matches, {rematch['notified']} donors/organizations notified")
+    
     # Inventory forecasting
     st.write("### 📊 Inventory Forecasting")
     forecast_df = generate_inventory_forecast()
@@ -1441,40 +1472,166 @@ def show_admin_dashboard():
     
     # Analytics
     st.write("### 📈 System Analytics")
-    if st.session_state.requests:
-        requests_df = pd.DataFrame(st.session_state.requests)
-        requests_df["created_at"] = pd.to_datetime(requests_df["created_at"])
-        requests_df["hour"] = requests_df["created_at"].dt.hour
-        
+    if st.session_state.rollups["counts"]:
         st.write("#### Requests by Hour")
-        st.bar_chart(requests_df["hour"].value_counts().sort_index())
+        st.bar_chart(analytics["by_hour"])
         
         st.write("#### Requests by Blood Type")
-        st.bar_chart(requests_df["blood_type"].value_counts())
+        st.bar_chart(analytics["by_blood_type"])
         
         st.write("#### Requests by District")
-        st.bar_chart(requests_df["district"].value_counts())
+        st.bar_chart(analytics["by_district"])
+        
+        st.write("#### Fulfilment Latency")
+        cols = st.columns(len(LATENCY_STAGES))
+        for col, stage in zip(cols, LATENCY_STAGES):
+            col.caption(stage.replace("_", " ").capitalize())
+            col.bar_chart(analytics["latency"][stage])
+        
+        st.download_button(
+            "Download request rollups (CSV)",
+            analytics["csv"],
+            file_name="request_rollups.csv",
+            mime="text/csv"
+        )
     else:
         st.info("No request data available")
+    
+    show_data_export()
+    show_performance()
+
+def show_data_export():
+    """Download buttons for the latest Parquet snapshot of each table"""
+    st.write("### 🗄️ Data Export")
+    if not snapshots_available():
+        st.info("Install pyarrow to enable snapshots and exports")
+        return
+    
+    manifest = load_manifest()
+    if st.button("Take snapshot now"):
+        REPO.flush()
+        manifest = run_snapshot(source_files=SNAPSHOT_SOURCES)
+    if not manifest:
+        st.info("No snapshot taken yet")
+        return
+    
+    taken_at = datetime.fromisoformat(manifest["taken_at"])
+    st.caption(f"Snapshot taken {taken_at.strftime('%d %b %Y %H:%M')}; exports read the snapshot, not the live stores")
+    for table, info in manifest["tables"].items():
+        cols = st.columns([2, 1, 1])
+        cols[0].write(f"**{table.capitalize()}** ({info['rows']} rows)")
+        # Files are handed over from disk; the stores are never loaded into a DataFrame
+        with open(info["path"], "rb") as f:
+            cols[1].download_button("Parquet", f, file_name=os.path.basename(info["path"]),
+                                    mime="application/octet-stream", key=f"export_parquet_{table}")
+        csv_path = csv_export_path(info["path"])
+        if os.path.exists(csv_path):
+            with open(csv_path, "rb") as f:
+                cols[2].download_button("CSV", f, file_name=os.path.basename(csv_path),
+                                        mime="text/csv", key=f"export_csv_{table}")
+        elif cols[2].button("Prepare CSV", key=f"prepare_csv_{table}"):
+            export_csv(info["path"])
+            st.rerun()
+
+def show_performance():
+    """Latency percentiles and data file I/O for this server process"""
+    st.write("### ⏱️ Performance")
+    if not PERF_ENABLED:
+        st.info("Instrumentation is off (BLOODHUB_PERF=0)")
+        return
+    
+    timings = timing_report()
+    if timings:
+        st.caption("Per-call latency across all sessions since the server started (ms)")
+        st.dataframe(pd.DataFrame(timings).set_index("name").round(2), use_container_width=True)
+    else:
+        st.info("No timings recorded yet")
+    
+    io = io_report()
+    if io:
+        st.write("#### Data File I/O")
+        io_df = pd.DataFrame(io).set_index("file")
+        io_df["mb_read"] = (io_df.pop("bytes_read") / 1e6).round(2)
+        io_df["mb_written"] = (io_df.pop("bytes_written") / 1e6).round(2)
+        st.dataframe(io_df, use_container_width=True)
+    
+    if st.button("Reset performance counters"):
+        reset_perf()
+        st.rerun()
+    
+    show_memory()
+
+def show_memory():
+    """Memory held per session and per store, plus optional tracemalloc snapshots"""
+    st.write("#### Memory")
+    if st.button("Measure memory", help="Walks every live session's data; takes a moment on large stores"):
+        data = memory_report(as_mapping=session_mapping)
+        if data["sessions"]:
+            st.caption(f"{len(data['sessions'])} live session(s), MB")
+            sessions_df = pd.DataFrame(data["sessions"] + [dict(data["totals"], session="TOTAL")]).set_index("session")
+            st.dataframe((sessions_df / 1e6).round(2), use_container_width=True)
+        else:
+            st.info("No sessions tracked yet")
+    
+    traced = traced_memory()
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if not tracing() and st.button("Start tracemalloc", help="Slows every allocation while on"):
+            start_tracing()
+            st.rerun()
+        elif tracing() and st.button("Stop tracemalloc"):
+            stop_tracing()
+            st.rerun()
+    with col2:
+        if tracing() and st.button("Take snapshot"):
+            take_snapshot()
+    with col3:
+        if traced:
+            st.metric("Traced now / peak", f"{traced[0] / 1e6:.1f} / {traced[1] / 1e6:.1f} MB")
+    
+    if tracing():
+        growth = snapshot_diff()
+        if growth:
+            st.caption("Growth since the previous snapshot (KB)")
+            st.dataframe(pd.DataFrame(growth).set_index("where").round(1), use_container_width=True)
+        elif top_allocations():
+            st.caption("Largest allocation sites in the snapshot (KB); take another to see growth")
+            st.dataframe(pd.DataFrame(top_allocations()).set_index("where").round(1), use_container_width=True)
 
 # ================== MAIN APP ==================
+@timed("rerun")
 def main():
     # Initialize session state
     init_session_state()
+    poll_changes()
     
-    # Show header
-    show_header()
-    
-    # Show appropriate screen based on state
-    if not st.session_state.get("logged_in", False):
-        if st.session_state.stage == "enter_phone":
-            phone_login()
-        elif st.session_state.stage == "enter_otp":
-            otp_verification()
-        elif st.session_state.stage == "complete_profile":
-            complete_profile()
-    else:
-        show_dashboard()
+    try:
+        # Show header
+        show_header()
+        
+        # Show appropriate screen based on state
+        if not st.session_state.get("logged_in", False):
+            if st.session_state.stage == "enter_phone":
+                phone_login()
+            elif st.session_state.stage == "enter_otp":
+                otp_verification()
+            elif st.session_state.stage == "complete_profile":
+                complete_profile()
+        else:
+            show_dashboard()
+    finally:
+        # Runs on st.rerun()/st.stop() too, so every change is written exactly once
+        REPO.flush()
+        # Periodic columnar snapshot for offline reporting, off the rerun thread; cron can run
+        # `python snapshots.py --if-due` instead
+        if snapshot_due():
+            start_snapshot(source_files=SNAPSHOT_SOURCES)
+        # Fold the write-ahead log into a binary snapshot off the rerun thread, so cold starts stay short
+        if REPO.checkpoint_due():
+            start_checkpoint(Repository(data_dir=DATA_DIR).checkpoint)
+        # Prometheus textfile for hosts that scrape files rather than ports (BLOODHUB_METRICS_FILE)
+        if metrics_file_due():
+            write_metrics_file(METRICS_FILE, REPO)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""Time every hot path on generated statewide data and check regression thresholds.
+
+Generates a data set per --donors size (see generate_data.py), then times
+load/save, cold start from a snapshot plus log, the donor index, matching, request creation, fulfilment, expiry
+cleaning, notification fan-out and dashboard data prep. Results go to a JSON
+file; the exit status is 1 if any path is over its threshold or, with
+--baseline, slower than the baseline by more than --tolerance.
+
+Usage: python benchmarks/bench_hot_paths.py [--donors 10000 100000] [--out bench_results.json]
+                                            [--baseline old_results.json] [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialization import codec_name  # noqa: E402
+from utils import load_data  # noqa: E402
+from locations import compile_locations, LOCATION_IDS_FILE  # noqa: E402
+from rollups import summarize  # noqa: E402
+from core import Repository, BloodHub, DuplicateRequestError, STORE_FILES, BLOOD_TYPES  # noqa: E402
+from generate_data import generate, write, ROOT  # noqa: E402
+
+# Per-operation budget in ms: fixed part + part per 10k donors (scans grow with the data).
+# Set at roughly 1.5-2x the timings measured when the suite was added.
+THRESHOLDS = {
+    "load_all_stores": (50, 250),
+    "save_all_stores": (50, 250),
+    "load_from_snapshot": (50, 120),
+    "donor_index_build": (5, 40),
+    "find_matching_donors": (2, 10),
+    # These three run in a transaction, so each op includes the flush that rewrites users.json
+    "create_request": (5, 50),
+    # One batch of a request per blood type
+    "create_requests_batch": (5, 40),
+    "fulfil_from_stock": (2, 5),
+    "add_to_inventory": (2, 2),
+    "clean_expired_inventory": (2, 5),
+    "notify_donors": (50, 400),
+    "hospital_board": (2, 2),
+    "nearby_requests": (2, 2),
+    "request_analytics": (2, 2),
+    "available_units": (1, 2),
+}
+
+# Operations timed per benchmark (fewer for whole-store operations)
+SAMPLE_SIZE = 50
+# Expired units put back before every timed clean_expired_inventory, so each repeat has work to do
+EXPIRED_UNITS = 200
+
+def timed_ops(fn, items, repeat=1, setup=None):
+    """Best-of-repeat wall time for running fn over every item; returns (seconds, ops).
+
+    setup, if given, runs untimed before every repeat.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - start)
+    return best, len(items)
+
+def spread(items, count):
+    """Up to count items spread evenly over a list"""
+    if len(items) <= count:
+        return list(items)
+    step = len(items) / count
+    return [items[int(i * step)] for i in range(count)]
+
+def run_suite(data_dir, table, repeat):
+    """{name: (seconds, ops)} for one data directory"""
+    results = {}
+    repo = Repository(data_dir=data_dir)
+
+    results["load_all_stores"] = timed_ops(lambda _: Repository(data_dir=data_dir).load(), [None], repeat)
+    repo.load()
+    hub = BloodHub(repo, table)
+
+    def save_all(_):
+        for store in STORE_FILES:
+            repo.mark_dirty(store)
+        repo.flush()
+    results["save_all_stores"] = timed_ops(save_all, [None], repeat)
+
+    Repository(data_dir=data_dir, wal=True).checkpoint()
+    # A log tail of single-record flushes to replay on top of the snapshot
+    for request in spread(repo["requests"], SAMPLE_SIZE):
+        repo.mark_dirty("requests", request["id"])
+        repo.flush()
+    results["load_from_snapshot"] = timed_ops(lambda _: Repository(data_dir=data_dir, wal=True).load(), [None], repeat)
+
+    def build_index(_):
+        repo.state.pop("donor_index", None)
+        hub.donor_index()
+    results["donor_index_build"] = timed_ops(build_index, [None], repeat)
+
+    requests = repo["requests"]
+    sample = spread(requests, SAMPLE_SIZE)
+    results["find_matching_donors"] = timed_ops(hub.find_matching_donors, sample, repeat)
+
+    hospitals = [phone for phone, user in repo["users"].items() if user.get("role") == "Hospital"]
+    blood_banks = [phone for phone, user in repo["users"].items() if user.get("role") == "Blood Bank"]
+    donors = spread([phone for phone, user in repo["users"].items() if user.get("role") == "Donor"], SAMPLE_SIZE)
+
+    # A request per blood type from each of a few hospitals; cancelled afterwards so the
+    # duplicate check doesn't reject the single creates below
+    batches = []
+    results["create_requests_batch"] = timed_ops(
+        lambda phone: batches.extend(hub.create_requests(phone, [(b, 2, "Urgent") for b in BLOOD_TYPES])),
+        spread(hospitals, 5))
+    for request in batches:
+        if not isinstance(request, DuplicateRequestError):
+            hub.set_request_status(request, "Cancelled")
+
+    # Distinct hospital/blood type pairs so the duplicate check never rejects one
+    pairs = spread([(h, b) for b in BLOOD_TYPES for h in hospitals], SAMPLE_SIZE)
+    created = []
+
+    def create(pair):
+        try:
+            created.append(hub.create_request(pair[0], pair[1], 2, "Urgent"))
+        except DuplicateRequestError:
+            pass
+    results["create_request"] = timed_ops(create, pairs)
+
+    critical = spread(requests, SAMPLE_SIZE // 5)
+    for request in critical:
+        request["matched_donors"] = hub.find_matching_donors(dict(request, urgency="Critical"))
+    results["notify_donors"] = timed_ops(hub.notify_donors, critical)
+
+    half = len(created) // 2
+    issued = []
+    results["fulfil_from_stock"] = timed_ops(
+        lambda request: issued.append(hub.fulfil_from_stock(request, blood_banks[0])), created[:half])
+    if not sum(issued):
+        raise AssertionError("fulfil_from_stock issued nothing: is the generated stock expired?")
+    results["add_to_inventory"] = timed_ops(
+        lambda pair: hub.add_to_inventory(pair[0]["id"], pair[1], blood_banks[0]),
+        list(zip(created[half:], donors)))
+
+    def seed_expired():
+        expired = (datetime.now() - timedelta(days=1)).isoformat()
+        for n in range(EXPIRED_UNITS):
+            hub.add_inventory(BLOOD_TYPES[n % len(BLOOD_TYPES)], 1, expired, blood_banks[n % len(blood_banks)])
+
+    def clean(_):
+        if not hub.clean_expired_inventory():
+            raise AssertionError("clean_expired_inventory found nothing to remove")
+    results["clean_expired_inventory"] = timed_ops(clean, [None], repeat, setup=seed_expired)
+    # Live stock only from here on
+    results["available_units"] = timed_ops(lambda _: hub.available_units(), [None], repeat)
+
+    # Dashboard data prep: what each rerun asks the engine for
+    results["hospital_board"] = timed_ops(
+        lambda phone: hub.query_requests(requester=phone, statuses=["Pending", "Accepted"]), spread(hospitals, 10),
+        repeat)
+    district_ids = table["children"][0]
+    results["nearby_requests"] = timed_ops(
+        lambda district_id: hub.query_requests(statuses=["Pending"], district_id=district_id), district_ids, repeat)
+    results["request_analytics"] = timed_ops(
+        lambda field: summarize(repo["rollups"], field), ["hour", "blood_type", "district_id"], repeat)
+    return results
+
+def check(name, per_op_ms, donors, baseline, tolerance):
+    """(threshold_ms, list of failure reasons)"""
+    fixed, per_10k = THRESHOLDS[name]
+    threshold = fixed + per_10k * donors / 10000
+    failures = []
+    if per_op_ms > threshold:
+        failures.append(f"over threshold {threshold:.1f} ms")
+    previous = (baseline or {}).get(str(donors), {}).get(name)
+    if previous and per_op_ms > previous["per_op_ms"] * (1 + tolerance):
+        failures.append(f"{per_op_ms / previous['per_op_ms']:.2f}x baseline")
+    return threshold, failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--donors", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    table = compile_locations(load_data(os.path.join(ROOT, "kerala_locations.json"), {}),
+                              os.path.join(ROOT, LOCATION_IDS_FILE))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    report = {
+        "run_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "codec": codec_name(),
+        "seed": args.seed,
+        "results": {}
+    }
+    failed = False
+    print(f"{'donors':>8} {'benchmark':<24} {'ops':>5} {'per op':>10} {'threshold':>10}")
+    for donors in args.donors:
+        with tempfile.TemporaryDirectory() as data_dir:
+            start = time.perf_counter()
+            write(generate(donors, args.seed, now=datetime.now(), table=table), data_dir)
+            print(f"{donors:>8} generated in {time.perf_counter() - start:.1f}s")
+            results = run_suite(data_dir, table, args.repeat)
+        rows = report["results"].setdefault(str(donors), {})
+        for name, (seconds, ops) in results.items():
+            per_op_ms = seconds / max(ops, 1) * 1000
+            threshold, failures = check(name, per_op_ms, donors, baseline, args.tolerance)
+            rows[name] = {"ops": ops, "total_s": seconds, "per_op_ms": per_op_ms, "threshold_ms": threshold,
+                          "ok": not failures}
+            failed = failed or bool(failures)
+            flag = "  FAIL: " + "; ".join(failures) if failures else ""
+            print(f"{donors:>8} {name:<24} {ops:>5} {per_op_ms:>8.2f}ms {threshold:>8.1f}ms{flag}")
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Time Red Alert rematching in-process against a process pool (see the note
+in core/rematch.py).
+
+Generates a data set (see generate_data.py), opens --requests requests spread
+over the districts, and times only the matching (write-back and notices cost
+the same either way). The pool time includes spawning its workers, which is
+what a Red Alert pays every time. "transfer" is pickling and unpickling the
+in-process results: what a pool pays to hand them back, whatever the core
+count.
+
+Usage: python benchmarks/bench_rematch.py [--donors 100000] [--requests 100 500 2000] [--workers 4]
+"""
+import argparse
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import load_data  # noqa: E402
+from locations import compile_locations, LOCATION_IDS_FILE  # noqa: E402
+from core import Repository, BloodHub, BLOOD_TYPES  # noqa: E402
+from core.rematch import build_shards, match_shards  # noqa: E402
+from generate_data import generate, write, random_place, place_fields, ROOT  # noqa: E402
+
+def open_requests(count, table, seed):
+    """count open requests, one in ten Critical, at random places"""
+    rng = random.Random(seed)
+    requests = []
+    for n in range(count):
+        request = {"id": n + 1, "blood_type": rng.choice(BLOOD_TYPES),
+                   "urgency": "Critical" if n % 10 == 0 else "Normal", "status": "Pending"}
+        request.update(place_fields(table, random_place(rng, table)))
+        requests.append(request)
+    return requests
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--donors", type=int, default=100000)
+    parser.add_argument("--requests", type=int, nargs="+", default=[100, 500, 2000])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    table = compile_locations(load_data(os.path.join(ROOT, "kerala_locations.json"), {}),
+                              os.path.join(ROOT, LOCATION_IDS_FILE))
+    with tempfile.TemporaryDirectory() as data_dir:
+        write(generate(args.donors, args.seed, now=datetime.now(), table=table), data_dir)
+        hub = BloodHub(Repository(data_dir=data_dir).load(), table)
+        donor_index = hub.donor_index()
+
+    print(f"cpus: {os.cpu_count()}  donors: {args.donors}  pool workers: {args.workers}")
+    print(f"{'requests':>8} {'shards':>6} {'in-process':>11} {'transfer':>9} {'pool':>9} {'per request':>12}")
+    for count in args.requests:
+        shards = build_shards(open_requests(count, table, args.seed), donor_index)
+        serial = best_of(lambda: match_shards(shards, []), args.repeat)
+        results = match_shards(shards, [])
+        transfer = best_of(lambda: pickle.loads(pickle.dumps(results)), args.repeat)
+        pool = best_of(lambda: match_shards(shards, [], args.workers), args.repeat)
+        print(f"{count:>8} {len(shards):>6} {serial * 1000:>9.0f}ms {transfer * 1000:>7.0f}ms {pool * 1000:>7.0f}ms "
+              f"{serial / count * 1000:>10.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare load/save times of the old pretty-printed stdlib JSON against the
+compact serialization layer, on copies of the shipped data scaled up.
+
+Usage: python benchmarks/bench_serialization.py [--scales 10 100]
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialization import codec_name, read_file, write_file  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def scale_users(users, factor):
+    """Replicate users under fresh 10-digit phone numbers"""
+    scaled = {}
+    for n in range(factor):
+        for i, (phone, user) in enumerate(users.items()):
+            scaled[f"{n:03d}{i:07d}" if n else phone] = copy.deepcopy(user)
+    return scaled
+
+def scale_list(records, factor):
+    """Replicate request/inventory records with unique ids"""
+    scaled = []
+    for n in range(factor):
+        for record in records:
+            record = copy.deepcopy(record)
+            if isinstance(record.get("id"), int):
+                record["id"] += n * len(records)
+            elif record.get("id"):
+                record["id"] = f"{record['id']}-{n}"
+            scaled.append(record)
+    return scaled
+
+def old_save(filename, data):
+    with open(filename, "w") as f:
+        json.dump(data, f, indent=2)
+
+def old_load(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = {
+        "users": read_file(os.path.join(ROOT, "users.json")),
+        "requests": read_file(os.path.join(ROOT, "requests.json")),
+        "inventory": read_file(os.path.join(ROOT, "inventory.json")),
+    }
+
+    print(f"codec: {codec_name()}")
+    print(f"{'scale':>5} {'store':<10} {'old MB':>8} {'new MB':>8} "
+          f"{'old save':>9} {'new save':>9} {'old load':>9} {'new load':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in args.scales:
+            for store, data in base.items():
+                scaled = scale_users(data, factor) if store == "users" else scale_list(data, factor)
+                old_path = os.path.join(tmp, f"{store}.old.json")
+                new_path = os.path.join(tmp, f"{store}.json")
+
+                old_save_s = best_of(lambda: old_save(old_path, scaled), args.repeat)
+                new_save_s = best_of(lambda: write_file(new_path, scaled), args.repeat)
+                old_load_s = best_of(lambda: old_load(old_path), args.repeat)
+                new_load_s = best_of(lambda: read_file(new_path), args.repeat)
+                old_mb = os.path.getsize(old_path) / 1e6
+                new_mb = os.path.getsize(new_path) / 1e6
+
+                print(f"{factor:>4}x {store:<10} {old_mb:>8.2f} {new_mb:>8.2f} "
+                      f"{old_save_s:>8.3f}s {new_save_s:>8.3f}s {old_load_s:>8.3f}s {new_load_s:>8.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Generate a deterministic, statewide-scale data set over kerala_locations.json.
+
+Writes users, volunteers, requests, inventory, rollups and the small stores
+into an output directory the app, API and benchmarks can point at. Dates are
+laid out around the current time, so stock and the newest requests are still
+live for the engine; the same --donors, --seed and --now always give the same
+files.
+
+Usage: python benchmarks/generate_data.py --donors 100000 --out /tmp/bloodhub-100k [--seed 7]
+                                          [--now 2025-07-01T12:00]
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import load_data, save_data  # noqa: E402
+from locations import compile_locations, LOCATION_IDS_FILE  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+from core.constants import (BLOOD_TYPES, URGENCY_LEVELS, STORE_FILES, INVENTORY_EXPIRY_DAYS,  # noqa: E402
+                            ORGANIZATION_TYPES)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Approximate Indian blood group distribution
+BLOOD_TYPE_WEIGHTS = {"O+": 37, "B+": 32, "A+": 22, "AB+": 7, "O-": 0.8, "B-": 0.6, "A-": 0.4, "AB-": 0.2}
+URGENCY_WEIGHTS = {"Normal": 70, "Urgent": 22, "Critical": 8}
+# Status mix of the request history (open requests are the recent ones)
+STATUS_WEIGHTS = {"Fulfilled": 55, "Partially Fulfilled": 8, "Accepted": 10, "Cancelled": 12, "Pending": 15}
+
+# Entity counts relative to the donor count
+DONORS_PER_HOSPITAL = 2000
+DONORS_PER_BLOOD_BANK = 5000
+DONORS_PER_ORGANIZATION = 2000
+VOLUNTEERS_PER_DONOR = 0.1
+REQUESTS_PER_DONOR = 0.05
+INVENTORY_PER_DONOR = 0.02
+HISTORY_DAYS = 365
+
+FIRST_NAMES = ["Arun", "Anjali", "Biju", "Deepa", "Faisal", "Gopika", "Hari", "Jaseena", "Kiran", "Lakshmi",
+               "Manoj", "Nimisha", "Pradeep", "Reshma", "Sajith", "Sneha", "Thomas", "Vidya", "Akhil", "Fathima",
+               "Rahul", "Aswathy", "Vishnu", "Merin", "Shibu", "Divya", "Nikhil", "Sruthi", "Joseph", "Ameena"]
+LAST_NAMES = ["Nair", "Menon", "Pillai", "Kurian", "Varghese", "Thomas", "Rahman", "Krishnan", "Das", "Joseph",
+              "Panicker", "Namboothiri", "Ibrahim", "George", "Mathew", "Kumar", "Raj", "Babu", "Haneefa", "Jacob"]
+
+def weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+def random_place(rng, table, district_id=None):
+    """(district_id, taluk_id, village_id) somewhere in Kerala, optionally inside one district"""
+    district_id = district_id or rng.choice(table["children"][0])
+    taluk_id = rng.choice(table["children"][district_id])
+    villages = table["children"].get(taluk_id)
+    village_id = rng.choice(villages) if villages and rng.random() < 0.85 else None
+    return district_id, taluk_id, village_id
+
+def place_fields(table, place):
+    district_id, taluk_id, village_id = place
+    names = table["names"]
+    return {
+        "district": names[district_id],
+        "taluk": names[taluk_id],
+        "village": names[village_id] if village_id else "",
+        "district_id": district_id,
+        "taluk_id": taluk_id,
+        "village_id": village_id
+    }
+
+def person_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def generate(donors, seed=7, now=None, table=None):
+    """Build every store in memory around now (default: the current minute); returns {store: data}"""
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(second=0, microsecond=0)
+    table = table or compile_locations(load_data(os.path.join(ROOT, "kerala_locations.json"), {}),
+                                       os.path.join(ROOT, LOCATION_IDS_FILE))
+    users = {}
+    serial = iter(range(10 ** 9))
+
+    def phone(prefix):
+        return f"{prefix}{next(serial):09d}"
+
+    users["4000000000"] = {"role": "Admin", "name": "State Admin", "email": "admin@bloodhub.example",
+                           "employee_id": "ADM-001", "profile": True}
+
+    facilities = {"Hospital": [], "Blood Bank": []}
+    for role, count in (("Hospital", max(5, donors // DONORS_PER_HOSPITAL)),
+                        ("Blood Bank", max(3, donors // DONORS_PER_BLOOD_BANK))):
+        for n in range(count):
+            place = random_place(rng, table)
+            number = phone(6 if role == "Hospital" else 7)
+            label = "Hospital" if role == "Hospital" else "Blood Bank"
+            users[number] = dict(place_fields(table, place), role=role, profile=True,
+                                 name=f"{table['names'][place[1]]} {label} {n + 1}", approved=rng.random() < 0.95)
+            facilities[role].append(number)
+
+    organizations = []
+    for n in range(max(2, donors // DONORS_PER_ORGANIZATION)):
+        number = phone(5)
+        place = random_place(rng, table)
+        users[number] = dict(place_fields(table, place), role="Organization", profile=True,
+                             name=f"{table['names'][place[0]]} Blood Donors Forum {n + 1}",
+                             organization_type=rng.choice(ORGANIZATION_TYPES))
+        organizations.append(number)
+
+    donor_phones = []
+    for _ in range(donors):
+        number = phone(9)
+        donated = rng.random() < 0.3
+        users[number] = dict(
+            place_fields(table, random_place(rng, table)),
+            role="Donor", profile=True, name=person_name(rng),
+            blood_group=weighted(rng, BLOOD_TYPE_WEIGHTS),
+            height=rng.randint(150, 190), weight=rng.randint(50, 95), chronic_disease=None,
+            last_donation_date=(now - timedelta(days=rng.randint(1, 365))).isoformat() if donated else None,
+            points=rng.randint(1, 12) * 10 if donated else 0
+        )
+        donor_phones.append(number)
+
+    volunteers = []
+    for n in range(int(donors * VOLUNTEERS_PER_DONOR)):
+        volunteers.append(dict(
+            place_fields(table, random_place(rng, table)),
+            id=f"VOL-{n:08d}", organization=rng.choice(organizations), name=person_name(rng),
+            age=rng.randint(18, 60), address="", blood_group=weighted(rng, BLOOD_TYPE_WEIGHTS),
+            height_cm=rng.randint(150, 190), weight_kg=rng.randint(50, 95), chronic_disease="No",
+            added_at=(now - timedelta(days=rng.randint(1, HISTORY_DAYS))).isoformat()
+        ))
+
+    requests = []
+    hospitals = facilities["Hospital"]
+    count = max(10, int(donors * REQUESTS_PER_DONOR))
+    for n in range(count):
+        requester = rng.choice(hospitals)
+        urgency = weighted(rng, URGENCY_WEIGHTS)
+        # Oldest first, like the real store; the newest slice is still open
+        created = now - timedelta(minutes=(count - n) * HISTORY_DAYS * 24 * 60 / count)
+        is_recent = now - created < timedelta(minutes=URGENCY_LEVELS[urgency]["timeout"])
+        status = "Pending" if is_recent else weighted(rng, STATUS_WEIGHTS)
+        units = rng.choice((1, 1, 1, 2, 2, 3, 4))
+        request = {
+            "id": n + 1, "requester": requester, "blood_type": weighted(rng, BLOOD_TYPE_WEIGHTS),
+            "units": units, "urgency": urgency, "status": status,
+            **{field: users[requester][field] for field in
+               ("district", "taluk", "village", "district_id", "taluk_id", "village_id")},
+            "created_at": created.isoformat(),
+            "expires_at": (created + timedelta(minutes=URGENCY_LEVELS[urgency]["timeout"])).isoformat(),
+            "matched_donors": [], "pledged_donors": [], "inventory_ids": [], "test_results": {}
+        }
+        if status in ("Accepted", "Fulfilled", "Partially Fulfilled"):
+            request["accepted_at"] = (created + timedelta(minutes=rng.randint(5, 240))).isoformat()
+            request["pledged_donors"] = [
+                {"phone": donor, "name": users[donor]["name"], "pledged_at": request["accepted_at"]}
+                for donor in rng.sample(donor_phones, min(units, len(donor_phones)))
+            ]
+        if status in ("Fulfilled", "Partially Fulfilled"):
+            request["fulfilled_at"] = (created + timedelta(hours=rng.randint(4, 72))).isoformat()
+            if status == "Partially Fulfilled":
+                request["fulfilled_units"] = rng.randint(1, units)
+        requests.append(request)
+
+    inventory = []
+    banks = facilities["Blood Bank"]
+    for n in range(int(donors * INVENTORY_PER_DONOR)):
+        added = now - timedelta(days=rng.randint(0, INVENTORY_EXPIRY_DAYS + 7))
+        inventory.append({
+            "id": f"INV-{n:08d}", "blood_type": weighted(rng, BLOOD_TYPE_WEIGHTS), "units": 1,
+            "expiry": (added + timedelta(days=INVENTORY_EXPIRY_DAYS)).isoformat(),
+            "added_by": rng.choice(banks), "added_at": added.isoformat(),
+            "donor_phone": rng.choice(donor_phones) if donor_phones else None,
+            "test_report": None, "test_report_thumbnail": None
+        })
+
+    return {
+        "users": users,
+        "volunteers": volunteers,
+        "requests": requests,
+        "inventory": inventory,
+        "request_counter": len(requests),
+        "red_alert": False,
+        "rollups": rebuild_rollups(requests)
+    }
+
+def write(stores, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    for store, data in stores.items():
+        save_data(os.path.join(out_dir, STORE_FILES[store]), data)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--donors", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--now", type=datetime.fromisoformat, help="date the data is laid out around (default: now)")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    stores = generate(args.donors, args.seed, now=args.now)
+    write(stores, args.out)
+    for store, data in stores.items():
+        if isinstance(data, (dict, list)) and store != "rollups":
+            print(f"{store:<12} {len(data):>9} records")
+    print(f"Wrote {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Drive many concurrent app.py sessions with Streamlit's AppTest and report how one server copes.
+
+Each session is a scripted user: hospitals log in and file requests, donors
+in those hospitals' districts pledge, blood banks fulfil from stock. AppTest
+swaps Streamlit's global runtime in and out around every run, so sessions
+can't share a process; each runs in its own worker, and they meet in the data
+directory through its lock and change feed, as a server's sessions do. The
+data comes from generate_data.py in a temporary BLOODHUB_DATA_DIR, and
+WhatsApp messages go to a local NDJSON file instead of a gateway.
+
+Reports throughput, rerun latency percentiles per action, lost updates
+(writes the app acknowledged that are missing from the stores afterwards)
+and memory per session.
+
+Usage: python benchmarks/load_test.py [--hospitals 5] [--donors 20] [--blood-banks 3]
+                                      [--actions 10] [--data-donors 10000] [--out load_results.json]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource  # POSIX only; memory per session is skipped elsewhere
+except ImportError:
+    resource = None
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from utils import load_data  # noqa: E402
+from core import STORE_FILES, BLOOD_TYPES  # noqa: E402
+from generate_data import generate, write, ROOT  # noqa: E402
+
+APP_PATH = os.path.join(ROOT, "app.py")
+RERUN_TIMEOUT_SECONDS = 120
+PERCENTILES = (50, 95, 99)
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+class Session:
+    """One scripted browser session; records (action, seconds) for every rerun it triggers.
+
+    A write only counts once the session's own state shows it after the
+    rerun: AppTest drops a click on a button the rerun no longer draws.
+    """
+
+    def __init__(self, phone, role):
+        self.phone = phone
+        self.role = role
+        self.app = AppTest.from_file(APP_PATH, default_timeout=RERUN_TIMEOUT_SECONDS)
+        self.latencies = []
+        self.errors = []
+        self.created = []   # request ids the app confirmed
+        self.pledged = []   # request ids pledged to
+        self.fulfilled = []  # request ids fulfilled from stock
+
+    def run(self, action):
+        start = time.perf_counter()
+        self.app.run()
+        self.latencies.append((action, time.perf_counter() - start))
+        if self.app.exception:
+            self.errors.append(f"{action}: {self.app.exception[0].value}")
+
+    def request(self, request_id):
+        """This session's copy of a request, as the app left it after the last rerun"""
+        return next((r for r in self.app.session_state["requests"] if r["id"] == request_id), None)
+
+    def button(self, label=None, key_prefix=None):
+        for button in self.app.button:
+            if (label is None or button.label == label) and (key_prefix is None or str(button.key).startswith(key_prefix)):
+                return button
+        return None
+
+    def login(self):
+        self.run("open")
+        self.app.text_input(key="phone_input").input(self.phone)
+        self.button("Continue").click()
+        self.run("login")
+        if not self.app.session_state["logged_in"]:
+            raise RuntimeError(f"{self.phone} could not log in")
+
+    def create_request(self, blood_type, urgency):
+        for selectbox in self.app.selectbox:
+            if selectbox.label == "Blood Type":
+                selectbox.set_value(blood_type)
+            elif selectbox.label == "Urgency Level":
+                selectbox.set_value(urgency)
+        self.button("Submit Request").click()
+        self.run("create_request")
+        for success in self.app.success:
+            found = re.search(r"Request #(\d+) created", str(success.value))
+            if found:
+                self.created.append(int(found.group(1)))
+
+    def pledge(self):
+        button = self.button(key_prefix="pledge_")
+        if button is None:
+            self.run("refresh")
+            return
+        request_id = int(str(button.key).split("_")[1])
+        button.click()
+        self.run("pledge")
+        request = self.request(request_id)
+        if request and any(pledge.get("phone") == self.phone for pledge in request.get("pledged_donors", [])):
+            self.pledged.append(request_id)
+
+    def fulfil(self):
+        button = self.button(key_prefix="fulfill_") or self.button(key_prefix="partial_")
+        if button is None:
+            self.run("refresh")
+            return
+        request_id = int(str(button.key).split("_")[1])
+        button.click()
+        self.run("fulfil")
+        request = self.request(request_id)
+        if (request and request.get("fulfilled_by") == self.phone
+                and request["status"] in ("Fulfilled", "Partially Fulfilled")):
+            self.fulfilled.append(request_id)
+
+def script(session, actions, blood_types, rng):
+    """A session's whole life: log in, then its role's action over and over"""
+    session.login()
+    for _ in range(actions):
+        if session.role == "Hospital":
+            session.create_request(rng.choice(blood_types), rng.choice(["Normal", "Urgent", "Critical"]))
+        elif session.role == "Donor":
+            session.pledge()
+        else:
+            session.fulfil()
+        time.sleep(rng.uniform(0, 0.2))  # think time, so sessions interleave
+
+def run_session(phone, role, actions, blood_types, seed):
+    """One session's whole life, in a worker process; returns what it recorded"""
+    rss_before = max_rss_mb()
+    session = Session(phone, role)
+    try:
+        script(session, actions, blood_types, random.Random(seed))
+    except Exception as error:  # ends this session only; reported with the errors
+        session.errors.append(f"crashed: {error!r}")
+    return {
+        "phone": phone, "role": role, "latencies": session.latencies, "errors": session.errors,
+        "created": session.created, "pledged": session.pledged, "fulfilled": session.fulfilled,
+        "memory_mb": max_rss_mb() - rss_before if rss_before is not None else None,
+    }
+
+def lost_updates(sessions, data_dir):
+    """Acknowledged writes that never reached the store files"""
+    requests = {request["id"]: request for request in load_data(os.path.join(data_dir, STORE_FILES["requests"]), [])}
+    lost = []
+    for session in sessions:
+        phone = session["phone"]
+        for request_id in session["created"]:
+            if request_id not in requests:
+                lost.append(f"request #{request_id} created by {phone}")
+        for request_id in session["pledged"]:
+            pledges = requests.get(request_id, {}).get("pledged_donors", [])
+            if not any(pledge.get("phone") == phone for pledge in pledges):
+                lost.append(f"pledge by {phone} on #{request_id}")
+        for request_id in session["fulfilled"]:
+            if requests.get(request_id, {}).get("status") not in ("Fulfilled", "Partially Fulfilled"):
+                lost.append(f"fulfilment of #{request_id} by {phone}")
+    return lost
+
+def pick_sessions(stores, hospitals, donors, blood_banks, rng):
+    """(phone, role) of approved hospitals and blood banks, and of donors living in those hospitals' districts"""
+    users = stores["users"]
+    hospital_phones = [p for p, u in users.items() if u["role"] == "Hospital" and u.get("approved")][:hospitals]
+    districts = {users[p]["district_id"] for p in hospital_phones}
+    donor_phones = [p for p, u in users.items()
+                    if u["role"] == "Donor" and u["district_id"] in districts and not u.get("last_donation_date")]
+    bank_phones = [p for p, u in users.items() if u["role"] == "Blood Bank" and u.get("approved")][:blood_banks]
+    sessions = ([(p, "Hospital") for p in hospital_phones] +
+                [(p, "Donor") for p in rng.sample(donor_phones, min(donors, len(donor_phones)))] +
+                [(p, "Blood Bank") for p in bank_phones])
+    # Hospitals ask for the blood groups their donor sessions have, so pledges have something to find
+    blood_types = sorted({users[phone]["blood_group"] for phone, role in sessions if role == "Donor"}) or BLOOD_TYPES
+    return sessions, blood_types
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hospitals", type=int, default=5)
+    parser.add_argument("--donors", type=int, default=20, help="donor sessions")
+    parser.add_argument("--blood-banks", type=int, default=3)
+    parser.add_argument("--actions", type=int, default=10, help="actions per session after login")
+    parser.add_argument("--data-donors", type=int, default=10000, help="size of the generated data set")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", default="load_results.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    out_path = os.path.abspath(args.out)
+    with tempfile.TemporaryDirectory() as data_dir:
+        stores = generate(args.data_donors, args.seed)
+        write(stores, data_dir)
+        notify_log = os.path.join(data_dir, "whatsapp.ndjson")
+        os.environ.update({
+            "BLOODHUB_DATA_DIR": data_dir,
+            "BLOODHUB_NOTIFY_LOG": notify_log,
+            "BLOODHUB_SNAPSHOT_DIR": os.path.join(data_dir, "snapshots"),
+        })
+        # app.py reads kerala_locations.json and location_ids.json from the working directory
+        os.chdir(ROOT)
+
+        picked, blood_types = pick_sessions(stores, args.hospitals, args.donors, args.blood_banks, rng)
+        del stores
+        seeds = [rng.random() for _ in picked]
+        start = time.perf_counter()
+        # Workers inherit the environment and working directory set above
+        with ProcessPoolExecutor(max_workers=len(picked)) as pool:
+            futures = [pool.submit(run_session, phone, role, args.actions, blood_types, seed)
+                       for (phone, role), seed in zip(picked, seeds)]
+            sessions = [future.result() for future in futures]
+        elapsed = time.perf_counter() - start
+
+        lost = lost_updates(sessions, data_dir)
+        messages = sum(1 for _ in open(notify_log, encoding="utf-8")) if os.path.exists(notify_log) else 0
+
+    by_action = {}
+    for session in sessions:
+        for action, seconds in session["latencies"]:
+            by_action.setdefault(action, []).append(seconds)
+    reruns = sum(len(values) for values in by_action.values())
+    memory = [session["memory_mb"] for session in sessions if session["memory_mb"] is not None]
+    report = {
+        "sessions": {role: sum(1 for s in sessions if s["role"] == role) for role in ("Hospital", "Donor", "Blood Bank")},
+        "data_donors": args.data_donors,
+        "elapsed_s": elapsed,
+        "reruns": reruns,
+        "reruns_per_s": reruns / elapsed if elapsed else None,
+        "latency_ms": {
+            action: dict({f"p{q}": percentile(values, q) * 1000 for q in PERCENTILES}, count=len(values))
+            for action, values in sorted(by_action.items())
+        },
+        "writes": {
+            "requests_created": sum(len(s["created"]) for s in sessions),
+            "pledges": sum(len(s["pledged"]) for s in sessions),
+            "fulfilments": sum(len(s["fulfilled"]) for s in sessions),
+            "whatsapp_messages": messages,
+        },
+        "lost_updates": lost,
+        "errors": [error for s in sessions for error in s["errors"]],
+        "memory_mb_per_session": sum(memory) / len(memory) if memory else None,
+    }
+
+    print(f"{len(sessions)} sessions, {reruns} reruns in {elapsed:.1f}s ({report['reruns_per_s']:.1f} reruns/s)")
+    for action, stats in report["latency_ms"].items():
+        print(f"  {action:<15} n={stats['count']:<5} " + " ".join(f"p{q}={stats[f'p{q}']:.0f}ms" for q in PERCENTILES))
+    print(f"  writes: {report['writes']}")
+    print(f"  lost updates: {len(lost)}   errors: {len(report['errors'])}")
+    if report["memory_mb_per_session"] is not None:
+        print(f"  peak memory growth per session: {report['memory_mb_per_session']:.1f} MB")
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out_path}")
+    sys.exit(1 if lost else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""UI-free BloodHub engine: stores behind a Repository, business rules in BloodHub"""
+from core.constants import (BLOOD_TYPES, URGENCY_LEVELS, REQUEST_STATUSES, REQUEST_SORTS, STORE_FILES,
+                            STORE_DEFAULTS, DONOR_COOLDOWN_DAYS, ORGANIZATION_TYPES)
+from core.records import User, Request, InventoryUnit, Match
+from core.repository import Repository, StoreCorruptError
+from core.services import BloodHub, DuplicateRequestError, generate_unique_id
+from core.rematch import rematch_open_requests
@@ -0,0 +1,184 @@
+import heapq
+from datetime import datetime
+from core.constants import URGENCY_LEVELS
+
+# Cost of moving one unit between a bank and a hospital, by distance tier (see MATCH_DISTANCES)
+TRAVEL_COSTS = {1: 0, 2: 10, 3: 30, 4: 100}
+# Cost per day of shelf life a unit has left: spending units that expire sooner (FEFO) is cheaper
+EXPIRY_COST_PER_DAY = 1
+# Value of supplying one unit by urgency; far above any travel and expiry cost,
+# so the planner always supplies as many units as it can, most urgent first
+URGENCY_VALUES = {"Critical": 3000, "Urgent": 2000, "Normal": 1000}
+
+def distance_tier(a, b):
+    """Priority-style distance between two located records: 1 same village … 4 another district"""
+    if a.get("district_id") != b.get("district_id"):
+        return 4
+    if a.get("taluk_id") != b.get("taluk_id"):
+        return 3
+    if a.get("village_id") and a.get("village_id") == b.get("village_id"):
+        return 1
+    return 2
+
+def min_cost_flow(edges, source, sink):
+    """Cheapest flow from source to sink by successive shortest paths.
+
+    edges is [(from, to, capacity, cost per unit)] over any hashable nodes;
+    costs may be negative as long as there is no negative cycle. Paths are
+    added while they lower the total cost. Returns the flow on each edge.
+    """
+    index = {source: 0}
+    for u, v, _, _ in edges:
+        index.setdefault(u, len(index))
+        index.setdefault(v, len(index))
+    graph = [[] for _ in index]  # node -> [to, capacity, cost, reverse edge position]
+    positions = []
+    for u, v, capacity, cost in edges:
+        u, v = index[u], index[v]
+        positions.append((u, len(graph[u])))
+        graph[u].append([v, capacity, cost, len(graph[v])])
+        graph[v].append([u, 0, -cost, len(graph[u]) - 1])
+    start, end = 0, index.get(sink)
+    if end is None:
+        return [0] * len(edges)
+
+    # Bellman-Ford once, so every reduced cost is non-negative and Dijkstra works from then on
+    potential = [None] * len(graph)
+    potential[start] = 0
+    changed = True
+    while changed:
+        changed = False
+        for u, out in enumerate(graph):
+            if potential[u] is None:
+                continue
+            for v, capacity, cost, _ in out:
+                if capacity > 0 and (potential[v] is None or potential[u] + cost < potential[v]):
+                    potential[v] = potential[u] + cost
+                    changed = True
+    potential = [p or 0 for p in potential]
+
+    while True:
+        dist = [None] * len(graph)
+        previous = [None] * len(graph)
+        dist[start] = 0
+        heap = [(0, start)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for position, (v, capacity, cost, _) in enumerate(graph[u]):
+                if capacity <= 0:
+                    continue
+                nd = d + cost + potential[u] - potential[v]
+                if dist[v] is None or nd < dist[v]:
+                    dist[v] = nd
+                    previous[v] = (u, position)
+                    heapq.heappush(heap, (nd, v))
+        if dist[end] is None:
+            break
+        path_cost = dist[end] + potential[end] - potential[start]
+        for v, d in enumerate(dist):
+            if d is not None:
+                potential[v] += d
+        if path_cost >= 0:
+            break
+        # Push as much as the narrowest edge on the path allows
+        push, v = None, end
+        while v != start:
+            u, position = previous[v]
+            capacity = graph[u][position][1]
+            push = capacity if push is None else min(push, capacity)
+            v = u
+        v = end
+        while v != start:
+            u, position = previous[v]
+            edge = graph[u][position]
+            edge[1] -= push
+            graph[v][edge[3]][1] += push
+            v = u
+
+    return [capacity - graph[u][position][1] for (u, position), (_, _, capacity, _) in zip(positions, edges)]
+
+def plan_allocation(needs, stock, now):
+    """Which stock units go to which requests, cheapest first.
+
+    needs is [(request, units still needed)], stock [(inventory item, holding
+    bank's user record, units free)], both already limited to the requests
+    and banks to plan over. Units only go to requests of the same blood type.
+    Returns [{request_id, inventory_id, from_bank, units, distance, cost}],
+    most urgent requests first.
+
+    A unit's cost is its bank's travel cost plus its expiry cost, so the
+    network runs lots (a bank's units expiring on one day) -> bank ->
+    request instead of linking every unit to every request.
+    """
+    today = now.date()
+    urgency_order = list(URGENCY_LEVELS)
+    rank = {request["id"]: -urgency_order.index(request["urgency"]) for request, _ in needs}
+    plan = []
+    for blood_type in sorted({request.get("blood_type") for request, units in needs if units > 0}):
+        requests = {request["id"]: (request, units) for request, units in needs
+                    if units > 0 and request.get("blood_type") == blood_type}
+        lots = {}  # (bank phone, days left) -> [[item, units free]], soonest expiry first
+        banks = {}
+        for item, bank, units in stock:
+            if units > 0 and item.get("blood_type") == blood_type:
+                days_left = max(0, (datetime.fromisoformat(item["expiry"]).date() - today).days)
+                lots.setdefault((item["added_by"], days_left), []).append([item, units])
+                banks[item["added_by"]] = bank
+        if not lots:
+            continue
+
+        edges = []
+        for (phone, days_left), entries in lots.items():
+            units = sum(units for _, units in entries)
+            edges.append(("source", ("lot", phone, days_left), units, 0))
+            edges.append((("lot", phone, days_left), ("bank", phone), units, days_left * EXPIRY_COST_PER_DAY))
+        travel = {}
+        for phone, bank in banks.items():
+            for request_id, (request, units) in requests.items():
+                value = URGENCY_VALUES.get(request.get("urgency"), URGENCY_VALUES["Normal"])
+                travel[(phone, request_id)] = TRAVEL_COSTS[distance_tier(bank, request)]
+                edges.append((("bank", phone), ("request", request_id), units, travel[(phone, request_id)] - value))
+        for request_id, (_, units) in requests.items():
+            edges.append((("request", request_id), "sink", units, 0))
+        flows = min_cost_flow(edges, "source", "sink")
+
+        # Any split of a bank's lots over its requests costs the same; hand out soonest-expiring units first
+        issued = {}  # bank phone -> [[item, units, days left]] taken from its lots
+        shipped = {}  # bank phone -> [(request_id, units)]
+        for (u, v, _, _), flow in zip(edges, flows):
+            if not flow:
+                continue
+            if u[0] == "lot":
+                _, phone, days_left = u
+                for entry in lots[(phone, days_left)]:
+                    take = min(flow, entry[1])
+                    if take:
+                        issued.setdefault(phone, []).append([entry[0], take, days_left])
+                        flow -= take
+            elif u[0] == "bank":
+                shipped.setdefault(u[1], []).append((v[1], flow))
+        for phone, deliveries in shipped.items():
+            units_out = sorted(issued.get(phone, []), key=lambda entry: entry[2])
+            deliveries.sort(key=lambda delivery: rank[delivery[0]])
+            for request_id, units in deliveries:
+                request = requests[request_id][0]
+                value = URGENCY_VALUES.get(request.get("urgency"), URGENCY_VALUES["Normal"])
+                while units:
+                    entry = units_out[0]
+                    take = min(units, entry[1])
+                    plan.append({
+                        "request_id": request_id,
+                        "inventory_id": entry[0]["id"],
+                        "from_bank": phone,
+                        "units": take,
+                        "distance": distance_tier(banks[phone], request),
+                        "cost": (travel[(phone, request_id)] + entry[2] * EXPIRY_COST_PER_DAY - value) * take
+                    })
+                    units -= take
+                    entry[1] -= take
+                    if not entry[1]:
+                        units_out.pop(0)
+    plan.sort(key=lambda leg: (rank[leg["request_id"]], leg["request_id"], leg["distance"]))
+    return plan
@@ -0,0 +1,73 @@
+import os
+from contextlib import contextmanager
+from serialization import dumps, loads
+
+try:
+    import fcntl  # POSIX advisory locks; on Windows appends rely on O_APPEND alone
+except ImportError:
+    fcntl = None
+
+CHANGE_LOG = "changes.log"
+
+# Start a fresh log once the current one grows past this
+MAX_LOG_BYTES = 8 << 20
+
+@contextmanager
+def locked(path):
+    """Exclusive lock shared by every process writing the log at path"""
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def log_position(path):
+    """(inode, size) of the log; the size is the feed's monotonic version"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None, 0
+    return stat.st_ino, stat.st_size
+
+def append_events(path, events):
+    """Append change events as NDJSON; starts a new log (new inode) when the old one is full.
+
+    Returns the (inode, size) just after our events.
+    """
+    payload = b"".join(dumps(event) + b"\n" for event in events)
+    with locked(path):
+        inode, size = log_position(path)
+        if size and size + len(payload) > MAX_LOG_BYTES:
+            # Readers notice the new inode and fall back to reloading the store files
+            tmp_path = f"{path}.tmp"
+            open(tmp_path, "wb").close()
+            os.replace(tmp_path, path)
+        with open(path, "ab") as f:
+            f.write(payload)
+        return log_position(path)
+
+def read_events(path, inode, offset):
+    """Events appended since (inode, offset).
+
+    Returns (events, inode, offset) for the next call; events is None when
+    the log was replaced since inode, meaning the caller missed changes and
+    must reload everything.
+    """
+    current_inode, size = log_position(path)
+    if inode is None:
+        # The log didn't exist yet when we started reading, so all of it is new to us
+        inode, offset = current_inode, 0
+    elif current_inode != inode:
+        return None, current_inode, size
+    if size <= offset:
+        return [], inode, offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size - offset)
+    # A writer may be mid-line; stop at the last complete event
+    end = data.rfind(b"\n") + 1
+    events = [loads(line) for line in data[:end].splitlines() if line]
+    return events, inode, offset + end
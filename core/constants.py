@@ -0,0 +1,62 @@
+from rollups import empty_rollups
+
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "O+", "O-", "AB+", "AB-"]
+URGENCY_LEVELS = {
+    "Normal": {"timeout": 120, "search_radius": "Taluk", "notification": "🔵"},
+    "Urgent": {"timeout": 45, "search_radius": "District", "notification": "🟠"},
+    "Critical": {"timeout": 15, "search_radius": "FullState", "notification": "🔴"}
+}
+
+# Kinds of organization a profile can pick
+ORGANIZATION_TYPES = ["NGO", "NSS", "NCC", "Red Cross", "Educational Institution", "Other"]
+
+REQUEST_STATUSES = ["Pending", "Accepted", "Partially Fulfilled", "Fulfilled", "Cancelled"]
+# Sort label -> (key, reverse) for request boards
+REQUEST_SORTS = {
+    "Newest first": (lambda r: r["created_at"], True),
+    "Oldest first": (lambda r: r["created_at"], False),
+    "Most urgent": (lambda r: (list(URGENCY_LEVELS).index(r["urgency"]), r["created_at"]), True),
+    "Expiring soonest": (lambda r: r["expires_at"], False)
+}
+
+# Days a donor waits between donations, unless Red Alert is on
+DONOR_COOLDOWN_DAYS = 90
+# Shelf life of a donated unit
+INVENTORY_EXPIRY_DAYS = 42
+# Admins are alerted when a blood type drops below this many units
+LOW_INVENTORY_UNITS = 5
+# Request statuses the district allocation planner still supplies
+ALLOCATABLE_STATUSES = ("Pending", "Partially Fulfilled")
+# Lifecycle of one planned bank-to-hospital transfer
+TRANSFER_STATUSES = ["Proposed", "Confirmed", "Declined", "Cancelled"]
+# A requester can't repeat a pending request for the same blood type within this window
+DUPLICATE_REQUEST_SECONDS = 3600
+
+# Data format version run_migrations brings a data directory to, recorded in MIGRATIONS_FILE;
+# bump it when run_migrations gains a step so every data directory runs them once more
+MIGRATIONS_VERSION = 1
+MIGRATIONS_FILE = "migrations.json"
+
+# Store name -> backing file for every persisted store
+STORE_FILES = {
+    "users": "users.json",
+    "requests": "requests.json",
+    "inventory": "inventory.json",
+    "red_alert": "red_alert.json",
+    "request_counter": "request_counter.json",
+    "volunteers": "volunteers.json",
+    "rollups": "rollups.json",
+    "transfers": "transfers.json"
+}
+
+# Factory for a store's value when its file is missing or unreadable
+STORE_DEFAULTS = {
+    "users": dict,
+    "requests": list,
+    "inventory": list,
+    "red_alert": bool,
+    "request_counter": int,
+    "volunteers": list,
+    "rollups": empty_rollups,
+    "transfers": list
+}
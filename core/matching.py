@@ -0,0 +1,53 @@
+from core.constants import URGENCY_LEVELS
+from core.records import Match
+
+# How far a match at each priority is, shown next to matched donors
+MATCH_DISTANCES = {1: "0-5km", 2: "5-10km", 3: "10-20km", 4: "20+ km"}
+
+def match_donors(request, by_district, in_cooldown):
+    """Hierarchical donor matching: Village → Taluk → District → State.
+
+    by_district is the donor index for the request's blood type (district_id
+    -> candidates) and in_cooldown a predicate on donor phones. Matches are
+    references to the donor, not copies. Pure, so it also runs in worker
+    processes.
+    """
+    matched_donors = []
+    req_district = request.get("district_id")
+    req_taluk = request.get("taluk_id")
+    req_village = request.get("village_id")
+    search_scope = URGENCY_LEVELS[request["urgency"]]["search_radius"]
+
+    # Skip donors outside the district unless search_scope is FullState
+    if search_scope == "FullState":
+        candidates = [donor for group in by_district.values() for donor in group]
+    else:
+        candidates = by_district.get(req_district, [])
+
+    for donor in candidates:
+        if donor["volunteer_id"] is None and in_cooldown(donor["phone"]):
+            continue
+
+        # Check Village level
+        if search_scope == "Taluk" and req_village and donor["village_id"] == req_village:
+            priority = 1
+        # Check Taluk level
+        elif search_scope == "Taluk" and donor["taluk_id"] == req_taluk:
+            priority = 2
+        # District level
+        elif search_scope == "District" and donor["district_id"] == req_district:
+            priority = 3
+        # Full state
+        else:
+            priority = 4
+
+        match = Match()
+        match.phone = donor["phone"]
+        match.priority = priority
+        if donor["volunteer_id"]:
+            match.volunteer_id = donor["volunteer_id"]
+        matched_donors.append(match)
+
+    # Sort by priority (closest first)
+    matched_donors.sort(key=lambda x: x["priority"])
+    return matched_donors
@@ -0,0 +1,133 @@
+import sys
+from collections.abc import MutableMapping
+
+class Record(MutableMapping):
+    """A dict-compatible record whose known fields live in __slots__.
+
+    Subclasses list their fields in FIELDS (and as __slots__); a field is
+    "present" when its slot is set, so `key in record`, get() and
+    iteration behave exactly like the dicts they replace. Unknown keys go to
+    a small overflow dict. Values of INTERNED fields (blood types, statuses,
+    roles...) are interned so a million records share a handful of strings.
+    CONVERTERS turn stored values (e.g. lists of dicts) into their in-memory
+    form on assignment.
+    """
+    __slots__ = ("_extra",)
+    FIELDS = ()
+    INTERNED = frozenset()
+    CONVERTERS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, data=()):
+        self._extra = None
+        for key, value in (data.items() if isinstance(data, (dict, Record)) else data):
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET:
+            converter = self.CONVERTERS.get(key)
+            if converter is not None:
+                value = converter(value)
+            elif key in self.INTERNED and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class Match(Record):
+    """A matched donor stored as a reference: phone (or the organization's phone
+    plus volunteer_id) and priority. Name, location and distance are looked up
+    when shown, see BloodHub.describe_match."""
+    FIELDS = ("phone", "priority", "volunteer_id")
+    __slots__ = FIELDS
+
+    @classmethod
+    def from_stored(cls, match):
+        """Match from a stored entry, dropping the copies older versions kept"""
+        if isinstance(match, Match):
+            return match
+        return cls((key, match[key]) for key in cls.FIELDS if key in match)
+
+def load_matches(matches):
+    return [Match.from_stored(match) for match in matches]
+
+class User(Record):
+    FIELDS = ("role", "name", "profile", "approved", "district", "taluk", "village", "district_id", "taluk_id",
+              "village_id", "blood_group", "height", "weight", "chronic_disease", "last_donation_date", "points",
+              "cooldown_override", "organization_type", "email", "employee_id", "certificate",
+              "certificate_thumbnail", "inventory", "notifications")
+    __slots__ = FIELDS
+    INTERNED = frozenset({"role", "blood_group", "organization_type"})
+
+class Request(Record):
+    FIELDS = ("id", "requester", "blood_type", "units", "urgency", "status", "district", "taluk", "village",
+              "district_id", "taluk_id", "village_id", "created_at", "expires_at", "accepted_at", "fulfilled_at",
+              "fulfilled_by", "fulfilled_units", "matched_donors", "pledged_donors", "inventory_ids", "test_results")
+    __slots__ = FIELDS
+    INTERNED = frozenset({"requester", "blood_type", "urgency", "status", "fulfilled_by"})
+    CONVERTERS = {"matched_donors": load_matches}
+
+class InventoryUnit(Record):
+    FIELDS = ("id", "blood_type", "units", "expiry", "added_by", "added_at", "donor_phone", "request_id",
+              "test_report", "test_report_thumbnail")
+    __slots__ = FIELDS
+    INTERNED = frozenset({"blood_type", "added_by"})
+
+# Store -> record type of its entries; other stores keep plain dicts
+RECORD_TYPES = {"users": User, "requests": Request, "inventory": InventoryUnit}
+
+def load_records(store, data):
+    """In-memory form of a store as read from disk"""
+    record_type = RECORD_TYPES.get(store)
+    if record_type is None:
+        return data
+    if isinstance(data, dict):
+        return {key: record_type(value) for key, value in data.items()}
+    return [record_type(value) for value in data]
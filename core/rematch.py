@@ -0,0 +1,147 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from core.matching import match_donors
+from metrics import DONOR_MATCHES
+
+# Statuses of requests that still need donors
+OPEN_STATUSES = ("Pending", "Partially Fulfilled")
+
+# Rematching runs in-process unless the caller asks for workers: measured on
+# 100k donors (benchmarks/bench_rematch.py), the pool loses at every size.
+# Most of matching is building the Match records (3.0 s of 4.2 s for 300
+# requests), and they have to end up in this process; receiving them from a
+# worker costs more than building them here (500 requests: 9.2 s to match,
+# 9.2 s just to unpickle the results), before 1.3 s to spawn 4 workers.
+
+# Per-worker state set once by the pool initializer, so shards don't re-send it
+_cooldown = frozenset()
+
+def _init_worker(cooldown_phones):
+    global _cooldown
+    _cooldown = frozenset(cooldown_phones)
+
+def match_shard(shard):
+    """Worker entry point: {request_id: matched_donors} for one district's requests"""
+    return {
+        request["id"]: match_donors(request, shard["donors"][request["blood_type"]], _cooldown.__contains__)
+        for request in shard["requests"]
+    }
+
+def build_shards(requests, donor_index):
+    """Open requests grouped by district, each with just the donors its requests can match.
+
+    Most requests only look inside their own district, so a shard carries
+    that district's candidates; state-wide (Critical) requests carry the
+    whole blood group.
+    """
+    shards = {}
+    for request in requests:
+        shard = shards.setdefault(request.get("district_id"), {"requests": [], "donors": {}})
+        shard["requests"].append({field: request.get(field) for field in
+                                  ("id", "blood_type", "urgency", "district_id", "taluk_id", "village_id")})
+        by_district = donor_index.get(request["blood_type"], {})
+        if request["urgency"] == "Critical":
+            shard["donors"][request["blood_type"]] = by_district
+        else:
+            donors = shard["donors"].setdefault(request["blood_type"], {})
+            if donors is not by_district:
+                donors[request.get("district_id")] = by_district.get(request.get("district_id"), [])
+    return list(shards.values())
+
+def match_shards(shards, cooldown_phones, workers=1, progress=None):
+    """{request_id: matched_donors} for every shard; in-process for one worker, else across a process pool"""
+    results = {}
+    if workers == 1:
+        _init_worker(cooldown_phones)
+        for done, shard in enumerate(shards, 1):
+            results.update(match_shard(shard))
+            if progress:
+                progress(done, len(shards))
+        return results
+    # spawn, not fork: the Streamlit server is multi-threaded
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(cooldown_phones,)) as pool:
+        futures = [pool.submit(match_shard, shard) for shard in shards]
+        for done, future in enumerate(as_completed(futures), 1):
+            results.update(future.result())
+            if progress:
+                progress(done, len(shards))
+    return results
+
+def donor_key(donor):
+    return donor.get("volunteer_id") or donor["phone"]
+
+def rematch_open_requests(hub, workers=None, progress=None):
+    """Re-run matching for every open, unexpired request and notify newly matched donors.
+
+    Shards are matched in-process, or across a pool of workers processes if given;
+    progress(done, total) is called as shards finish. Each donor, and each
+    organization for its volunteers, gets one notification listing all the
+    requests they newly match. Matching runs outside the lock unless the
+    caller holds it (the admin dashboard's Red Alert does); the matches
+    are written back and the notices sent in one transaction, onto the
+    latest copy of each request and inbox. Returns a summary dict.
+    """
+    repo = hub.repo
+    now = datetime.now().isoformat()
+    requests = [
+        r for r in repo["requests"]
+        if r.get("status") in OPEN_STATUSES and r.get("expires_at", "") > now
+    ]
+    summary = {"requests": len(requests), "rematched": 0, "new_matches": 0, "notified": 0}
+    if not requests:
+        return summary
+
+    shards = build_shards(requests, hub.donor_index())
+    cooldown_phones = [phone for phone, user in repo["users"].items()
+                       if user.get("role") == "Donor" and hub.donor_in_cooldown(phone)]
+    results = match_shards(shards, cooldown_phones, min(workers or 1, len(shards)), progress)
+
+    with repo.transaction():
+        _write_back(hub, requests, results, summary)
+    return summary
+
+def _write_back(hub, requests, results, summary):
+    """Store the new matches and notify whoever is new on a request; call inside a transaction"""
+    repo = hub.repo
+    # The poll may have replaced a request, or another session closed it since it was matched
+    current = {request["id"]: request for request in repo["requests"]}
+    # Apply results and collect who is new on each request
+    new_by_contact = {}
+    volunteers = hub.volunteer_by_id()
+    for matched in requests:
+        request = current.get(matched["id"])
+        if request is None or request.get("status") not in OPEN_STATUSES:
+            continue
+        matches = results[request["id"]]
+        known = {donor_key(donor) for donor in request.get("matched_donors", [])}
+        fresh = [donor for donor in matches if donor_key(donor) not in known]
+        if not fresh:
+            continue
+        request["matched_donors"] = matches
+        DONOR_MATCHES.inc(request["urgency"], by=len(fresh))
+        repo.mark_dirty("requests", request["id"])
+        summary["rematched"] += 1
+        summary["new_matches"] += len(fresh)
+        for donor in fresh:
+            entry = new_by_contact.setdefault(donor["phone"], {"requests": [], "volunteers": set()})
+            if request["id"] not in entry["requests"]:
+                entry["requests"].append(request["id"])
+            if donor.get("volunteer_id"):
+                entry["volunteers"].add(volunteers.get(donor["volunteer_id"], {}).get("name", ""))
+
+    # One coalesced notice per donor / organization
+    for phone, entry in new_by_contact.items():
+        ids = ", ".join(f"#{request_id}" for request_id in entry["requests"][:10])
+        if len(entry["requests"]) > 10:
+            ids += f" and {len(entry['requests']) - 10} more"
+        if entry["volunteers"]:
+            message = (f"🚨 Red Alert: {len(entry['volunteers'])} of your volunteers now match "
+                       f"{len(entry['requests'])} open request(s): {ids}")
+        else:
+            message = f"🚨 Red Alert: cooldowns are suspended and you now match {len(entry['requests'])} open request(s): {ids}"
+        hub.notify_user(phone, {"type": "red_alert", "message": message, "request_ids": entry["requests"],
+                                "volunteers": sorted(entry["volunteers"])})
+        hub.send_message(phone, message + ". Please check the Kerala Blood Hub app.")
+        summary["notified"] += 1
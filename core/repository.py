@@ -0,0 +1,643 @@
+import os
+import uuid
+import zlib
+from contextlib import contextmanager
+from serialization import read_file, dumps, encode
+from datetime import datetime
+from utils import load_data, save_data
+from core import wal
+from core.constants import STORE_FILES, STORE_DEFAULTS, MIGRATIONS_FILE
+from core.changefeed import CHANGE_LOG, append_events, read_events, log_position
+from core.records import RECORD_TYPES, load_records
+
+# Stores whose changes are published record by record: store -> how records are keyed
+KEYED_STORES = {"users": "phone", "requests": "id", "inventory": "id", "volunteers": "id", "transfers": "id"}
+# Small stores published by value
+VALUE_STORES = ("red_alert", "request_counter")
+# Large fields published as deltas against the copy last published: a "blob" by its digest while it is
+# unchanged, a "list" (an inbox) by the items added at its end
+DELTA_FIELDS = {
+    "users": {"certificate": "blob", "certificate_thumbnail": "blob", "notifications": "list"},
+    "requests": {"test_results": "blob"},
+    "inventory": {"test_report": "blob", "test_report_thumbnail": "blob"},
+}
+
+class StoreCorruptError(Exception):
+    """A store file that exists but can't be parsed, with no snapshot or log to rebuild it from"""
+
+def field_digest(value):
+    """Checksum naming one version of a field, so deltas can say which copy they apply to"""
+    return zlib.crc32(dumps(value))
+
+def merge_delta(old, record, delta, fits=None):
+    """The whole record a put with delta fields stands for, from the record it replaces.
+
+    fits(field, spec, old value), if given, checks each delta against that
+    copy first. Returns None when there is no old record or a delta doesn't fit.
+    """
+    merged = dict(record)
+    for field, spec in delta.items():
+        if "keep" not in spec and "from" not in spec:
+            continue  # sent whole
+        if old is None or (fits is not None and not fits(field, spec, old.get(field))):
+            return None
+        if "from" in spec:
+            merged[field] = (old.get(field) or [])[:spec["from"]] + spec["items"]
+        elif field in old:
+            merged[field] = old[field]
+    return merged
+
+def apply_event(data, store, event, fits=None):
+    """Apply one put/delete event to a keyed store held as a dict or a list.
+
+    A put's delta fields are filled in from the record it replaces; returns
+    False, changing nothing, when they can't be (see merge_delta).
+    """
+    key = event["key"]
+    if isinstance(data, dict):
+        pos = key if key in data else None
+    else:
+        field = KEYED_STORES[store]
+        pos = next((i for i in range(len(data) - 1, -1, -1) if data[i].get(field) == key), None)
+    if event["op"] == "delete":
+        if pos is not None:
+            del data[pos]
+        return True
+    record = event["record"]
+    if event.get("delta"):
+        record = merge_delta(None if pos is None else data[pos], record, event["delta"], fits)
+        if record is None:
+            return False
+    if store in RECORD_TYPES:
+        record = RECORD_TYPES[store](record)
+    if pos is None and not isinstance(data, dict):
+        data.append(record)
+    else:
+        data[key if pos is None else pos] = record
+    return True
+
+class Repository:
+    """The persisted stores plus their unit-of-work bookkeeping.
+
+    Everything lives in one mapping: a plain dict for scripts, workers and
+    benchmarks, or st.session_state for the Streamlit app. Callers change
+    records in place and call mark_dirty; flush writes each changed store
+    back to disk once and publishes the changed records on the change feed,
+    which other sessions and processes apply with poll. Flushes hold the
+    data directory's lock and poll first, so a store is always written as
+    the latest copy on disk plus this session's changed records; an edit to
+    a record other sessions also change goes in a transaction, so it starts
+    from their latest copy of it. Large fields (certificates, inboxes) go out
+    as deltas against the copy last published; see pack_delta.
+
+    With the write-ahead log on, every flush is logged (and fsynced) before
+    the store files are touched, and load rebuilds the stores from the
+    newest snapshot plus the log after it, checking them against the files;
+    see recover and checkpoint.
+    """
+
+    def __init__(self, state=None, data_dir=".", wal=wal.WAL_ENABLED):
+        self.state = {} if state is None else state
+        self.data_dir = data_dir
+        self.use_wal = wal
+        self._lock_depth = 0
+
+    def path(self, store):
+        """File backing a store"""
+        return os.path.join(self.data_dir, STORE_FILES[store])
+
+    def load(self):
+        """Load every store not loaded yet and set up the bookkeeping; cheap after the first call"""
+        for key in ("disk_versions", "dirty_stores", "store_versions", "quiet_keys", "published", "feed_versions"):
+            if key not in self.state:
+                self.state[key] = {}
+        if "feed" not in self.state:
+            # Position taken before the files are read, so no change can fall in between
+            inode, offset = log_position(self.feed_path())
+            self.state["feed"] = {"writer": uuid.uuid4().hex, "inode": inode, "offset": offset}
+        missing = [store for store in STORE_FILES if store not in self.state]
+        if not missing:
+            return self
+        if self.use_wal:
+            with self.locked():
+                stores, versions = self.recover(missing)
+        else:
+            versions = {store: self.disk_version(store) for store in missing}
+            stores = {store: self.read_store(store) for store in missing}
+        for store in missing:
+            self.state["disk_versions"][store] = versions[store]
+            self.state[store] = stores[store]
+        return self
+
+    def read_store(self, store):
+        """A store's file in its in-memory form (slotted records for users, requests and inventory).
+
+        A missing file is an empty store; a file that doesn't parse raises
+        StoreCorruptError rather than passing for an empty one.
+        """
+        try:
+            data = read_file(self.path(store))
+        except FileNotFoundError:
+            data = STORE_DEFAULTS[store]()
+        except ValueError as error:
+            raise StoreCorruptError(f"{STORE_FILES[store]} is damaged ({error})") from error
+        return load_records(store, data)
+
+    def __getitem__(self, store):
+        return self.state[store]
+
+    def __setitem__(self, store, value):
+        self.state[store] = value
+
+    def feed_path(self):
+        return os.path.join(self.data_dir, CHANGE_LOG)
+
+    def migration_version(self):
+        """Data format version the data directory was migrated to; 0 if it never was"""
+        return load_data(os.path.join(self.data_dir, MIGRATIONS_FILE), {}).get("version", 0)
+
+    def set_migration_version(self, version):
+        save_data(os.path.join(self.data_dir, MIGRATIONS_FILE),
+                  {"version": version, "migrated_at": datetime.now().isoformat()})
+
+    def mark_dirty(self, store, key=None, reindex=True):
+        """Record that a store changed: one record if key is given, otherwise the whole store.
+
+        reindex=False marks an edit no derived index reads (a notification
+        inbox, say): it is saved and published but, here and in every session
+        that polls it, leaves the store version and so the indexes alone.
+        """
+        # None in the key set stands for "the whole store"
+        dirty = self.state["dirty_stores"].setdefault(store, set())
+        quiet = self.state["quiet_keys"].setdefault(store, set())
+        if reindex or key is None:
+            quiet.discard(key)
+            self.state["store_versions"][store] = self.state["store_versions"].get(store, 0) + 1
+        elif key not in dirty:
+            # Stays quiet only while every edit since the last flush was
+            quiet.add(key)
+        dirty.add(key)
+
+    def defer(self, store, change):
+        """Apply change(data) to a whole store now, and again at flush time if another writer saved it since.
+
+        For stores that aren't keyed records, such as the rollup counters:
+        the flush replays the changes onto the copy on disk instead of
+        overwriting it with ours.
+        """
+        change(self.state[store])
+        self.state.setdefault("deferred", {}).setdefault(store, []).append(change)
+        self.mark_dirty(store)
+
+    @contextmanager
+    def locked(self):
+        """Hold the data directory's write lock (re-entrant); take it to poll, allocate ids and flush atomically"""
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with wal.wal_lock(self.recovery_dir()):
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+
+    @contextmanager
+    def transaction(self, poll=None):
+        """Poll, run the block and flush, all under the lock: a read-modify-write against every writer's latest records.
+
+        Flush keeps this session's copy of a record it changed, so two sessions
+        editing the same record off their own earlier reads would each write
+        theirs back, the later one dropping the other's change. Edits made
+        before the block are flushed first, so the poll can refresh every
+        record; look records up again inside the block, the poll may have
+        replaced them. poll, if given, is called instead of self.poll (e.g.
+        to note what changed).
+        """
+        with self.locked():
+            self.flush()
+            (poll or self.poll)()
+            try:
+                yield
+            finally:
+                self.flush()
+
+    def is_dirty(self, store):
+        return store in self.state["dirty_stores"]
+
+    def version(self, store):
+        """In-memory change counter of a store, for invalidating derived indexes"""
+        return self.state["store_versions"].get(store, 0)
+
+    def flush(self, stores=None):
+        """Write each store changed since the last flush back to disk, once per store, and publish the changes.
+
+        Under the lock, other writers' changes are polled in first (records
+        this session changed keep its version) and deferred changes are
+        replayed onto stores another writer saved, so nothing they wrote is
+        overwritten by this session's older copy. stores limits the flush to
+        those stores; the rest stay dirty.
+        """
+        all_dirty = self.state.get("dirty_stores")
+        if not all_dirty:
+            return
+        with self.locked():
+            if "feed" in self.state:
+                self.poll()
+            dirty = {store: keys for store, keys in all_dirty.items() if stores is None or store in stores}
+            if not dirty:
+                return
+            deferred = self.state.get("deferred", {})
+            for store in dirty:
+                changes = deferred.pop(store, ())
+                if changes and self.disk_version(store) != self.state["disk_versions"].get(store):
+                    data = self.read_store(store)
+                    for change in changes:
+                        change(data)
+                    self.state[store] = data
+            events = []
+            for store, keys in list(dirty.items()):
+                events.extend(self.change_events(store, keys))
+            if self.use_wal:
+                directory = self.recovery_dir()
+                # Whole stores are encoded once, for the log and for their file
+                encoded = {event["store"]: encode(self.state[event["store"]])
+                           for event in events if event["op"] == "reload"}
+                txn = uuid.uuid4().hex
+                wal.append(directory, [self.log_entry(txn, events, encoded)])
+                saved = self.save_stores(dirty, encoded)
+                # Not synced: if it is lost, recovery just rewrites these files from the log
+                wal.append(directory, [{"commit": [txn], "saved": saved}], sync=False)
+            else:
+                self.save_stores(dirty)
+            for store in dirty:
+                del all_dirty[store]
+                self.state["quiet_keys"].pop(store, None)
+            # Published before the lock is released, so the next writer's poll sees these records
+            if events and "feed" in self.state:
+                append_events(self.feed_path(), events)
+
+    def save_stores(self, stores, encoded=None):
+        """Write stores to their files (from their encoding, where given); returns {store: new disk version}"""
+        saved = {}
+        for store in stores:
+            save_data(self.path(store), self.state[store], (encoded or {}).get(store))
+            # Remember our own write so sync doesn't reload it
+            saved[store] = self.state["disk_versions"][store] = self.disk_version(store)
+        return saved
+
+    def log_entry(self, txn, events, encoded):
+        """The log frame announcing a flush: its change events, a whole-store change carrying the store"""
+        parts = [b'{"store":' + dumps(event["store"]) + b',"op":"set","value":' + encoded[event["store"]] + b"}"
+                 if event["op"] == "reload" else dumps(event) for event in events]
+        return b'{"txn":' + dumps(txn) + b',"events":[' + b",".join(parts) + b"]}"
+
+    def change_events(self, store, keys):
+        """Change feed events describing the dirty keys of one store"""
+        writer = self.state["feed"]["writer"] if "feed" in self.state else None
+        if store in VALUE_STORES:
+            return [{"writer": writer, "store": store, "op": "set", "value": self.state[store]}]
+        if store not in KEYED_STORES or None in keys:
+            # Whole-store changes (e.g. inventory consumed) are too broad to describe; readers reload the file
+            return [{"writer": writer, "store": store, "op": "reload"}]
+        records = self.records_by_key(store)
+        quiet = self.state["quiet_keys"].get(store, ())
+        events = []
+        for key in keys:
+            if key not in records:
+                self.forget_published(store, key)
+                events.append({"writer": writer, "store": store, "op": "delete", "key": key})
+                continue
+            event = {"writer": writer, "store": store, "op": "put", "key": key, "record": records[key]}
+            if key in quiet:
+                event["reindex"] = False
+            if store in DELTA_FIELDS:
+                self.pack_delta(event)
+            events.append(event)
+        return events
+
+    def pack_delta(self, event):
+        """Swap a put's large fields for deltas against the copy last published, where that copy still holds.
+
+        Every session caught up with the feed holds that copy, and the log
+        replays onto it, so a certificate goes out once and a notice costs
+        only itself, not the whole inbox.
+        """
+        store, key, record = event["store"], event["key"], event["record"]
+        published = self.state["published"]
+        delta = {}
+        for field, kind in DELTA_FIELDS[store].items():
+            if field not in record:
+                continue
+            value = record[field]
+            spec = {"digest": field_digest(value)}
+            if kind == "list":
+                spec["length"] = len(value)
+            last = published.get((store, key, field))
+            if last is not None and last[1] == spec["digest"]:
+                spec["keep"] = True
+            elif (kind == "list" and last is not None and last[0] <= len(value)
+                  and field_digest(value[:last[0]]) == last[1]):
+                spec.update({"from": last[0], "base": last[1], "items": value[last[0]:]})
+            delta[field] = spec
+            published[(store, key, field)] = (spec.get("length"), spec["digest"])
+        if delta:
+            event["record"] = {field: value for field, value in record.items()
+                               if field not in delta or not ("keep" in delta[field] or "from" in delta[field])}
+            event["delta"] = delta
+
+    def delta_fits(self, store, key):
+        """Check for apply_event: does a delta apply to our copy of the record?"""
+        published = self.state["published"]
+
+        def fits(field, spec, value):
+            length, digest = spec.get("from"), spec.get("base", spec["digest"])
+            if published.get((store, key, field)) == (length if "from" in spec else spec.get("length"), digest):
+                return True
+            if length is not None and (value is None or len(value) < length):
+                return False
+            return field_digest(value if length is None else value[:length]) == digest
+        return fits
+
+    def forget_published(self, store, key=None):
+        """Drop what we know was last published for one record, or for a whole store we reloaded"""
+        published = self.state["published"]
+        if key is not None:
+            for field in DELTA_FIELDS.get(store, ()):
+                published.pop((store, key, field), None)
+        elif any(entry[0] == store for entry in published):
+            self.state["published"] = {entry: last for entry, last in published.items() if entry[0] != store}
+
+    def records_by_key(self, store):
+        """key -> record for a keyed store"""
+        data = self.state[store]
+        if isinstance(data, dict):
+            return data
+        return {record.get(KEYED_STORES[store]): record for record in data}
+
+    def poll(self):
+        """Apply other writers' changes since our last poll; returns {store: set of changed keys}.
+
+        Costs one stat() when nothing changed. Records with unflushed local
+        edits keep the local version. If the log was rotated past us, or a
+        delta doesn't fit our copy of its record, the stores concerned are
+        reloaded from disk instead, still keeping the local edits (see resync).
+        """
+        feed = self.state["feed"]
+        events, feed["inode"], feed["offset"] = read_events(self.feed_path(), feed["inode"], feed["offset"])
+        if events is None:
+            return {store: {None} for store in STORE_FILES if self.resync(store)}
+
+        changed = {}
+        reindexed = set()
+        resynced = set()
+        fed = set()
+        for event in events:
+            store = event["store"]
+            fed.add(store)
+            # The file we reloaded already holds every event read along with this one
+            if event["writer"] == feed["writer"] or store in resynced:
+                continue
+            dirty_keys = self.state["dirty_stores"].get(store, set())
+            if None in dirty_keys:
+                continue
+            if event["op"] == "set":
+                self.state[store] = event["value"]
+            elif event["op"] == "reload":
+                if not self.sync(store):
+                    continue
+                resynced.add(store)
+            elif event["key"] in dirty_keys:
+                continue
+            elif not self.apply_record(store, event):
+                # Our copy isn't the one its deltas were made against
+                resynced.add(store)
+                if self.resync(store):
+                    changed.setdefault(store, set()).add(None)
+                continue
+            changed.setdefault(store, set()).add(event.get("key"))
+            if event.get("reindex", True):
+                reindexed.add(store)
+
+        for store in reindexed:
+            self.state["store_versions"][store] = self.version(store) + 1
+        # Stores read from their file since are named by the file's version instead (see shared_version)
+        for store in fed - resynced:
+            self.state["feed_versions"][store] = (feed["inode"], feed["offset"])
+        return changed
+
+    def apply_record(self, store, event):
+        """Apply one put/delete event to a keyed store; False if its deltas don't fit our copy"""
+        key = event["key"]
+        if not apply_event(self.state[store], store, event, self.delta_fits(store, key)):
+            return False
+        if event["op"] == "delete":
+            self.forget_published(store, key)
+        for field, spec in event.get("delta", {}).items():
+            self.state["published"][(store, key, field)] = (spec.get("length"), spec["digest"])
+        return True
+
+    def disk_version(self, store):
+        """Cheap on-disk version of a store.
+
+        The inode changes on every atomic save, so this also tells apart two
+        writes that land within the filesystem's mtime granularity.
+        """
+        try:
+            stat = os.stat(self.path(store))
+        except FileNotFoundError:
+            return 0
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def sync(self, store):
+        """Reload a store if another process has written it since we last looked"""
+        version = self.disk_version(store)
+        if version == self.state["disk_versions"].get(store) or self.is_dirty(store):
+            return False
+        try:
+            self.state[store] = self.read_store(store)
+        except StoreCorruptError:
+            # Keep what we have; the next load recovers the file from the log
+            return False
+        self.state["disk_versions"][store] = version
+        self.state["store_versions"][store] = self.version(store) + 1
+        self.state["feed_versions"].pop(store, None)
+        self.forget_published(store)
+        return True
+
+    def resync(self, store):
+        """Reload a store that changed on disk, putting back the records this session hasn't flushed yet.
+
+        For when poll can't follow the feed. A store changed as a whole here
+        (or not keyed) keeps our copy; flush merges it. Returns True if the
+        store was reloaded.
+        """
+        dirty = self.state["dirty_stores"].get(store)
+        if not dirty:
+            return self.sync(store)
+        version = self.disk_version(store)
+        if None in dirty or store not in KEYED_STORES or version == self.state["disk_versions"].get(store):
+            return False
+        try:
+            data = self.read_store(store)
+        except StoreCorruptError:
+            return False
+        mine = self.records_by_key(store)
+        if isinstance(data, dict):
+            for key in dirty:
+                if key in mine:
+                    data[key] = mine[key]
+                else:
+                    data.pop(key, None)
+        else:
+            # In place, so list order (oldest stock first) is kept
+            field = KEYED_STORES[store]
+            positions = {record.get(field): pos for pos, record in enumerate(data)}
+            for key in dirty:
+                pos = positions.get(key)
+                if key not in mine:
+                    if pos is not None:
+                        data[pos] = None
+                elif pos is None:
+                    data.append(mine[key])
+                else:
+                    data[pos] = mine[key]
+            data = [record for record in data if record is not None]
+        self.state[store] = data
+        self.state["disk_versions"][store] = version
+        self.state["store_versions"][store] = self.version(store) + 1
+        self.state["feed_versions"].pop(store, None)
+        self.forget_published(store)
+        return True
+
+    def shared_version(self, store):
+        """Version of a store usable as a cache key shared by every session.
+
+        The change feed position just after the store's last change, or, if no
+        change has come through the feed since the store was read from its
+        file, that file's version. Pending edits are flushed and the feed
+        polled first, under the lock so no writer is between saving a file and
+        publishing its events; no file is read for this.
+        """
+        with self.locked():
+            self.flush()
+            self.poll()
+        return self.state["feed_versions"].get(store) or self.state["disk_versions"][store]
+
+    def derived(self, name, version, build):
+        """Index named name, rebuilt by build() only when version changes"""
+        cached = self.state.get(name)
+        if cached is None or cached["version"] != version:
+            cached = {"version": version, "value": build()}
+            self.state[name] = cached
+        return cached["value"]
+
+    # ---------- crash recovery ----------
+    def recovery_dir(self):
+        """Snapshots and write-ahead log segments"""
+        return os.path.join(self.data_dir, wal.RECOVERY_DIR)
+
+    def recover(self, stores):
+        """The given stores as of the last flush the log saw, plus the disk version each matches.
+
+        Starts from the newest snapshot that passes its checksum and replays
+        the log after it. A store whose file still is what the log last
+        committed comes straight from there, without parsing the file. Then:
+        a file written outside the log is taken as it is (and logged as the
+        new base); a torn, missing or half-written file is rewritten from the
+        log. A damaged file with nothing in the snapshot or log to rebuild it
+        from raises StoreCorruptError. Call under locked().
+        Returns ({store: data}, {store: disk version}).
+        """
+        directory = self.recovery_dir()
+        seq, data, committed = wal.latest_snapshot(directory)
+        # JSON and marshal hand versions back as lists; 0 stands for "no file"
+        committed = {store: tuple(version) if version else 0 for store, version in committed.items()}
+        wanted = set(stores)
+        pending = {}  # txn -> stores its flush was writing when the process stopped
+        indexes = {}  # list store -> {key: record} while replaying, None if its keys aren't unique
+        for frame in wal.read_log(directory, seq, repair=True):
+            if "commit" in frame:
+                for txn in frame["commit"]:
+                    pending.pop(txn, None)
+                committed.update((store, tuple(version) if version else 0) for store, version in frame["saved"].items())
+                continue
+            events = [event for event in frame["events"] if event["store"] in wanted]
+            pending[frame["txn"]] = {event["store"] for event in events}
+            for event in events:
+                self.replay(data, indexes, event)
+        for store, index in indexes.items():
+            if index is not None:
+                data[store] = list(index.values())
+
+        unsaved = set().union(*pending.values())
+        result, versions, saved, adopted = {}, {}, {}, []
+        for store in stores:
+            version = self.disk_version(store)
+            if store not in data:
+                result[store] = self.read_store(store)
+            elif store not in unsaved and version == committed.get(store):
+                result[store] = data[store]
+            else:
+                try:
+                    on_disk = self.read_store(store) if version and store not in unsaved else None
+                except StoreCorruptError:
+                    on_disk = None
+                if on_disk is not None:
+                    result[store] = on_disk
+                    adopted.append({"store": store, "op": "set", "value": on_disk})
+                else:
+                    result[store] = data[store]
+                    save_data(self.path(store), data[store])
+                    version = self.disk_version(store)
+                saved[store] = version
+            versions[store] = version
+        frames = []
+        if adopted:
+            txn = uuid.uuid4().hex
+            frames.append({"txn": txn, "events": adopted})
+            pending[txn] = set()
+        if saved or pending:
+            frames.append({"commit": list(pending), "saved": saved})
+            wal.append(directory, frames)
+        return result, versions
+
+    def replay(self, data, indexes, event):
+        """Apply one logged event to stores being recovered"""
+        store = event["store"]
+        if event["op"] == "set":
+            data[store] = load_records(store, event["value"])
+            indexes.pop(store, None)
+            return
+        if store not in data:
+            # Not in the snapshot yet: the file already holds every committed change, replay is idempotent
+            data[store] = self.read_store(store)
+        if store not in indexes and isinstance(data[store], list):
+            field = KEYED_STORES[store]
+            index = {record.get(field): record for record in data[store]}
+            indexes[store] = index if len(index) == len(data[store]) else None
+        index = indexes.get(store)
+        apply_event(data[store] if index is None else index, store, event)
+
+    def checkpoint(self):
+        """Fold the log into a new snapshot and drop the segments it replaces.
+
+        Works from the files (snapshot, log, stores), never from a session's
+        state, so it can run on a background thread or from cron. Returns
+        (snapshot path, bytes).
+        """
+        directory = self.recovery_dir()
+        with self.locked():
+            stores, versions = self.recover(list(STORE_FILES))
+            seq = wal.rotate(directory)
+        snapshot = wal.write_snapshot(directory, seq, stores, versions)
+        with self.locked():
+            wal.prune(directory)
+        return snapshot
+
+    def checkpoint_due(self):
+        return self.use_wal and wal.checkpoint_due(self.recovery_dir())
@@ -0,0 +1,829 @@
+import random
+import functools
+from datetime import datetime, timedelta
+from locations import assign_location_ids, get_location_name
+from rollups import rebuild_rollups, record_transition
+from perf import timed
+from metrics import REQUEST_TRANSITIONS, DONOR_MATCHES, NOTIFICATIONS
+from images import process_stored_image, available as images_available
+from core.matching import match_donors, MATCH_DISTANCES
+from core.allocation import plan_allocation
+from core.records import User, Request, InventoryUnit
+from core.constants import (URGENCY_LEVELS, REQUEST_SORTS, DONOR_COOLDOWN_DAYS, INVENTORY_EXPIRY_DAYS,
+                            LOW_INVENTORY_UNITS, DUPLICATE_REQUEST_SECONDS, ALLOCATABLE_STATUSES,
+                            MIGRATIONS_VERSION)
+
+class DuplicateRequestError(ValueError):
+    """The requester already has a recent pending request for this blood type"""
+
+def generate_unique_id(prefix):
+    """Generate unique ID for inventory items"""
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    random_str = ''.join(random.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789', k=6))
+    return f"{prefix}-{timestamp}-{random_str}"
+
+class BloodHub:
+    """Requests, matching, inventory and notifications over a Repository.
+
+    Nothing here touches Streamlit: outgoing messages go through send_message
+    (phone, text), which defaults to dropping them.
+    """
+
+    def __init__(self, repo, location_table, send_message=None):
+        self.repo = repo
+        self.locations = location_table
+        self._send_message = send_message or (lambda phone, message: None)
+
+    # ---------- users ----------
+    def register_user(self, phone, role):
+        """Create the account for a phone number on first login"""
+        self.repo["users"][phone] = User({"role": role})
+        self.repo.mark_dirty("users", phone)
+
+    def has_profile(self, phone):
+        """Check if user has completed their profile"""
+        return self.repo["users"].get(phone, {}).get("profile", False)
+
+    def is_approved(self, phone):
+        """Check if user is approved by admin"""
+        user = self.repo["users"].get(phone, {})
+        if user.get("role") in ["Hospital", "Blood Bank"]:
+            return user.get("approved", False)
+        return True  # Always approved for other roles
+
+    def donor_in_cooldown(self, phone):
+        """Check if donor is in cooldown period"""
+        if self.repo["red_alert"]:
+            return False  # Bypass cooldown during red alert
+
+        donor = self.repo["users"].get(phone, {})
+        if donor.get("cooldown_override", False):
+            return False
+
+        last_donation = donor.get("last_donation_date")
+        if not last_donation:
+            return False
+
+        if isinstance(last_donation, str):
+            last_donation = datetime.fromisoformat(last_donation)
+
+        return (datetime.now() - last_donation).days < DONOR_COOLDOWN_DAYS
+
+    def approve_user(self, phone):
+        self.repo["users"][phone]["approved"] = True
+        self.repo.mark_dirty("users", phone)
+
+    def reject_user(self, phone):
+        self.repo["users"].pop(phone, None)
+        self.repo.mark_dirty("users", phone)
+
+    def set_red_alert(self, active):
+        """Switch Red Alert on or off; while on, donor cooldowns are ignored"""
+        self.repo["red_alert"] = active
+        self.repo.mark_dirty("red_alert")
+
+    def notify_user(self, phone, notification):
+        """Append a notification to a user's inbox.
+
+        Other sessions notify the same users: call it inside a transaction,
+        or the flush writes back this session's older copy of the inbox.
+        """
+        user = self.repo["users"].get(phone)
+        if user is None:
+            NOTIFICATIONS.inc("in_app", "failed")
+            return
+        user.setdefault("notifications", []).append(dict(notification, timestamp=datetime.now().isoformat(), read=False))
+        # Inboxes aren't indexed: don't make every session rebuild its donor index
+        self.repo.mark_dirty("users", phone, reindex=False)
+        NOTIFICATIONS.inc("in_app", "sent")
+
+    def mark_notifications_read(self, phone, positions=None):
+        """Mark a user's notifications read: those at the given positions in the inbox, or all of them.
+
+        Call inside a transaction, as for notify_user; inboxes only grow at
+        the end, so positions read before the poll still point at the same notices.
+        """
+        user = self.repo["users"].get(phone)
+        if user is None:
+            return
+        for pos, note in enumerate(user.get("notifications", [])):
+            if positions is None or pos in positions:
+                note["read"] = True
+        self.repo.mark_dirty("users", phone, reindex=False)
+
+    def send_message(self, phone, message):
+        """Send an outgoing message; a failed send is counted and doesn't abort the caller"""
+        try:
+            self._send_message(phone, message)
+        except Exception:
+            NOTIFICATIONS.inc("whatsapp", "failed")
+            return False
+        NOTIFICATIONS.inc("whatsapp", "sent")
+        return True
+
+    def notify_admins(self, message):
+        """Store notification for admins"""
+        with self.repo.transaction():
+            for phone, user in self.repo["users"].items():
+                if user.get("role") == "Admin":
+                    self.notify_user(phone, {"message": message})
+
+    # ---------- locations ----------
+    def location_name_from_ids(self, district_id, taluk_id, village_id):
+        """Formatted location name for a set of location IDs"""
+        names = self.locations["names"]
+        return get_location_name(names.get(district_id, ""), names.get(taluk_id, ""), names.get(village_id))
+
+    # ---------- requests ----------
+    def request_index(self):
+        """Request positions grouped by requester, status and district ID, rebuilt only when requests change"""
+        requests = self.repo["requests"]
+
+        def build():
+            index = {"requester": {}, "status": {}, "district_id": {}}
+            for pos, req in enumerate(requests):
+                for field in ("requester", "status", "district_id"):
+                    index[field].setdefault(req.get(field), []).append(pos)
+            return index
+        return self.repo.derived("request_index", (self.repo.version("requests"), len(requests)), build)
+
+    def query_requests(self, requester=None, statuses=None, district_id=None, blood_type=None, urgencies=None,
+                       sort_by="Newest first"):
+        """Filter requests through the request index and sort them"""
+        requests = self.repo["requests"]
+        index = self.request_index()
+
+        selections = []
+        if requester is not None:
+            selections.append(set(index["requester"].get(requester, [])))
+        if statuses is not None:
+            selections.append(set().union(*(index["status"].get(s, []) for s in statuses)))
+        if district_id is not None:
+            selections.append(set(index["district_id"].get(district_id, [])))
+        positions = set.intersection(*selections) if selections else range(len(requests))
+
+        results = [
+            requests[pos] for pos in positions
+            if (blood_type is None or requests[pos].get("blood_type") == blood_type)
+            and (urgencies is None or requests[pos].get("urgency") in urgencies)
+        ]
+        sort_key, reverse = REQUEST_SORTS[sort_by]
+        results.sort(key=sort_key, reverse=reverse)
+        return results
+
+    def get_request(self, request_id):
+        return next((r for r in self.repo["requests"] if r["id"] == request_id), None)
+
+    def set_request_status(self, request, status):
+        """Move a request to a new status, stamping the transition time and updating the rollups"""
+        old_status = request.get("status")
+        if old_status == status:
+            return
+        now = datetime.now().isoformat()
+        request["status"] = status
+        if status == "Accepted":
+            request["accepted_at"] = now
+        elif status in ("Fulfilled", "Partially Fulfilled"):
+            request["fulfilled_at"] = now
+        # A copy: the counters are replayed at flush time if another session saved them first
+        self.repo.defer("rollups", functools.partial(record_transition, request=dict(request),
+                                                     old_status=old_status, new_status=status))
+        REQUEST_TRANSITIONS.inc(old_status or "none", status)
+        self.repo.mark_dirty("requests", request["id"])
+
+    def supplied_units(self, request):
+        """Units supplied to a request so far, whether donated, issued from stock or transferred.
+
+        Requests saved before every path kept fulfilled_units count their inventory IDs.
+        """
+        return request.get("fulfilled_units", len(request.get("inventory_ids") or ()))
+
+    def remaining_units(self, request):
+        return max(0, request["units"] - self.supplied_units(request))
+
+    def record_supply(self, request, inventory_ids, supplied_by=None):
+        """Count units towards a request, one inventory ID per unit; returns the units it still needs.
+
+        The one place fulfilled_units moves; callers set the status from what is left.
+        """
+        supplied = self.supplied_units(request) + len(inventory_ids)
+        request.setdefault("inventory_ids", []).extend(inventory_ids)
+        request["fulfilled_units"] = supplied
+        if supplied_by is not None:
+            request["fulfilled_by"] = supplied_by
+        self.repo.mark_dirty("requests", request["id"])
+        return self.remaining_units(request)
+
+    def recent_pending_types(self, requester_phone, now):
+        """Blood types the requester already has a pending request for from the last DUPLICATE_REQUEST_SECONDS"""
+        return {
+            req["blood_type"] for req in self.query_requests(requester=requester_phone, statuses=["Pending"])
+            if (now - datetime.fromisoformat(req["created_at"])).total_seconds() < DUPLICATE_REQUEST_SECONDS
+        }
+
+    def create_request(self, requester_phone, blood_type, units, urgency):
+        """Create a new blood request, match donors and send the notifications; returns the request.
+
+        Raises DuplicateRequestError if the requester already has a recent
+        pending request for the same blood type.
+        """
+        result = self.create_requests(requester_phone, [(blood_type, units, urgency)])[0]
+        if isinstance(result, DuplicateRequestError):
+            raise result
+        return result
+
+    def create_requests(self, requester_phone, rows):
+        """Create several requests at once from (blood_type, units, urgency) rows.
+
+        One duplicate check, one matching pass and one notice per donor, organization
+        and blood bank for the whole batch. Returns one entry per row: the new
+        request, or a DuplicateRequestError for a row whose blood type already
+        has a recent pending request (including an earlier row of this batch).
+
+        All of it runs in one transaction: ids are allocated after polling, so
+        two sessions never hand out the same id, and the notices land on every
+        recipient's latest inbox.
+        """
+        with self.repo.transaction():
+            results, created = self._add_requests(requester_phone, rows)
+            if not created:
+                return results
+            requester = self.repo["users"].get(requester_phone, {})
+
+            # Find matching donors
+            self.match_requests(created)
+            for new_request in created:
+                self.repo.mark_dirty("requests", new_request["id"])
+
+            # Notify donors about the critical ones
+            critical = [new_request for new_request in created if new_request["urgency"] == "Critical"]
+            if critical:
+                self.notify_donors_batch(critical)
+
+            # Notify nearby blood banks if hospital creates request
+            if requester.get("role") == "Hospital":
+                self.notify_nearby_blood_banks_batch(created)
+
+        return results
+
+    def _add_requests(self, requester_phone, rows):
+        """Append the rows' new Pending requests; returns (one result per row, the created requests)"""
+        now = datetime.now()
+        taken = self.recent_pending_types(requester_phone, now)
+        requester = self.repo["users"].get(requester_phone, {})
+        results = []
+        created = []
+        for blood_type, units, urgency in rows:
+            if blood_type in taken:
+                results.append(DuplicateRequestError(
+                    "You already have a pending request for this blood type. Please wait before creating a new one."
+                ))
+                continue
+            taken.add(blood_type)
+            new_request = Request({
+                "id": self.repo["request_counter"] + 1,
+                "requester": requester_phone,
+                "blood_type": blood_type,
+                "units": units,
+                "urgency": urgency,
+                "status": "Pending",
+                "district": requester.get("district", ""),
+                "taluk": requester.get("taluk", ""),
+                "village": requester.get("village", ""),
+                "district_id": requester.get("district_id"),
+                "taluk_id": requester.get("taluk_id"),
+                "village_id": requester.get("village_id"),
+                "created_at": now.isoformat(),
+                "expires_at": (now + timedelta(minutes=URGENCY_LEVELS[urgency]["timeout"])).isoformat(),
+                "matched_donors": [],
+                "pledged_donors": [],  # Donors who have pledged to donate
+                "inventory_ids": [],    # Stores inventory IDs for fulfilled units
+                "test_results": {}      # Stores test results keyed by inventory ID
+            })
+            self.repo["requests"].append(new_request)
+            self.repo["request_counter"] += 1
+            self.repo.mark_dirty("request_counter")
+            self.repo.mark_dirty("requests", new_request["id"])
+            self.repo.defer("rollups", functools.partial(record_transition, request=dict(new_request),
+                                                         old_status=None, new_status="Pending"))
+            REQUEST_TRANSITIONS.inc("none", "Pending")
+            results.append(new_request)
+            created.append(new_request)
+        return results, created
+
+    def cancel_request(self, request):
+        """Cancel a request still waiting for donors; returns False if it has moved on (or is gone)"""
+        if request is None or request["status"] != "Pending":
+            return False
+        self.set_request_status(request, "Cancelled")
+        return True
+
+    def pledge(self, request, donor_phone):
+        """Record a donor's pledge; the request is Accepted once enough donors pledge.
+
+        Returns False, recording nothing, if the request is no longer Pending
+        (or is gone) or the donor has already pledged to it.
+        """
+        if request is None or request["status"] != "Pending":
+            return False
+        if any(pledge.get("phone") == donor_phone for pledge in request.get("pledged_donors", [])):
+            return False
+        donor = self.repo["users"].get(donor_phone, {})
+        request.setdefault("pledged_donors", []).append({
+            "phone": donor_phone,
+            "name": donor.get("name", ""),
+            "pledged_at": datetime.now().isoformat()
+        })
+        if len(request["pledged_donors"]) >= request["units"]:
+            self.set_request_status(request, "Accepted")
+        self.repo.mark_dirty("requests", request["id"])
+        return True
+
+    def withdraw_pledge(self, request, donor_phone):
+        if request is None:
+            return
+        request["pledged_donors"] = [d for d in request["pledged_donors"] if d.get("phone") != donor_phone]
+        self.repo.mark_dirty("requests", request["id"])
+
+    # ---------- volunteers ----------
+    def volunteer_index(self):
+        """Volunteer positions grouped by organization, rebuilt only when volunteers change"""
+        volunteers = self.repo["volunteers"]
+
+        def build():
+            index = {}
+            for pos, volunteer in enumerate(volunteers):
+                index.setdefault(volunteer.get("organization"), []).append(pos)
+            return index
+        return self.repo.derived("volunteer_index", (self.repo.version("volunteers"), len(volunteers)), build)
+
+    def volunteer_by_id(self):
+        """Volunteer records keyed by ID, rebuilt only when volunteers change"""
+        volunteers = self.repo["volunteers"]
+        return self.repo.derived("volunteer_by_id", (self.repo.version("volunteers"), len(volunteers)),
+                                 lambda: {volunteer.get("id"): volunteer for volunteer in volunteers})
+
+    def organization_volunteers(self, org_phone):
+        """Volunteer records registered by one organization"""
+        volunteers = self.repo["volunteers"]
+        return [volunteers[pos] for pos in self.volunteer_index().get(org_phone, [])]
+
+    def add_volunteers(self, org_phone, records):
+        """Register volunteers for an organization in the volunteer store"""
+        for record in records:
+            record["id"] = generate_unique_id("VOL")
+            record["organization"] = org_phone
+            if "district_id" not in record:
+                assign_location_ids(self.locations, record)
+        self.repo["volunteers"].extend(records)
+        for record in records:
+            self.repo.mark_dirty("volunteers", record["id"])
+
+    # ---------- matching ----------
+    def donor_index(self):
+        """Matchable donors and organization volunteers grouped by blood group, then district.
+
+        Rebuilt only when the users or volunteers store changes, so matching a
+        request scans one district's candidates instead of every user.
+        """
+        users = self.repo["users"]
+        volunteers = self.repo["volunteers"]
+
+        def build():
+            donors = {}
+            for phone, user in users.items():
+                if user.get("role") != "Donor":
+                    continue
+                donors.setdefault(user.get("blood_group"), {}).setdefault(user.get("district_id"), []).append({
+                    "phone": phone,
+                    "district_id": user.get("district_id"),
+                    "taluk_id": user.get("taluk_id"),
+                    "village_id": user.get("village_id"),
+                    "volunteer_id": None
+                })
+            for volunteer in volunteers:
+                # Volunteers have no phone of their own; they are reached through their organization
+                org_phone = volunteer.get("organization")
+                donors.setdefault(volunteer.get("blood_group"), {}).setdefault(volunteer.get("district_id"), []).append({
+                    "phone": org_phone,
+                    "district_id": volunteer.get("district_id"),
+                    "taluk_id": volunteer.get("taluk_id"),
+                    "village_id": volunteer.get("village_id"),
+                    "volunteer_id": volunteer.get("id")
+                })
+            return donors
+        version = (self.repo.version("users"), len(users), self.repo.version("volunteers"), len(volunteers))
+        return self.repo.derived("donor_index", version, build)
+
+    @timed()
+    def find_matching_donors(self, request):
+        """Donors and volunteers for a request, closest first"""
+        matches = match_donors(request, self.donor_index().get(request["blood_type"], {}), self.donor_in_cooldown)
+        DONOR_MATCHES.inc(request["urgency"], by=len(matches))
+        return matches
+
+    @timed()
+    def match_requests(self, requests):
+        """Set matched_donors on several requests with one donor index lookup and one cooldown check per donor"""
+        by_blood_type = self.donor_index()
+        in_cooldown = functools.lru_cache(maxsize=None)(self.donor_in_cooldown)
+        for request in requests:
+            request["matched_donors"] = match_donors(request, by_blood_type.get(request["blood_type"], {}), in_cooldown)
+            DONOR_MATCHES.inc(request["urgency"], by=len(request["matched_donors"]))
+
+    def describe_match(self, match):
+        """Display form of a matched-donor reference: name, location and distance looked up now"""
+        users = self.repo["users"]
+        volunteer_id = match.get("volunteer_id")
+        if volunteer_id:
+            donor = self.volunteer_by_id().get(volunteer_id, {})
+        else:
+            donor = users.get(match["phone"], {})
+        described = {
+            "phone": match["phone"],
+            "name": donor.get("name", ""),
+            "location": self.location_name_from_ids(donor.get("district_id"), donor.get("taluk_id"),
+                                                    donor.get("village_id")),
+            "distance": MATCH_DISTANCES.get(match.get("priority"), ""),
+            "priority": match.get("priority")
+        }
+        if volunteer_id:
+            described["volunteer_id"] = volunteer_id
+            described["contact"] = f"via {users.get(match['phone'], {}).get('name') or 'Organization'}"
+        return described
+
+    # ---------- notifications ----------
+    def request_notice(self, notice_type, requests):
+        """In-app notice about one request, or one combined notice about several"""
+        first = requests[0]
+        notification = {
+            "type": notice_type,
+            "request_id": first["id"],
+            "blood_type": first["blood_type"],
+            "units": first["units"],
+            "location": get_location_name(first["district"], first["taluk"], first.get("village", ""))
+        }
+        if len(requests) > 1:
+            locations = {get_location_name(r["district"], r["taluk"], r.get("village", "")): None for r in requests}
+            notification.update(
+                request_ids=[r["id"] for r in requests],
+                blood_type=", ".join({r["blood_type"]: None for r in requests}),
+                units=sum(r["units"] for r in requests),
+                location="; ".join(locations)
+            )
+        return notification
+
+    def notify_donors(self, request):
+        """Notify matched donors about a critical request"""
+        with self.repo.transaction():
+            self.notify_donors_batch([request])
+
+    @timed()
+    def notify_donors_batch(self, requests):
+        """Notify the donors matched to critical requests: one notice and one message each, however many they match.
+
+        Call inside a transaction, as for notify_user.
+        """
+        volunteers = self.volunteer_by_id()
+        by_id = {request["id"]: request for request in requests}
+        by_donor = {}  # phone -> IDs of the requests the donor matches
+        # Volunteers are contacted through their organization: one notice per organization
+        by_org = {}
+        for request_id, request in by_id.items():
+            for donor in request["matched_donors"]:
+                volunteer_id = donor.get("volunteer_id")
+                if volunteer_id:
+                    org = by_org.setdefault(donor["phone"], ({}, {}))
+                    org[0][request_id] = request
+                    org[1][volunteers.get(volunteer_id, {}).get("name", "")] = None
+                else:
+                    phone = donor["phone"]
+                    by_donor[phone] = by_donor.get(phone, ()) + (request_id,)
+
+        # Donors matching the same requests get the same words: build them once per set
+        worded = {}
+        for phone, key in by_donor.items():
+            if key not in worded:
+                matched = [by_id[request_id] for request_id in key]
+                notification = self.request_notice("critical_request", matched)
+                if len(matched) == 1:
+                    message = (f"URGENT: Blood request for {notification['blood_type']} at "
+                               f"{notification['location']}. {notification['units']} units needed. "
+                               f"Please check the Kerala Blood Hub app to pledge.")
+                else:
+                    message = (f"URGENT: {len(matched)} blood requests for {notification['blood_type']} at "
+                               f"{notification['location']}. {notification['units']} units needed in all. "
+                               f"Please check the Kerala Blood Hub app to pledge.")
+                worded[key] = (notification, message)
+            notification, message = worded[key]
+            self.notify_user(phone, notification)
+            self.send_message(phone, message)
+
+        for org_phone, (matched, names) in by_org.items():
+            if org_phone not in self.repo["users"]:
+                continue
+            notification = self.request_notice("critical_request", list(matched.values()))
+            self.notify_user(org_phone, dict(notification, volunteers=list(names)))
+            wanted = (f"a {notification['blood_type']} request" if len(matched) == 1
+                      else f"{len(matched)} blood requests ({notification['blood_type']})")
+            self.send_message(
+                org_phone,
+                f"URGENT: {len(names)} of your volunteers match {wanted} at {notification['location']}. "
+                f"Please contact them through the Kerala Blood Hub app."
+            )
+
+    def notify_nearby_blood_banks(self, request):
+        """Notify nearby blood banks about a hospital request"""
+        with self.repo.transaction():
+            self.notify_nearby_blood_banks_batch([request])
+
+    @timed()
+    def notify_nearby_blood_banks_batch(self, requests):
+        """Notify the approved blood banks in each request's district, one notice per bank; call inside a transaction"""
+        by_district = {}
+        for request in requests:
+            by_district.setdefault(request.get("district_id"), []).append(request)
+        for phone, user in self.repo["users"].items():
+            if (user.get("role") == "Blood Bank" and
+                user.get("district_id") in by_district and
+                user.get("approved", False)):
+                self.notify_user(phone, self.request_notice("hospital_request", by_district[user["district_id"]]))
+
+    # ---------- inventory ----------
+    def add_inventory(self, blood_type, units, expiry, added_by, donor_phone=None, request_id=None,
+                      test_report=None, test_report_thumbnail=None):
+        """Add one inventory record and return its ID"""
+        inventory_id = generate_unique_id("INV")
+        item = InventoryUnit({
+            "id": inventory_id,
+            "blood_type": blood_type,
+            "units": units,
+            "expiry": expiry,
+            "added_by": added_by,  # Blood bank/hospital that processed it
+            "added_at": datetime.now().isoformat(),
+            "donor_phone": donor_phone,
+            "test_report": test_report,  # Base64 of test result if provided
+            "test_report_thumbnail": test_report_thumbnail
+        })
+        if request_id is not None:
+            item["request_id"] = request_id
+        self.repo["inventory"].append(item)
+        self.repo.mark_dirty("inventory", inventory_id)
+        return inventory_id
+
+    @timed()
+    def add_to_inventory(self, request_id, donor_phone, processed_by, units=1, test_report=None,
+                         test_report_thumbnail=None):
+        """Add donated blood to inventory with tracking; False if the request is gone, fulfilled or cancelled"""
+        request = self.get_request(request_id)
+        if not request or request["status"] in ("Fulfilled", "Cancelled"):
+            return False
+
+        donor = self.repo["users"].get(donor_phone, {})
+        expiry = (datetime.now() + timedelta(days=INVENTORY_EXPIRY_DAYS)).isoformat()
+
+        # Each donated unit gets its own inventory record
+        inventory_ids = [
+            self.add_inventory(donor.get("blood_group", ""), 1, expiry, processed_by, donor_phone, request_id,
+                               test_report, test_report_thumbnail)
+            for _ in range(units)
+        ]
+
+        # Store test result if provided
+        if test_report:
+            request["test_results"][inventory_ids[-1]] = test_report
+
+        # Update request status
+        if not self.record_supply(request, inventory_ids):
+            self.set_request_status(request, "Fulfilled")
+
+        # Update donor points
+        donor["points"] = donor.get("points", 0) + (10 * units)
+        donor["last_donation_date"] = datetime.now().isoformat()
+
+        self.repo.mark_dirty("requests", request_id)
+        self.repo.mark_dirty("users", donor_phone)
+        return True
+
+    def available_units(self):
+        """Units on hand per blood type"""
+        available = {}
+        for item in self.repo["inventory"]:
+            available[item.get("blood_type")] = available.get(item.get("blood_type"), 0) + item["units"]
+        return available
+
+    @timed()
+    def fulfil_from_stock(self, request, fulfilled_by):
+        """Fulfil a request from inventory, oldest stock first; partially if stock is short.
+
+        Returns the number of units issued: 0 if there is no stock, or the
+        request is no longer Pending (another bank got there first, say) or is gone.
+        """
+        if request is None or request["status"] != "Pending":
+            return 0
+        issued = min(self.remaining_units(request), self.available_units().get(request["blood_type"], 0))
+        if not issued:
+            return 0
+
+        remaining = issued
+        used = []  # one inventory ID per unit issued
+        new_inventory = []
+        for item in self.repo["inventory"]:
+            if item.get("blood_type") == request["blood_type"] and remaining > 0:
+                taken = min(item["units"], remaining)
+                used.extend([item.get("id")] * taken)
+                remaining -= taken
+                item["units"] -= taken
+                if item["units"]:
+                    new_inventory.append(item)
+                # Otherwise fully consumed: left out of the new inventory
+                self.repo.mark_dirty("inventory", item.get("id"))
+            else:
+                new_inventory.append(item)
+        self.repo["inventory"] = new_inventory
+
+        left = self.record_supply(request, used, fulfilled_by)
+        self.set_request_status(request, "Partially Fulfilled" if left else "Fulfilled")
+        return issued
+
+    def clean_expired_inventory(self):
+        """Remove expired blood units from inventory"""
+        today = datetime.now().date()
+        cleaned_inventory = []
+        for item in self.repo["inventory"]:
+            if "expiry" in item and datetime.fromisoformat(item["expiry"]).date() >= today:
+                cleaned_inventory.append(item)
+            else:
+                self.repo.mark_dirty("inventory", item.get("id"))
+        if len(cleaned_inventory) != len(self.repo["inventory"]):
+            self.repo["inventory"] = cleaned_inventory
+            return True
+        return False
+
+    def check_inventory_alerts(self):
+        """Check inventory levels and notify admins if low"""
+        for blood_type, units in self.available_units().items():
+            if units < LOW_INVENTORY_UNITS:
+                self.notify_admins(f"⚠️ Low inventory for {blood_type} - only {units} units left")
+
+    # ---------- district allocation ----------
+    def open_transfers(self, bank=None, district_id=None):
+        """Proposed transfers, optionally only one bank's or one district's"""
+        return [
+            transfer for transfer in self.repo["transfers"]
+            if transfer["status"] == "Proposed"
+            and (bank is None or transfer["from_bank"] == bank)
+            and (district_id is None or transfer["district_id"] == district_id)
+        ]
+
+    def set_transfer_status(self, transfer, status):
+        transfer["status"] = status
+        transfer[f"{status.lower()}_at"] = datetime.now().isoformat()
+        self.repo.mark_dirty("transfers", transfer["id"])
+
+    @timed()
+    def plan_district_allocation(self, district_id):
+        """Plan stock transfers from every approved blood bank to a district's open requests.
+
+        Replaces the district's unconfirmed plan; stock held for other
+        districts' plans is left out. Each leg becomes a Proposed transfer for
+        its bank to confirm, and each bank is notified: call it inside a
+        transaction. Returns the new transfers.
+        """
+        now = datetime.now()
+        for transfer in self.open_transfers(district_id=district_id):
+            self.set_transfer_status(transfer, "Cancelled")
+        reserved = {}
+        for transfer in self.open_transfers():
+            reserved[transfer["inventory_id"]] = reserved.get(transfer["inventory_id"], 0) + transfer["units"]
+
+        needs = [
+            (request, self.remaining_units(request))
+            for request in self.query_requests(statuses=ALLOCATABLE_STATUSES, district_id=district_id)
+            if request["expires_at"] > now.isoformat() and self.remaining_units(request)
+        ]
+        users = self.repo["users"]
+        today = now.date().isoformat()
+        stock = []
+        for item in self.repo["inventory"]:
+            bank = users.get(item.get("added_by"), {})
+            if bank.get("role") == "Blood Bank" and bank.get("approved") and item.get("expiry", "")[:10] >= today:
+                stock.append((item, bank, item["units"] - reserved.get(item["id"], 0)))
+        requests = {request["id"]: request for request, _ in needs}
+        expiries = {item["id"]: item["expiry"] for item, _, _ in stock}
+
+        plan_id = generate_unique_id("PLAN")
+        transfers = []
+        for leg in plan_allocation(needs, stock, now):
+            request = requests[leg["request_id"]]
+            transfer = dict(leg, id=generate_unique_id("TRF"), plan_id=plan_id, district_id=district_id,
+                            to=request["requester"], blood_type=request["blood_type"],
+                            expiry=expiries[leg["inventory_id"]], distance=MATCH_DISTANCES[leg["distance"]],
+                            status="Proposed", created_at=now.isoformat())
+            self.repo["transfers"].append(transfer)
+            self.repo.mark_dirty("transfers", transfer["id"])
+            transfers.append(transfer)
+
+        for bank in {transfer["from_bank"] for transfer in transfers}:
+            units = sum(transfer["units"] for transfer in transfers if transfer["from_bank"] == bank)
+            self.notify_user(bank, {"message": f"🚚 {units} unit(s) of your stock are planned for transfer "
+                                               "to district requests. Please confirm in your dashboard."})
+        return transfers
+
+    def confirm_transfer(self, transfer, bank_phone):
+        """A bank confirms its leg: the units leave its stock and count towards the request.
+
+        Returns the units issued; 0, and the transfer is cancelled, when the
+        stock or the request has moved on since planning.
+        """
+        if transfer["status"] != "Proposed" or transfer["from_bank"] != bank_phone:
+            return 0
+        inventory = self.repo["inventory"]
+        pos = next((i for i, item in enumerate(inventory) if item.get("id") == transfer["inventory_id"]), None)
+        request = self.get_request(transfer["request_id"])
+        units = 0
+        if pos is not None and request is not None and request["status"] in ALLOCATABLE_STATUSES:
+            units = min(transfer["units"], inventory[pos]["units"], self.remaining_units(request))
+        if units <= 0:
+            self.set_transfer_status(transfer, "Cancelled")
+            return 0
+
+        item = inventory[pos]
+        item["units"] -= units
+        if not item["units"]:
+            del inventory[pos]
+        self.repo.mark_dirty("inventory", item["id"])
+
+        left = self.record_supply(request, [item["id"]] * units, bank_phone)
+        self.set_request_status(request, "Partially Fulfilled" if left else "Fulfilled")
+
+        transfer["units"] = units
+        self.set_transfer_status(transfer, "Confirmed")
+        self.notify_user(request["requester"], {
+            "message": f"🚚 {units} unit(s) of {request['blood_type']} are on the way for Request #{request['id']}"
+        })
+        return units
+
+    def decline_transfer(self, transfer, bank_phone):
+        """A bank turns down its leg; the request stays open for the next plan"""
+        if transfer["status"] == "Proposed" and transfer["from_bank"] == bank_phone:
+            self.set_transfer_status(transfer, "Declined")
+
+    # ---------- migrations ----------
+    def migrate_embedded_volunteers(self):
+        """Move volunteers still embedded in organization user records into the volunteer store"""
+        for phone, user in self.repo["users"].items():
+            if user.get("volunteers"):
+                self.add_volunteers(phone, user.pop("volunteers"))
+                self.repo.mark_dirty("users", phone)
+            elif "volunteers" in user:
+                user.pop("volunteers")
+                self.repo.mark_dirty("users", phone)
+
+    def backfill_location_ids(self):
+        """Give every stored user, request and volunteer its location IDs"""
+        for phone, user in self.repo["users"].items():
+            if assign_location_ids(self.locations, user):
+                self.repo.mark_dirty("users", phone)
+        for store in ("requests", "volunteers"):
+            for record in self.repo[store]:
+                if assign_location_ids(self.locations, record):
+                    self.repo.mark_dirty(store, record.get("id"))
+
+    def backfill_image_thumbnails(self):
+        """Re-encode stored certificates and test reports and give them thumbnails.
+
+        Images that can't be read get thumbnail False and are skipped from then on.
+        """
+        if not images_available():
+            return
+        for phone, user in self.repo["users"].items():
+            if user.get("certificate") and user.get("certificate_thumbnail") is None:
+                user["certificate"], user["certificate_thumbnail"] = process_stored_image(user["certificate"])
+                self.repo.mark_dirty("users", phone)
+        for item in self.repo["inventory"]:
+            if item.get("test_report") and item.get("test_report_thumbnail") is None:
+                item["test_report"], item["test_report_thumbnail"] = process_stored_image(item["test_report"])
+                self.repo.mark_dirty("inventory", item.get("id"))
+
+    def run_migrations(self):
+        """One-off upgrades of data written by older versions.
+
+        Runs once per data directory, not per session: the version reached is
+        recorded next to the stores, and later calls return False straight
+        away until MIGRATIONS_VERSION is bumped.
+        """
+        with self.repo.locked():
+            if self.repo.migration_version() >= MIGRATIONS_VERSION:
+                return False
+            self.repo.poll()
+            self.migrate_embedded_volunteers()
+            self.backfill_location_ids()
+            self.backfill_image_thumbnails()
+            # Build the analytics rollups from the existing request history
+            if not self.repo["rollups"]["counts"] and self.repo["requests"]:
+                self.repo["rollups"] = rebuild_rollups(self.repo["requests"])
+                self.repo.mark_dirty("rollups")
+            self.repo.flush()
+            self.repo.set_migration_version(MIGRATIONS_VERSION)
+        return True
@@ -0,0 +1,304 @@
+import marshal
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+from core.changefeed import locked
+from core.records import RECORD_TYPES
+from serialization import dumps, loads
+
+# Snapshots and log segments live here, under the data directory
+RECOVERY_DIR = "recovery"
+# BLOODHUB_WAL=0 turns the log off: stores are read from and written to their JSON files only
+WAL_ENABLED = os.environ.get("BLOODHUB_WAL", "1") != "0"
+
+# Checkpoint once this much log has piled up since the last snapshot...
+CHECKPOINT_WAL_BYTES = int(os.environ.get("BLOODHUB_CHECKPOINT_BYTES", str(32 << 20)))
+# ...or once the last snapshot is this old and the log isn't empty
+CHECKPOINT_INTERVAL_SECONDS = int(os.environ.get("BLOODHUB_CHECKPOINT_SECONDS", "600"))
+# Snapshots kept; the older one is the fallback if the newest fails its checksum
+KEEP_SNAPSHOTS = 2
+
+# Log frame: magic, payload length, crc32 of the payload, then the JSON payload
+FRAME_MAGIC = b"BHWL"
+FRAME_HEADER = struct.Struct(">4sII")
+# Snapshot: magic, Python major/minor and marshal version it was written with, crc32 and length of the body
+SNAPSHOT_MAGIC = b"BHSN"
+SNAPSHOT_HEADER = struct.Struct(">4sBBBxIQ")
+
+_checkpoint_running = threading.Lock()
+
+# ================== FILES ==================
+def segment_path(directory, seq):
+    return os.path.join(directory, f"wal-{seq:06d}.log")
+
+def snapshot_path(directory, seq):
+    return os.path.join(directory, f"snapshot-{seq:06d}.bin")
+
+def _numbered(directory, prefix, suffix):
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[len(prefix):-len(suffix)]) for name in names
+                  if name.startswith(prefix) and name.endswith(suffix) and name[len(prefix):-len(suffix)].isdigit())
+
+def segments(directory):
+    """Sequence numbers of the log segments, oldest first"""
+    return _numbered(directory, "wal-", ".log")
+
+def snapshots(directory):
+    """Sequence numbers of the snapshots, oldest first; snapshot N covers every segment before N"""
+    return _numbered(directory, "snapshot-", ".bin")
+
+def wal_lock(directory):
+    """Held for the whole of a flush (log, store files, commit) and while recovering or rotating"""
+    os.makedirs(directory, exist_ok=True)
+    return locked(os.path.join(directory, "wal"))
+
+def _fsync_dir(directory):
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+# ================== LOG ==================
+def encode_frame(payload):
+    """Frame a payload: a JSON-ready value, or bytes already encoded as JSON"""
+    body = payload if isinstance(payload, bytes) else dumps(payload)
+    return FRAME_HEADER.pack(FRAME_MAGIC, len(body), zlib.crc32(body)) + body
+
+def append(directory, payloads, sync=True):
+    """Append frames to the newest segment; call under wal_lock.
+
+    sync=True returns only once they are on disk: that is what makes a
+    flush durable before its store files are touched.
+    """
+    seqs = segments(directory)
+    with open(segment_path(directory, seqs[-1] if seqs else 1), "ab") as f:
+        f.write(b"".join(encode_frame(payload) for payload in payloads))
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+
+def read_frames(path):
+    """(payloads, end of the last good frame) of one segment.
+
+    Reading stops at the first frame whose header or checksum doesn't hold:
+    a torn append, or damage. Later frames may build on the lost one, so
+    replaying them would rebuild a state that never existed.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    payloads = []
+    pos = 0
+    while pos + FRAME_HEADER.size <= len(data):
+        magic, length, crc = FRAME_HEADER.unpack_from(data, pos)
+        start = pos + FRAME_HEADER.size
+        body = data[start:start + length]
+        if magic != FRAME_MAGIC or len(body) != length or zlib.crc32(body) != crc:
+            break
+        payloads.append(loads(body))
+        pos = start + length
+    return payloads, pos
+
+def read_log(directory, since=0, repair=False):
+    """Every frame in the segments numbered since and up, oldest first, up to the first bad one.
+
+    With repair (call under wal_lock), the log is cut at the bad frame so
+    later appends follow a good one: see quarantine.
+    """
+    seqs = [seq for seq in segments(directory) if seq >= since]
+    frames = []
+    for i, seq in enumerate(seqs):
+        path = segment_path(directory, seq)
+        payloads, good_end = read_frames(path)
+        frames.extend(payloads)
+        if good_end < os.path.getsize(path):
+            if repair:
+                quarantine(directory, seq, good_end, seqs[i + 1:])
+            break
+    return frames
+
+def quarantine(directory, seq, good_end, later):
+    """Cut segment seq at good_end; call under wal_lock.
+
+    A torn tail (nothing that looks like another frame after it) is just
+    dropped. Otherwise the rest of the segment and the later segments are
+    moved to .bad files beside the log, for someone to look at.
+    """
+    path = segment_path(directory, seq)
+    with open(path, "rb") as f:
+        f.seek(good_end)
+        rest = f.read()
+    if later or rest.find(FRAME_MAGIC, 1) >= 0:
+        suffix = datetime.now().strftime(".%Y%m%d%H%M%S.bad")
+        with open(path + suffix, "wb") as f:
+            f.write(rest)
+            os.fsync(f.fileno())
+        for later_seq in later:
+            os.replace(segment_path(directory, later_seq), segment_path(directory, later_seq) + suffix)
+    with open(path, "r+b") as f:
+        f.truncate(good_end)
+        os.fsync(f.fileno())
+    _fsync_dir(directory)
+
+def log_bytes(directory, since=0):
+    """Size of the log a cold start would replay"""
+    return sum(os.path.getsize(segment_path(directory, seq)) for seq in segments(directory) if seq >= since)
+
+def rotate(directory):
+    """Start a new segment and return its number; call under wal_lock"""
+    seqs = segments(directory)
+    seq = (seqs[-1] if seqs else 0) + 1
+    open(segment_path(directory, seq), "ab").close()
+    return seq
+
+# ================== SNAPSHOTS ==================
+def _encode_records(record_type, records):
+    """Records as (fields present, their values, overflow dict) rows marshal can write"""
+    shapes = {}
+    converted = record_type.CONVERTERS
+    rows = []
+    for record in records:
+        fields = tuple(field for field in record_type.FIELDS if hasattr(record, field))
+        # One tuple per distinct shape: marshal writes the repeats as back-references
+        fields = shapes.setdefault(fields, fields)
+        values = tuple(loads(dumps(getattr(record, field))) if field in converted else getattr(record, field)
+                       for field in fields)
+        rows.append((fields, values, record._extra))
+    return rows
+
+def _decode_records(record_type, rows):
+    new = record_type.__new__
+    converters = record_type.CONVERTERS
+    records = []
+    for fields, values, extra in rows:
+        record = new(record_type)
+        record._extra = extra
+        for field, value in zip(fields, values):
+            setattr(record, field, value)
+        for field, converter in converters.items():
+            if hasattr(record, field):
+                setattr(record, field, converter(getattr(record, field)))
+        records.append(record)
+    return records
+
+def encode_store(store, data):
+    record_type = RECORD_TYPES.get(store)
+    if record_type is None:
+        return ("value", data)
+    if isinstance(data, dict):
+        return ("dict", list(data), _encode_records(record_type, data.values()))
+    return ("list", _encode_records(record_type, data))
+
+def decode_store(store, encoded):
+    if encoded[0] == "value":
+        return encoded[1]
+    record_type = RECORD_TYPES[store]
+    if encoded[0] == "dict":
+        return dict(zip(encoded[1], _decode_records(record_type, encoded[2])))
+    return _decode_records(record_type, encoded[1])
+
+def write_snapshot(directory, seq, stores, versions):
+    """Write snapshot seq atomically (temp file, fsync, rename); returns its path and size"""
+    body = marshal.dumps({
+        "seq": seq,
+        "taken_at": datetime.now().isoformat(),
+        "versions": versions,
+        "stores": {store: encode_store(store, data) for store, data in stores.items()},
+    }, marshal.version)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, sys.version_info[0], sys.version_info[1], marshal.version,
+                                  zlib.crc32(body), len(body))
+    path = snapshot_path(directory, seq)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(directory)
+    return path, len(header) + len(body)
+
+def read_snapshot(directory, seq):
+    """(stores, versions) from snapshot seq, or None if it is damaged or from another Python"""
+    try:
+        with open(snapshot_path(directory, seq), "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    if len(raw) < SNAPSHOT_HEADER.size:
+        return None
+    magic, major, minor, marshal_version, crc, length = SNAPSHOT_HEADER.unpack_from(raw)
+    body = raw[SNAPSHOT_HEADER.size:]
+    if (magic != SNAPSHOT_MAGIC or (major, minor) != sys.version_info[:2] or marshal_version != marshal.version
+            or len(body) != length or zlib.crc32(body) != crc):
+        return None
+    snapshot = marshal.loads(body)
+    stores = {store: decode_store(store, encoded) for store, encoded in snapshot["stores"].items()}
+    return stores, dict(snapshot["versions"])
+
+def latest_snapshot(directory):
+    """(seq, stores, versions) of the newest snapshot that checks out; (0, {}, {}) when there is none"""
+    for seq in reversed(snapshots(directory)):
+        snapshot = read_snapshot(directory, seq)
+        if snapshot is not None:
+            return (seq,) + snapshot
+    return 0, {}, {}
+
+def prune(directory, keep=KEEP_SNAPSHOTS):
+    """Drop all but the newest keep snapshots, and the segments none of those needs"""
+    seqs = snapshots(directory)
+    for seq in seqs[:-keep]:
+        os.remove(snapshot_path(directory, seq))
+    if seqs:
+        oldest = seqs[-keep:][0]
+        for seq in segments(directory):
+            if seq < oldest:
+                os.remove(segment_path(directory, seq))
+
+# ================== CHECKPOINTS ==================
+def checkpoint_due(directory, wal_bytes=CHECKPOINT_WAL_BYTES, interval=CHECKPOINT_INTERVAL_SECONDS):
+    """True once the log since the newest snapshot is large or old enough to be worth folding in"""
+    seqs = snapshots(directory)
+    pending = log_bytes(directory, seqs[-1] if seqs else 0)
+    if not pending:
+        return False
+    if not seqs or pending >= wal_bytes:
+        return True
+    return time.time() - os.path.getmtime(snapshot_path(directory, seqs[-1])) >= interval
+
+def start_checkpoint(checkpoint):
+    """Run checkpoint() on a daemon thread unless one is already running in this process"""
+    if not _checkpoint_running.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            checkpoint()
+        finally:
+            _checkpoint_running.release()
+    threading.Thread(target=run, name="wal-checkpoint", daemon=True).start()
+    return True
+
+if __name__ == "__main__":
+    # Usage: python -m core.wal --data-dir . [--if-due]   (cron alternative to the app's own checkpoints)
+    import argparse
+    from core.repository import Repository
+    parser = argparse.ArgumentParser(description="Snapshot the BloodHub stores and trim the write-ahead log")
+    parser.add_argument("--data-dir", default=".")
+    parser.add_argument("--if-due", action="store_true", help="only if checkpoint_due() says so")
+    args = parser.parse_args()
+    repository = Repository(data_dir=args.data_dir, wal=True)
+    if args.if_due and not checkpoint_due(repository.recovery_dir()):
+        print("Checkpoint not due")
+        sys.exit(0)
+    start = time.perf_counter()
+    path, size = repository.checkpoint()
+    print(f"Wrote {path} ({size / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
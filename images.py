@@ -0,0 +1,80 @@
+import base64
+import io
+
+try:
+    from PIL import Image, ImageOps, features  # Optional: uploads are stored as-is without it
+except ImportError:
+    Image = None
+
+# Longest side of stored images and of thumbnails, in pixels
+MAX_IMAGE_SIDE = 1600
+THUMBNAIL_SIDE = 240
+
+IMAGE_QUALITY = 80
+THUMBNAIL_QUALITY = 70
+
+def available():
+    """True if Pillow is installed"""
+    return Image is not None
+
+def output_format():
+    """WebP where Pillow was built with it, JPEG otherwise"""
+    return "WEBP" if features.check("webp") else "JPEG"
+
+def _encode(image, max_side, quality):
+    """Resize image to fit max_side and encode it in the output format"""
+    image = image.copy()
+    image.thumbnail((max_side, max_side))
+    image_format = output_format()
+    if image_format == "JPEG" and image.mode != "RGB":
+        # JPEG has no alpha channel; flatten transparent scans onto white
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A") if "A" in image.getbands() else None)
+        image = background
+    options = {"quality": quality}
+    if image_format == "WEBP":
+        options["method"] = 4
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+def _open(raw):
+    """Decode raw upload bytes, applying the camera's EXIF rotation"""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(raw)))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or "A" in image.getbands() else "RGB")
+    return image
+
+def process_image(raw):
+    """(image_base64, thumbnail_base64) for uploaded image bytes.
+
+    The stored image is capped at MAX_IMAGE_SIDE and re-encoded, unless the
+    original is already smaller than the re-encoding. Without Pillow, or for
+    bytes Pillow can't read, the original is kept and there is no thumbnail.
+    """
+    if not available():
+        return base64.b64encode(raw).decode("utf-8"), None
+    try:
+        image = _open(raw)
+    except (OSError, ValueError):
+        return base64.b64encode(raw).decode("utf-8"), None
+    encoded = _encode(image, MAX_IMAGE_SIDE, IMAGE_QUALITY)
+    if len(encoded) >= len(raw) and max(image.size) <= MAX_IMAGE_SIDE:
+        encoded = raw
+    thumbnail = _encode(image, THUMBNAIL_SIDE, THUMBNAIL_QUALITY)
+    return base64.b64encode(encoded).decode("utf-8"), base64.b64encode(thumbnail).decode("utf-8")
+
+def process_stored_image(image_base64):
+    """process_image for an image already stored as base64 (backfills).
+
+    An image that can't be read is kept as it is with thumbnail False rather
+    than None, so backfills take it as done instead of retrying it.
+    """
+    try:
+        raw = base64.b64decode(image_base64)
+    except ValueError:
+        return image_base64, False
+    image_base64, thumbnail = process_image(raw)
+    if thumbnail is None and available():
+        thumbnail = False
+    return image_base64, thumbnail
@@ -0,0 +1,82 @@
+import re
+
+# Spelling variants common in romanised Malayalam place names, folded before matching
+TRANSLITERATION_RULES = [
+    ("th", "t"), ("dh", "d"), ("zh", "z"), ("kh", "k"), ("bh", "b"), ("ph", "f"),
+    ("aa", "a"), ("ee", "i"), ("oo", "u"), ("w", "v")
+]
+
+# Minimum score for best_match to accept a correction
+MATCH_THRESHOLD = 0.6
+
+def normalize_name(name):
+    """Fold case, spacing and transliteration variants: 'Tiruvalla' and 'Thiruvala' both become 'tiruvala'"""
+    name = re.sub(r"[^a-z]", "", str(name).lower())
+    for variant, folded in TRANSLITERATION_RULES:
+        name = name.replace(variant, folded)
+    # Doubled consonants/vowels are written either way (Alappuzha / Alapuzha)
+    return re.sub(r"(.)\1+", r"\1", name)
+
+def trigrams(normalized):
+    """Set of padded character trigrams of a normalized name"""
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def build_search_index(table):
+    """Trigram index over every district, taluk and village in a compiled location table"""
+    index = {"table": table, "entries": {}, "postings": {}}
+    for location_id, name in table["names"].items():
+        normalized = normalize_name(name)
+        grams = trigrams(normalized)
+        index["entries"][location_id] = (normalized, len(grams))
+        for gram in grams:
+            index["postings"].setdefault(gram, []).append(location_id)
+    return index
+
+def search_locations(index, query, level=None, parent_id=None, limit=5):
+    """Best (location_id, score) matches for free text, highest score first.
+
+    Scores are the Dice coefficient of the trigram sets, with prefix matches
+    lifted so partially typed names autocomplete. level ('district', 'taluk',
+    'village') and parent_id restrict the candidates.
+    """
+    normalized = normalize_name(query)
+    if not normalized:
+        return []
+    grams = trigrams(normalized)
+    table = index["table"]
+
+    shared = {}
+    for gram in grams:
+        for location_id in index["postings"].get(gram, ()):
+            shared[location_id] = shared.get(location_id, 0) + 1
+
+    results = []
+    for location_id, common in shared.items():
+        if level is not None and table["levels"][location_id] != level:
+            continue
+        if parent_id is not None and table["parents"][location_id] != parent_id:
+            continue
+        entry_name, entry_size = index["entries"][location_id]
+        score = 2 * common / (len(grams) + entry_size)
+        if entry_name.startswith(normalized):
+            score = max(score, 0.5 + 0.5 * len(normalized) / len(entry_name))
+        results.append((score, location_id))
+
+    results.sort(key=lambda result: (-result[0], result[1]))
+    return [(location_id, score) for score, location_id in results[:limit]]
+
+def best_match(index, name, level=None, parent_id=None, threshold=MATCH_THRESHOLD):
+    """ID of the closest place to name, or None if nothing scores above threshold"""
+    matches = search_locations(index, name, level=level, parent_id=parent_id, limit=1)
+    if matches and matches[0][1] >= threshold:
+        return matches[0][0]
+    return None
+
+def location_lineage(table, location_id):
+    """(district, taluk, village) names for a location ID; missing levels are empty"""
+    names = {"district": "", "taluk": "", "village": ""}
+    while location_id:
+        names[table["levels"][location_id]] = table["names"][location_id]
+        location_id = table["parents"][location_id]
+    return names["district"], names["taluk"], names["village"]
@@ -0,0 +1,110 @@
+import os
+
+from utils import load_data, save_data
+
+LOCATION_IDS_FILE = "location_ids.json"
+# The registry shipped with the code; the generated and sample data use its IDs
+DEFAULT_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), LOCATION_IDS_FILE)
+
+DISTRICT, TALUK, VILLAGE = "district", "taluk", "village"
+
+def get_location_name(district, taluk, village):
+    """Get formatted location name"""
+    return f"{village}, {taluk}, {district}" if village else f"{taluk}, {district}"
+
+def location_path(district, taluk=None, village=None):
+    """Registry key for a place, e.g. 'Kollam|Kottarakkara|Valakom'"""
+    return "|".join(part for part in (district, taluk, village) if part)
+
+def registry_path(data_dir):
+    """Location ID registry of a data directory; the IDs its records store come from it"""
+    return os.path.join(data_dir, LOCATION_IDS_FILE)
+
+def compile_locations(locations, registry_file=DEFAULT_REGISTRY):
+    """Compile the district -> taluk -> village mapping into an integer-coded table.
+
+    IDs come from an append-only registry file (path -> id), so a place keeps
+    its ID when the location list is reordered or extended; new places get the
+    next free ID and the registry is saved to registry_file. A data directory
+    without a registry yet (see registry_path) starts from the shipped one.
+
+    The table is a dict of lookup structures:
+      names[id], levels[id], parents[id]   -- parent is 0 for districts
+      children[id]                         -- child ids in file order (0 = districts)
+      path_ids[path]                       -- 'District|Taluk|Village' -> id
+      ids_by_name[level][name]             -- every id with that name (villages repeat across taluks)
+    """
+    # Until it gets a place of its own, a data directory reads the shipped registry
+    registry = load_data(registry_file if os.path.exists(registry_file) else DEFAULT_REGISTRY, {})
+    next_id = max(registry.values(), default=0) + 1
+    registry_changed = False
+
+    table = {
+        "names": {},
+        "levels": {},
+        "parents": {},
+        "children": {0: []},
+        "path_ids": {},
+        "ids_by_name": {DISTRICT: {}, TALUK: {}, VILLAGE: {}}
+    }
+
+    def add(level, name, parent_id, path):
+        nonlocal next_id, registry_changed
+        if path not in registry:
+            registry[path] = next_id
+            next_id += 1
+            registry_changed = True
+        location_id = registry[path]
+        table["names"][location_id] = name
+        table["levels"][location_id] = level
+        table["parents"][location_id] = parent_id
+        table["children"].setdefault(location_id, [])
+        table["children"][parent_id].append(location_id)
+        table["path_ids"][path] = location_id
+        table["ids_by_name"][level].setdefault(name, []).append(location_id)
+        return location_id
+
+    for district, data in locations.items():
+        district_id = add(DISTRICT, district, 0, location_path(district))
+        villages = data.get("villages", {})
+        for taluk in data.get("taluks", []):
+            taluk_id = add(TALUK, taluk, district_id, location_path(district, taluk))
+            for village in villages.get(taluk, []):
+                add(VILLAGE, village, taluk_id, location_path(district, taluk, village))
+
+    if registry_changed:
+        save_data(registry_file, registry)
+    return table
+
+def child_names(table, parent_id=0):
+    """Names of a place's children in file order (districts for parent_id 0)"""
+    return [table["names"][child] for child in table["children"].get(parent_id, [])]
+
+def resolve_location(table, district, taluk=None, village=None):
+    """(district_id, taluk_id, village_id) for a set of names; unknown parts are None"""
+    district_id = table["path_ids"].get(location_path(district)) if district else None
+    taluk_id = table["path_ids"].get(location_path(district, taluk)) if district_id and taluk else None
+    village_id = table["path_ids"].get(location_path(district, taluk, village)) if taluk_id and village else None
+    return district_id, taluk_id, village_id
+
+def assign_location_ids(table, record):
+    """Add district_id/taluk_id/village_id to a record from its name fields.
+
+    The names stay on the record: they are what the user picked, and the only
+    record of a place missing from the location list (its ID is None). Pages,
+    donor notices and the admin user table show them as stored. Known names are
+    swapped for the table's own string objects, so the many records naming
+    the same place share one string in memory. Returns True if the record
+    changed.
+    """
+    if not record.get("district"):
+        return False
+    ids = resolve_location(table, record.get("district"), record.get("taluk"), record.get("village"))
+    changed = False
+    for field, location_id in zip(("district", "taluk", "village"), ids):
+        if record.get(f"{field}_id") != location_id:
+            record[f"{field}_id"] = location_id
+            changed = True
+        if location_id is not None:
+            record[field] = table["names"][location_id]
+    return changed
@@ -0,0 +1,213 @@
+import argparse
+import json
+import sys
+import tracemalloc
+import weakref
+from collections.abc import Mapping
+from datetime import datetime
+from urllib.request import urlopen
+from core.constants import STORE_FILES
+
+# Image fields counted as "blobs" rather than under their store
+BLOB_FIELDS = frozenset({"certificate", "certificate_thumbnail", "test_report", "test_report_thumbnail"})
+# Frames kept per allocation while tracing; more frames, more overhead
+TRACE_FRAMES = 5
+# tracemalloc snapshots kept for diffing
+MAX_SNAPSHOTS = 4
+# Path the running app serves the report on (see metrics.start_http_server)
+REPORT_PATH = "/debug/memory"
+
+# Process-wide: session id -> weak reference to that session's state
+_sessions = {}
+_snapshots = []  # (label, taken_at, tracemalloc.Snapshot)
+
+# ================== OBJECT SIZES ==================
+def _children(obj):
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return ()
+    if isinstance(obj, Mapping):
+        return ((key, value) for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return ((None, value) for value in obj)
+    return ()
+
+def deep_size(obj, seen=None):
+    """(bytes, blob bytes) reachable from obj, counting each object once.
+
+    Walks dicts, lists, tuples, sets and dict-like records; strings held
+    under BLOB_FIELDS are counted as blob bytes instead.
+    """
+    seen = set() if seen is None else seen
+    total = blobs = 0
+    stack = [(None, obj)]
+    while stack:
+        key, current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        size = sys.getsizeof(current)
+        if key in BLOB_FIELDS and isinstance(current, str):
+            blobs += size
+        else:
+            total += size
+            if isinstance(current, Mapping) and not isinstance(current, dict):
+                # Slotted records: getsizeof misses the overflow dict
+                extra = getattr(current, "_extra", None)
+                if extra:
+                    total += sys.getsizeof(extra)
+            stack.extend(_children(current))
+    return total, blobs
+
+def state_breakdown(state):
+    """Bytes per store, for blobs and for everything else in a session's state"""
+    seen = set()
+    breakdown = {"blobs": 0}
+    for store in STORE_FILES:
+        if store in state:
+            size, blobs = deep_size(state[store], seen)
+            breakdown[store] = size
+            breakdown["blobs"] += blobs
+    other, blobs = deep_size({key: value for key, value in state.items() if key not in STORE_FILES}, seen)
+    breakdown["session_other"] = other
+    breakdown["blobs"] += blobs
+    breakdown["total"] = sum(breakdown.values())
+    return breakdown
+
+# ================== SESSIONS ==================
+def track_session(session_id, state):
+    """Remember a session's state for reports; dropped automatically when the session goes away"""
+    if session_id not in _sessions:
+        try:
+            _sessions[session_id] = weakref.ref(state)
+        except TypeError:
+            # Plain dicts can't be weakly referenced (CLI, API); keep them for the process lifetime
+            _sessions[session_id] = lambda: state
+
+def live_sessions():
+    """{session id: state mapping} for sessions still alive"""
+    alive = {}
+    for session_id, ref in list(_sessions.items()):
+        state = ref()
+        if state is None:
+            _sessions.pop(session_id, None)
+        else:
+            alive[session_id] = state
+    return alive
+
+def session_report(as_mapping=dict):
+    """Per-session breakdown; sessions share nothing but interned strings, so their totals add up.
+
+    as_mapping turns a tracked state object into a plain mapping of its keys.
+    """
+    rows = []
+    for session_id, state in live_sessions().items():
+        try:
+            row = state_breakdown(as_mapping(state))
+        except Exception:
+            # The session was torn down while we walked it
+            continue
+        rows.append(dict(row, session=session_id[:8]))
+    return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+# ================== TRACEMALLOC ==================
+def tracing():
+    return tracemalloc.is_tracing()
+
+def start_tracing(frames=TRACE_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def stop_tracing():
+    tracemalloc.stop()
+    _snapshots.clear()
+
+def take_snapshot(label=None):
+    """Snapshot allocations now; keeps the last MAX_SNAPSHOTS"""
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    _snapshots.append((label or f"snapshot {len(_snapshots) + 1}", datetime.now().isoformat(), snapshot))
+    del _snapshots[:-MAX_SNAPSHOTS]
+    return snapshot
+
+def snapshots():
+    return [(label, taken_at) for label, taken_at, _ in _snapshots]
+
+def top_allocations(limit=15, group_by="lineno"):
+    """Largest allocation sites in the latest snapshot"""
+    if not _snapshots:
+        return []
+    stats = _snapshots[-1][2].statistics(group_by)[:limit]
+    return [{"where": str(stat.traceback[0]), "kb": stat.size / 1024, "blocks": stat.count} for stat in stats]
+
+def snapshot_diff(limit=15, group_by="lineno"):
+    """Allocation sites that grew most between the last two snapshots"""
+    if len(_snapshots) < 2:
+        return []
+    stats = _snapshots[-1][2].compare_to(_snapshots[-2][2], group_by)[:limit]
+    return [{"where": str(stat.traceback[0]), "kb_diff": stat.size_diff / 1024, "kb": stat.size / 1024,
+             "blocks_diff": stat.count_diff} for stat in stats]
+
+def traced_memory():
+    """(current, peak) bytes traced, or None when not tracing"""
+    return tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else None
+
+# ================== REPORT ==================
+def report(as_mapping=dict):
+    """Everything above as one JSON-ready dict"""
+    sessions = session_report(as_mapping)
+    totals = {}
+    for row in sessions:
+        for key, value in row.items():
+            if key != "session":
+                totals[key] = totals.get(key, 0) + value
+    traced = traced_memory()
+    return {
+        "taken_at": datetime.now().isoformat(),
+        "sessions": sessions,
+        "totals": totals,
+        "tracing": traced is not None,
+        "traced_bytes": traced[0] if traced else None,
+        "traced_peak_bytes": traced[1] if traced else None,
+        "snapshots": snapshots(),
+        "top_allocations": top_allocations(),
+        "growth": snapshot_diff(),
+    }
+
+def format_report(data):
+    mb = 1 / 1e6
+    lines = [f"Memory report {data['taken_at']}: {len(data['sessions'])} session(s)"]
+    columns = ["users", "requests", "inventory", "volunteers", "blobs", "session_other", "total"]
+    rows = data["sessions"] + ([dict(data["totals"], session="TOTAL")] if data["sessions"] else [])
+    if rows:
+        lines.append(f"{'session':<10}" + "".join(f"{column:>14}" for column in columns))
+        for row in rows:
+            lines.append(f"{row['session']:<10}" + "".join(f"{row.get(column, 0) * mb:>12.1f}MB" for column in columns))
+    if data["tracing"]:
+        lines.append(f"tracemalloc: {data['traced_bytes'] * mb:.1f} MB now, {data['traced_peak_bytes'] * mb:.1f} MB peak")
+        for row in data["growth"] or data["top_allocations"]:
+            size = f"{row['kb_diff']:+.0f} KB" if "kb_diff" in row else f"{row['kb']:.0f} KB"
+            lines.append(f"  {size:>12}  {row['where']}")
+    else:
+        lines.append("tracemalloc: off")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # Usage: python memory.py --url http://127.0.0.1:9108   (app started with BLOODHUB_METRICS_PORT=9108)
+    #        python memory.py --data-dir .                  (fresh load of the store files, no sessions)
+    parser = argparse.ArgumentParser(description="Dump a BloodHub memory report")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--url", help="base URL of a running app's metrics endpoint")
+    source.add_argument("--data-dir", default=".")
+    parser.add_argument("--json", action="store_true", help="print raw JSON")
+    args = parser.parse_args()
+    if args.url:
+        with urlopen(args.url.rstrip("/") + REPORT_PATH) as response:
+            data = json.loads(response.read())
+    else:
+        from core import Repository
+        repository = Repository(data_dir=args.data_dir).load()
+        track_session("cli", repository.state)
+        data = report()
+    print(json.dumps(data, indent=2) if args.json else format_report(data))
@@ -0,0 +1,214 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import perf
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Where the app writes metrics for node_exporter's textfile collector (unset: no file)
+METRICS_FILE = os.environ.get("BLOODHUB_METRICS_FILE")
+METRICS_FILE_INTERVAL_SECONDS = int(os.environ.get("BLOODHUB_METRICS_FILE_SECONDS", "15"))
+# Port for the app's /metrics endpoint (unset: no endpoint)
+METRICS_PORT = os.environ.get("BLOODHUB_METRICS_PORT")
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statuses counted as the request queue
+QUEUE_STATUSES = ("Pending", "Accepted", "Partially Fulfilled")
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """A metric family: one value per label combination.
+
+    Updates are plain dict writes with no lock: under the GIL a rare race
+    can drop one increment, which monitoring tolerates far better than a
+    lock on every request.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def samples(self):
+        for values, value in self.values.items():
+            yield self.name, _labels(self.labels, values), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {_number(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, by=1):
+        self.values[labels] = self.values.get(labels, 0) + by
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels, count=1):
+        """Record count observations of value"""
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values.setdefault(labels, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state["buckets"][i] += count
+                break
+        state["sum"] += value * count
+        state["count"] += count
+
+    def samples(self):
+        for values, state in self.values.items():
+            cumulative = 0
+            for bound, hits in zip(self.buckets, state["buckets"]):
+                cumulative += hits
+                yield f"{self.name}_bucket", _labels(self.labels, values, [f'le="{_number(bound)}"']), cumulative
+            yield f"{self.name}_bucket", _labels(self.labels, values, ['le="+Inf"']), state["count"]
+            yield f"{self.name}_sum", _labels(self.labels, values), state["sum"]
+            yield f"{self.name}_count", _labels(self.labels, values), state["count"]
+
+# ================== PROCESS METRICS ==================
+REQUEST_TRANSITIONS = Counter("bloodhub_request_transitions_total",
+                              "Blood request status changes (from=none for new requests)", ("from", "to"))
+DONOR_MATCHES = Counter("bloodhub_donor_matches_total", "Donors and volunteers matched to requests", ("urgency",))
+NOTIFICATIONS = Counter("bloodhub_notifications_total", "Notifications by channel and outcome", ("channel", "result"))
+
+REGISTRY = [REQUEST_TRANSITIONS, DONOR_MATCHES, NOTIFICATIONS]
+
+# ================== COLLECTED AT SCRAPE TIME ==================
+def perf_metrics():
+    """Call latencies and data file I/O recorded by perf (empty when BLOODHUB_PERF=0)"""
+    durations = Histogram("bloodhub_call_duration_seconds",
+                          "Latency of instrumented calls: matching, notifications, fulfilment, file I/O, renders",
+                          ("call",))
+    for name, stats in list(perf.timings().items()):
+        for index, hits in list(stats["buckets"].items()):
+            durations.observe(perf.bucket_upper(index), name, count=hits)
+        # Use the exact sum rather than the bucket approximation
+        durations.values[(name,)]["sum"] = stats["total"]
+    io_bytes = Counter("bloodhub_file_bytes_total", "Bytes read from and written to data files", ("file", "direction"))
+    io_ops = Counter("bloodhub_file_operations_total", "Data file reads and writes", ("file", "direction"))
+    for row in perf.io_report():
+        for direction, ops, size in (("read", "reads", "bytes_read"), ("write", "writes", "bytes_written")):
+            if row[ops]:
+                io_ops.inc(row["file"], direction, by=row[ops])
+                io_bytes.inc(row["file"], direction, by=row[size])
+    return [durations, io_bytes, io_ops]
+
+def store_metrics(repo):
+    """Request queue, inventory and Red Alert gauges from a repository's current data"""
+    queue = Gauge("bloodhub_open_requests", "Requests waiting on donors or stock", ("status", "urgency"))
+    now = datetime.now().isoformat()
+    for request in repo["requests"]:
+        if request.get("status") in QUEUE_STATUSES and request.get("expires_at", "") > now:
+            key = (request["status"], request.get("urgency"))
+            queue.values[key] = queue.values.get(key, 0) + 1
+    inventory = Gauge("bloodhub_inventory_units", "Units in stock per blood type", ("blood_type",))
+    for item in repo["inventory"]:
+        key = (item.get("blood_type"),)
+        inventory.values[key] = inventory.values.get(key, 0) + item.get("units", 0)
+    red_alert = Gauge("bloodhub_red_alert", "1 while Red Alert is active")
+    red_alert.set(1 if repo["red_alert"] else 0)
+    return [queue, inventory, red_alert]
+
+def render(repo=None):
+    """Every metric in Prometheus text format; store gauges only when a repository is given"""
+    families = REGISTRY + perf_metrics()
+    if repo is not None:
+        families += store_metrics(repo)
+    return "\n".join(family.render() for family in families) + "\n"
+
+# ================== EXPORTERS ==================
+def write_metrics_file(path, repo=None):
+    """Write the metrics atomically, for node_exporter's textfile collector"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render(repo))
+    os.replace(tmp_path, path)
+
+def metrics_file_due(path=METRICS_FILE):
+    if not path:
+        return False
+    try:
+        return time.time() - os.path.getmtime(path) >= METRICS_FILE_INTERVAL_SECONDS
+    except FileNotFoundError:
+        return True
+
+def start_http_server(port, repo_factory=None, host="127.0.0.1", routes=None):
+    """Serve /metrics from a daemon thread.
+
+    Requests are handled one at a time on that thread, so the repository
+    made by repo_factory (kept current with poll()) is never shared. routes
+    adds other read-only pages: path -> function returning (content type, text).
+    """
+    repo = repo_factory() if repo_factory else None
+
+    def metrics_page():
+        if repo is not None:
+            repo.poll()
+        return CONTENT_TYPE, render(repo)
+    pages = dict(routes or {}, **{"/metrics": metrics_page})
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            page = pages.get(self.path.split("?")[0])
+            if page is None:
+                self.send_error(404)
+                return
+            content_type, text = page()
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, int(port)), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    # Usage: python metrics.py --data-dir . [--out bloodhub.prom]  (store gauges only; counters live in the app)
+    from core import Repository
+    parser = argparse.ArgumentParser(description="Print BloodHub store metrics in Prometheus format")
+    parser.add_argument("--data-dir", default=".")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+    repository = Repository(data_dir=args.data_dir).load()
+    if args.out:
+        write_metrics_file(args.out, repository)
+    else:
+        print(render(repository), end="")
@@ -0,0 +1,132 @@
+import math
+import os
+import time
+from functools import wraps
+
+# BLOODHUB_PERF=0 turns instrumentation off: timed() then returns functions untouched
+# and span() a shared no-op, so nothing is measured or stored
+ENABLED = os.environ.get("BLOODHUB_PERF", "1") != "0"
+
+# Latency histogram resolution: 4 buckets per doubling (~19% wide), from 1 µs up
+BUCKETS_PER_DOUBLING = 4
+PERCENTILES = (50, 95, 99)
+
+# Process-wide, shared by every session; plain dict updates, no locks
+_timings = {}  # name -> {"count", "total", "max", "buckets": {index: count}}
+_io = {}       # file name -> {"reads", "bytes_read", "writes", "bytes_written"}
+
+def _bucket(seconds):
+    micros = seconds * 1e6
+    return int(math.log2(micros) * BUCKETS_PER_DOUBLING) if micros > 1 else 0
+
+def bucket_upper(index):
+    """Upper bound of a bucket in seconds"""
+    return 2 ** ((index + 1) / BUCKETS_PER_DOUBLING) / 1e6
+
+def record(name, seconds):
+    """Add one call's latency to a histogram"""
+    stats = _timings.get(name)
+    if stats is None:
+        stats = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "buckets": {}})
+    stats["count"] += 1
+    stats["total"] += seconds
+    if seconds > stats["max"]:
+        stats["max"] = seconds
+    index = _bucket(seconds)
+    stats["buckets"][index] = stats["buckets"].get(index, 0) + 1
+
+def record_io(filename, read=0, written=0):
+    """Count bytes read from or written to a data file"""
+    stats = _io.get(filename)
+    if stats is None:
+        stats = _io.setdefault(filename, {"reads": 0, "bytes_read": 0, "writes": 0, "bytes_written": 0})
+    if read:
+        stats["reads"] += 1
+        stats["bytes_read"] += read
+    if written:
+        stats["writes"] += 1
+        stats["bytes_written"] += written
+
+def timed(name=None):
+    """Decorator recording each call's latency under name (default: the function's name)"""
+    def decorate(func):
+        if not ENABLED:
+            return func
+        label = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(name):
+    """Context manager timing a block under name"""
+    return _Span(name) if ENABLED else _NO_SPAN
+
+def percentile(buckets, count, q):
+    """Approximate q-th percentile (seconds) from a bucket histogram"""
+    target = count * q / 100
+    seen = 0
+    for index in sorted(buckets):
+        seen += buckets[index]
+        if seen >= target:
+            return bucket_upper(index)
+    return 0.0
+
+def timing_report():
+    """One row per instrumented name, slowest total first; times in milliseconds"""
+    rows = []
+    for name, stats in list(_timings.items()):
+        count = stats["count"]
+        if not count:
+            continue
+        row = {"name": name, "calls": count, "mean_ms": stats["total"] / count * 1000}
+        for q in PERCENTILES:
+            # A bucket's upper bound can overshoot the slowest call actually seen
+            row[f"p{q}_ms"] = min(percentile(stats["buckets"], count, q), stats["max"]) * 1000
+        row["max_ms"] = stats["max"] * 1000
+        row["total_s"] = stats["total"]
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["total_s"], reverse=True)
+
+def io_report():
+    """One row per data file with read and write counts and bytes"""
+    return [dict(stats, file=filename) for filename, stats in sorted(_io.items())]
+
+def timings():
+    """The raw histograms, for exporters"""
+    return _timings
+
+def reset():
+    _timings.clear()
+    _io.clear()
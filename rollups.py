@@ -0,0 +1,82 @@
+from datetime import datetime
+
+# Dimensions of every rollup counter, in key order
+ROLLUP_FIELDS = ["day", "hour", "district_id", "blood_type", "urgency", "status"]
+
+# Upper bounds (minutes) of the fulfilment latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = [15, 30, 60, 120, 240, 480, 1440, 4320, 10080]
+LATENCY_STAGES = ["created_to_accepted", "accepted_to_fulfilled", "created_to_fulfilled"]
+
+def empty_rollups():
+    """Fresh rollup store: request counters plus one latency histogram per stage"""
+    return {
+        "counts": {},
+        "latency": {stage: [0] * (len(LATENCY_BUCKETS) + 1) for stage in LATENCY_STAGES}
+    }
+
+def rollup_key(request, status):
+    """Counter key 'day|hour|district_id|blood_type|urgency|status' for a request"""
+    created = datetime.fromisoformat(request["created_at"])
+    return "|".join(str(part) for part in (
+        created.date().isoformat(), created.hour, request.get("district_id"),
+        request.get("blood_type"), request.get("urgency"), status
+    ))
+
+def observe_latency(rollups, stage, start, end):
+    """Add one duration (ISO timestamps) to a stage's latency histogram"""
+    minutes = (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds() / 60
+    bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if minutes <= bound), len(LATENCY_BUCKETS))
+    rollups["latency"][stage][bucket] += 1
+
+def record_transition(rollups, request, old_status, new_status):
+    """Move a request's count from old_status to new_status and record stage latencies.
+
+    old_status is None for a newly created request. The request must already
+    carry accepted_at/fulfilled_at for the stage it is entering.
+    """
+    counts = rollups["counts"]
+    if old_status is not None:
+        old_key = rollup_key(request, old_status)
+        counts[old_key] = counts.get(old_key, 0) - 1
+        if counts[old_key] <= 0:
+            del counts[old_key]
+    new_key = rollup_key(request, new_status)
+    counts[new_key] = counts.get(new_key, 0) + 1
+
+    if new_status == "Accepted" and request.get("accepted_at"):
+        observe_latency(rollups, "created_to_accepted", request["created_at"], request["accepted_at"])
+    elif new_status == "Fulfilled" and request.get("fulfilled_at"):
+        observe_latency(rollups, "created_to_fulfilled", request["created_at"], request["fulfilled_at"])
+        if request.get("accepted_at"):
+            observe_latency(rollups, "accepted_to_fulfilled", request["accepted_at"], request["fulfilled_at"])
+
+def rebuild_rollups(requests):
+    """Rollups from scratch for an existing request history (one-off backfill)"""
+    rollups = empty_rollups()
+    for request in requests:
+        record_transition(rollups, request, None, request.get("status", "Pending"))
+    return rollups
+
+def summarize(rollups, field, statuses=None):
+    """Total count per value of one rollup field, optionally limited to some statuses"""
+    position = ROLLUP_FIELDS.index(field)
+    status_position = ROLLUP_FIELDS.index("status")
+    totals = {}
+    for key, count in rollups["counts"].items():
+        parts = key.split("|")
+        if statuses is not None and parts[status_position] not in statuses:
+            continue
+        totals[parts[position]] = totals.get(parts[position], 0) + count
+    return totals
+
+def latency_histogram(rollups, stage):
+    """(bucket label, count) pairs for one latency stage"""
+    labels = [f"<= {bound} min" for bound in LATENCY_BUCKETS] + [f"> {LATENCY_BUCKETS[-1]} min"]
+    return list(zip(labels, rollups["latency"][stage]))
+
+def iter_rollup_rows(rollups):
+    """Counters as flat dicts, e.g. for CSV export"""
+    for key, count in rollups["counts"].items():
+        row = dict(zip(ROLLUP_FIELDS, key.split("|")))
+        row["count"] = count
+        yield row
@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+from collections.abc import Mapping
+from datetime import date, datetime
+import perf
+
+try:
+    import orjson  # Optional fast codec
+except ImportError:
+    orjson = None
+
+# Flush the write buffer after roughly this many bytes of encoded records
+WRITE_CHUNK_BYTES = 1 << 20
+
+def _default(value):
+    """Encode values the stdlib codec doesn't understand (e.g. st.date_input dates)"""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, set):
+        return list(value)
+    if isinstance(value, Mapping):
+        # Dict-like records (core.records) encode as the dict they stand in for
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def codec_name():
+    """Name of the JSON codec in use"""
+    return "orjson" if orjson is not None else "json"
+
+def dumps(value):
+    """Encode a value as compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+def loads(raw):
+    """Decode JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _iter_chunks(data):
+    """Yield the compact encoding of data one top-level record at a time"""
+    if isinstance(data, dict):
+        yield b"{"
+        for i, (key, value) in enumerate(data.items()):
+            prefix = b"," if i else b""
+            yield prefix + dumps(str(key)) + b":" + dumps(value)
+        yield b"}"
+    elif isinstance(data, list):
+        yield b"["
+        for i, value in enumerate(data):
+            yield (b"," if i else b"") + dumps(value)
+        yield b"]"
+    else:
+        yield dumps(data)
+
+def encode(data):
+    """The compact encoding write_file streams, as one bytes object (to reuse it elsewhere)"""
+    return b"".join(_iter_chunks(data))
+
+def read_file(filename):
+    """Parse a JSON file in one pass.
+
+    Only writes are streamed. Reading whole costs a passing copy of the file
+    (29 MB of a 143 MB peak for users.json at 100k donors), but a
+    record-at-a-time parse needs the stdlib decoder's raw_decode: 3.7x slower,
+    and without orjson's shared keys the parsed store takes 181 MB, not 113.
+    """
+    with open(filename, "rb") as f:
+        raw = f.read()
+    if perf.ENABLED:
+        perf.record_io(os.path.basename(filename), read=len(raw))
+    return loads(raw)
+
+def write_file(filename, data, encoded=None):
+    """Stream data to filename as compact JSON, replacing the old file atomically.
+
+    Records are encoded one at a time so a large store is never built as a
+    single string; the temp file + rename means readers never see a torn file.
+    encoded, if given, is data already run through encode(). Returns the
+    number of bytes written.
+    """
+    tmp_name = f"{filename}.tmp"
+    written = 0
+    pending = []
+    pending_size = 0
+    with open(tmp_name, "wb") as f:
+        for chunk in (_iter_chunks(data) if encoded is None else (encoded,)):
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= WRITE_CHUNK_BYTES:
+                f.write(b"".join(pending))
+                written += pending_size
+                pending, pending_size = [], 0
+        f.write(b"".join(pending))
+        written += pending_size
+    os.replace(tmp_name, filename)
+    if perf.ENABLED:
+        perf.record_io(os.path.basename(filename), written=written)
+    return written
+
+def export_readable(filename, dest):
+    """Write a pretty-printed copy of a store for humans (diffs, debugging)"""
+    data = read_file(filename)
+    with open(dest, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=_default)
+
+if __name__ == "__main__":
+    # Usage: python serialization.py export users.json users.readable.json
+    if len(sys.argv) != 4 or sys.argv[1] != "export":
+        print("Usage: python serialization.py export <store.json> <output.json>")
+        sys.exit(1)
+    export_readable(sys.argv[2], sys.argv[3])
+    print(f"Exported {sys.argv[2]} to {sys.argv[3]} ({codec_name()})")
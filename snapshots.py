@@ -0,0 +1,230 @@
+import os
+import sys
+import threading
+import uuid
+from datetime import date, datetime
+from core.changefeed import locked
+from serialization import read_file
+from utils import load_data, save_data
+
+try:
+    import pyarrow as pa  # Optional: snapshots and exports are disabled without it
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SNAPSHOT_DIR = os.environ.get("BLOODHUB_SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_MANIFEST = "manifest.json"
+
+# Minimum seconds between automatic snapshots
+SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get("BLOODHUB_SNAPSHOT_SECONDS", "3600"))
+
+# Rows converted to Arrow and written per Parquet row group
+SNAPSHOT_BATCH_ROWS = 5000
+
+_snapshot_running = threading.Lock()
+
+# Store files the snapshot reads; it works from disk, not from a live session
+SOURCE_FILES = {
+    "users": "users.json",
+    "requests": "requests.json",
+    "inventory": "inventory.json"
+}
+
+# Column name -> kind for every snapshot table; blobs (certificates, test
+# reports) and nested lists are left out
+SNAPSHOT_COLUMNS = {
+    "users": {
+        "phone": "str", "role": "str", "name": "str", "district": "str", "taluk": "str",
+        "village": "str", "district_id": "int", "taluk_id": "int", "village_id": "int",
+        "approved": "bool", "profile": "bool", "blood_group": "str", "points": "int",
+        "last_donation_date": "ts", "organization_type": "str", "email": "str", "employee_id": "str"
+    },
+    "requests": {
+        "id": "int", "requester": "str", "blood_type": "str", "units": "int", "urgency": "str",
+        "status": "str", "district": "str", "taluk": "str", "village": "str", "district_id": "int",
+        "taluk_id": "int", "village_id": "int", "created_at": "ts", "expires_at": "ts",
+        "accepted_at": "ts", "fulfilled_at": "ts", "fulfilled_by": "str", "fulfilled_units": "int",
+        "matched_count": "int", "pledged_count": "int"
+    },
+    "inventory": {
+        "id": "str", "blood_type": "str", "units": "int", "expiry": "ts", "added_by": "str",
+        "added_at": "ts", "donor_phone": "str", "request_id": "int"
+    },
+    "donations": {
+        "inventory_id": "str", "donor_phone": "str", "blood_type": "str", "request_id": "int",
+        "recorded_by": "str", "donated_at": "ts"
+    }
+}
+
+def available():
+    """True if pyarrow is installed"""
+    return pa is not None
+
+def _arrow_type(kind):
+    return {"str": pa.string(), "int": pa.int64(), "bool": pa.bool_(), "ts": pa.timestamp("us")}[kind]
+
+def table_schema(table):
+    """Arrow schema of a snapshot table"""
+    return pa.schema([(column, _arrow_type(kind)) for column, kind in SNAPSHOT_COLUMNS[table].items()])
+
+def _convert(value, kind):
+    """Coerce a JSON value to its column kind; anything unparseable becomes null"""
+    if value is None or value == "":
+        return None
+    try:
+        if kind == "ts":
+            if isinstance(value, datetime):
+                return value
+            if isinstance(value, date):
+                return datetime(value.year, value.month, value.day)
+            return datetime.fromisoformat(str(value))
+        if kind == "int":
+            return int(value)
+        if kind == "bool":
+            return bool(value)
+        return str(value)
+    except (TypeError, ValueError):
+        return None
+
+def iter_rows(table, stores):
+    """Flat dicts for one snapshot table, built from the raw stores"""
+    if table == "users":
+        for phone, user in stores["users"].items():
+            yield dict(user, phone=phone)
+    elif table == "requests":
+        for request in stores["requests"]:
+            yield dict(request,
+                       matched_count=len(request.get("matched_donors") or []),
+                       pledged_count=len(request.get("pledged_donors") or []))
+    elif table == "inventory":
+        yield from stores["inventory"]
+    elif table == "donations":
+        # Every inventory unit with a donor is one donation event
+        for item in stores["inventory"]:
+            if item.get("donor_phone"):
+                yield {
+                    "inventory_id": item.get("id"),
+                    "donor_phone": item["donor_phone"],
+                    "blood_type": item.get("blood_type"),
+                    "request_id": item.get("request_id"),
+                    "recorded_by": item.get("added_by"),
+                    "donated_at": item.get("added_at")
+                }
+
+def iter_batches(table, rows, batch_rows=SNAPSHOT_BATCH_ROWS):
+    """Arrow record batches of at most batch_rows rows"""
+    schema = table_schema(table)
+    columns = SNAPSHOT_COLUMNS[table]
+    batch = []
+    for row in rows:
+        batch.append({column: _convert(row.get(column), kind) for column, kind in columns.items()})
+        if len(batch) >= batch_rows:
+            yield pa.RecordBatch.from_pylist(batch, schema=schema)
+            batch = []
+    if batch:
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+def _tmp_path(path):
+    """A temp name next to path that no other session or process will pick"""
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp"
+
+def write_table(table, rows, taken_at, snapshot_dir=SNAPSHOT_DIR):
+    """Write one table to snapshot_dir/<table>/date=YYYY-MM-DD/<table>-HHMMSS.parquet.
+
+    The date=... directories are Hive-style partitions, so readers such as
+    pyarrow.dataset or pandas.read_parquet see a "date" column. Returns
+    (path, row_count).
+    """
+    partition = os.path.join(snapshot_dir, table, f"date={taken_at.date().isoformat()}")
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, f"{table}-{taken_at.strftime('%H%M%S')}.parquet")
+    tmp_path = _tmp_path(path)
+    row_count = 0
+    with pq.ParquetWriter(tmp_path, table_schema(table), compression="zstd") as writer:
+        for batch in iter_batches(table, rows):
+            writer.write_batch(batch)
+            row_count += batch.num_rows
+    os.replace(tmp_path, path)
+    return path, row_count
+
+def load_manifest(snapshot_dir=SNAPSHOT_DIR):
+    """Latest snapshot manifest: {"taken_at": ..., "tables": {table: {"path", "rows"}}}"""
+    return load_data(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST), {})
+
+def run_snapshot(snapshot_dir=SNAPSHOT_DIR, source_files=SOURCE_FILES, if_due=False):
+    """Snapshot every table from the store files and record it in the manifest.
+
+    Holds a lock file in snapshot_dir, so sessions and processes snapshot one
+    at a time. With if_due, returns None instead if another one finished
+    while we waited.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with locked(os.path.join(snapshot_dir, "snapshot")):
+        if if_due and not snapshot_due(snapshot_dir):
+            return None
+        stores = {store: read_file(filename) for store, filename in source_files.items()}
+        taken_at = datetime.now()
+        tables = {}
+        for table in SNAPSHOT_COLUMNS:
+            path, row_count = write_table(table, iter_rows(table, stores), taken_at, snapshot_dir)
+            tables[table] = {"path": path, "rows": row_count}
+        manifest = {"taken_at": taken_at.isoformat(), "tables": tables}
+        save_data(os.path.join(snapshot_dir, SNAPSHOT_MANIFEST), manifest)
+    return manifest
+
+def start_snapshot(snapshot_dir=SNAPSHOT_DIR, source_files=SOURCE_FILES):
+    """Run a due snapshot on a daemon thread unless one is already running in this process"""
+    if not _snapshot_running.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            run_snapshot(snapshot_dir, source_files, if_due=True)
+        finally:
+            _snapshot_running.release()
+    threading.Thread(target=run, name="parquet-snapshot", daemon=True).start()
+    return True
+
+def snapshot_due(snapshot_dir=SNAPSHOT_DIR, interval=SNAPSHOT_INTERVAL_SECONDS):
+    """True if pyarrow is available and the last snapshot is older than interval"""
+    if not available():
+        return False
+    manifest_path = os.path.join(snapshot_dir, SNAPSHOT_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return True
+    return datetime.now().timestamp() - os.path.getmtime(manifest_path) >= interval
+
+def csv_export_path(parquet_path):
+    """Where export_csv puts the CSV copy of a snapshot file"""
+    return parquet_path[:-len(".parquet")] + ".csv"
+
+def export_csv(parquet_path):
+    """CSV copy of a snapshot file, converted row group by row group.
+
+    The CSV sits next to the Parquet file and is reused on later calls, so
+    each snapshot is converted at most once. Returns the CSV path.
+    """
+    csv_path = csv_export_path(parquet_path)
+    if os.path.exists(csv_path):
+        return csv_path
+    tmp_path = _tmp_path(csv_path)
+    parquet_file = pq.ParquetFile(parquet_path)
+    with pa_csv.CSVWriter(tmp_path, parquet_file.schema_arrow) as writer:
+        for batch in parquet_file.iter_batches(batch_size=SNAPSHOT_BATCH_ROWS):
+            writer.write_batch(batch)
+    os.replace(tmp_path, csv_path)
+    return csv_path
+
+if __name__ == "__main__":
+    # Usage: python snapshots.py [--if-due]   (e.g. from cron)
+    if not available():
+        print("pyarrow is not installed; snapshots are disabled")
+        sys.exit(1)
+    manifest = run_snapshot(if_due="--if-due" in sys.argv[1:])
+    if manifest is None:
+        print("Last snapshot is recent; nothing to do")
+        sys.exit(0)
+    for table, info in manifest["tables"].items():
+        print(f"{table:<10} {info['rows']:>8} rows  {info['path']}")
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from generate_data import generate, write  # noqa: E402
+from locations import compile_locations, LOCATION_IDS_FILE  # noqa: E402
+from utils import load_data  # noqa: E402
+
+@pytest.fixture(scope="session")
+def location_table():
+    return compile_locations(load_data(os.path.join(ROOT, "kerala_locations.json"), {}),
+                             os.path.join(ROOT, LOCATION_IDS_FILE))
+
+@pytest.fixture
+def data_dir(tmp_path, location_table):
+    """A small generated data set in a fresh directory"""
+    write(generate(300, table=location_table), str(tmp_path))
+    return str(tmp_path)
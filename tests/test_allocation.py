@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+from core import Repository, BloodHub
+from core.allocation import min_cost_flow, plan_allocation, EXPIRY_COST_PER_DAY
+
+def test_min_cost_flow_beats_cheapest_edge_first():
+    # Two banks with 2 units each, two requests needing 2 each, supplying a unit is worth 10.
+    # Cheapest edge first sends A's units to X (1 each) and B's to Y (8 each): 18.
+    # The optimum swaps them: A -> Y and B -> X at 2 each, 8 in all.
+    edges = [
+        ("s", "A", 2, 0), ("s", "B", 2, 0),
+        ("A", "X", 10, 1), ("A", "Y", 10, 2), ("B", "X", 10, 2), ("B", "Y", 10, 8),
+        ("X", "t", 2, -10), ("Y", "t", 2, -10),
+        # Not worth it: costs more to reach than supplying it is worth
+        ("B", "Z", 10, 12), ("Z", "t", 1, -10),
+    ]
+    flows = min_cost_flow(edges, "s", "t")
+
+    assert sum(flow * cost for (_, _, _, cost), flow in zip(edges, flows)) == 8 - 40
+    assert dict(((u, v), flow) for (u, v, _, _), flow in zip(edges, flows) if flow) == {
+        ("s", "A"): 2, ("s", "B"): 2, ("A", "Y"): 2, ("B", "X"): 2, ("X", "t"): 2, ("Y", "t"): 2}
+    for (u, v, capacity, _), flow in zip(edges, flows):
+        assert 0 <= flow <= capacity
+    for node in "ABXYZ":
+        assert (sum(flow for (_, v, _, _), flow in zip(edges, flows) if v == node) ==
+                sum(flow for (u, _, _, _), flow in zip(edges, flows) if u == node))
+
+def test_plan_allocation_supplies_everything_it_can_at_least_cost():
+    now = datetime(2025, 1, 1, 9, 0)
+
+    def unit(item_id, bank, units, days_left, blood_type="O+"):
+        return {"id": item_id, "blood_type": blood_type, "units": units, "added_by": bank,
+                "expiry": (now + timedelta(days=days_left)).isoformat()}
+    near = {"district_id": 1, "taluk_id": 10}
+    far = {"district_id": 2, "taluk_id": 20}
+    critical = dict(near, id=1, blood_type="O+", urgency="Critical")
+    normal = dict(far, id=2, blood_type="O+", urgency="Normal")
+    no_stock = dict(near, id=3, blood_type="AB-", urgency="Critical")
+    needs = [(critical, 2), (normal, 2), (no_stock, 1)]
+    stock = [
+        (unit("P1", "P", 2, 5), near, 2),
+        (unit("P2", "P", 2, 30), near, 2),
+        (unit("Q1", "Q", 1, 10), far, 1),
+    ]
+
+    plan = plan_allocation(needs, stock, now)
+
+    # Every unit asked for is supplied: the critical request from the nearby bank's soonest
+    # expiring lot, the normal one from its own district's bank and the rest from across the state
+    legs = {(leg["request_id"], leg["inventory_id"], leg["from_bank"], leg["units"]) for leg in plan}
+    assert legs == {(1, "P1", "P", 2), (2, "Q1", "Q", 1), (2, "P2", "P", 1)}
+    assert plan[0]["request_id"] == 1
+    expected = ((10 + 5 * EXPIRY_COST_PER_DAY - 3000) * 2 + (10 + 10 * EXPIRY_COST_PER_DAY - 1000)
+                + (100 + 30 * EXPIRY_COST_PER_DAY - 1000))
+    assert sum(leg["cost"] for leg in plan) == expected
+    for request, units in needs:
+        assert sum(leg["units"] for leg in plan if leg["request_id"] == request["id"]) <= units
+    for item, _, units in stock:
+        assert sum(leg["units"] for leg in plan if leg["inventory_id"] == item["id"]) <= units
+
+def test_confirmed_transfer_records_one_inventory_id_per_unit(data_dir, location_table):
+    repo = Repository(data_dir=data_dir).load()
+    hub = BloodHub(repo, location_table)
+    users = repo["users"]
+    hospital = next(p for p, u in users.items() if u["role"] == "Hospital" and u.get("approved"))
+    bank = next(p for p, u in users.items() if u["role"] == "Blood Bank" and u.get("approved"))
+    request = hub.create_request(hospital, "AB-", 3, "Normal")
+    item_id = hub.add_inventory("AB-", 3, (datetime.now() + timedelta(days=10)).isoformat(), bank)
+    transfer = {"id": "TRF-1", "request_id": request["id"], "inventory_id": item_id, "from_bank": bank,
+                "units": 2, "status": "Proposed"}
+    repo["transfers"].append(transfer)
+
+    assert hub.confirm_transfer(transfer, bank) == 2
+    assert request["inventory_ids"] == [item_id, item_id]
+    assert request["fulfilled_units"] == 2
+    assert request["status"] == "Partially Fulfilled"
+
+def test_plan_needs_only_what_no_path_has_supplied_yet(data_dir, location_table):
+    repo = Repository(data_dir=data_dir).load()
+    hub = BloodHub(repo, location_table)
+    users = repo["users"]
+    hospital = next(p for p, u in users.items() if u["role"] == "Hospital" and u.get("approved"))
+    bank = next(p for p, u in users.items() if u["role"] == "Blood Bank" and u.get("approved"))
+    donor = next(p for p, u in users.items() if u["role"] == "Donor")
+    repo["inventory"] = [item for item in repo["inventory"] if item["blood_type"] != "AB-"]
+    request = hub.create_request(hospital, "AB-", 5, "Normal")
+
+    # One unit donated, then one from the only AB- stock there is
+    assert hub.add_to_inventory(request["id"], donor, hospital, units=1)
+    assert request["status"] == "Pending"
+    expiry = (datetime.now() + timedelta(days=10)).isoformat()
+    hub.add_inventory("AB-", 1, expiry, bank)
+    assert hub.fulfil_from_stock(request, bank) == 1
+    assert request["status"] == "Partially Fulfilled"
+    assert hub.supplied_units(request) == len(request["inventory_ids"]) == 2
+
+    hub.add_inventory("AB-", 50, expiry, bank)
+    plan = hub.plan_district_allocation(request["district_id"])
+    legs = [transfer for transfer in plan if transfer["request_id"] == request["id"]]
+    assert sum(transfer["units"] for transfer in legs) == 3
+    for transfer in legs:
+        hub.confirm_transfer(transfer, transfer["from_bank"])
+    assert request["status"] == "Fulfilled"
+    assert hub.supplied_units(request) == len(request["inventory_ids"]) == 5
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+import time
+
+from api import ApiServer, add_key
+from core import Repository, BloodHub
+
+async def post(port, path, api_key, payload, idempotency_key):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: test\r\nAuthorization: Bearer {api_key}\r\n"
+                 f"Idempotency-Key: {idempotency_key}\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, rest = raw.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"chunked" in head:
+        # Chunk sizes and JSON lines alternate; keep the JSON
+        return status, [json.loads(line) for line in rest.split(b"\r\n") if line.startswith(b"{")]
+    return status, json.loads(rest)
+
+class SlowNetworkApi(ApiServer):
+    """Every write waits on the network, as drain() does under back-pressure, so calls interleave"""
+
+    async def start_stream(self, writer):
+        await asyncio.sleep(0.01)
+        await super().start_stream(writer)
+
+    async def send_json(self, writer, status, payload):
+        await asyncio.sleep(0.01)
+        await super().send_json(writer, status, payload)
+
+def run_twice(data_dir, location_table, role, path, payload):
+    """Send the same call twice at once with one Idempotency-Key; returns (responses, repository after)"""
+    repo = Repository(data_dir=data_dir).load()
+    phone = next(phone for phone, user in repo["users"].items() if user.get("role") == role and user.get("approved"))
+    api_key = add_key(phone, data_dir)
+    api = SlowNetworkApi(BloodHub(repo, location_table), data_dir)
+
+    async def main():
+        server = await asyncio.start_server(api.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.gather(*(post(port, path, api_key, payload, "retry-1") for _ in range(2)))
+    return asyncio.run(main()), repo
+
+def test_concurrent_retries_create_requests_once(data_dir, location_table):
+    before = len(Repository(data_dir=data_dir).load()["requests"])
+    payload = {"requests": [{"blood_type": "B-", "units": 2, "urgency": "Normal"}]}
+    (first, second), repo = run_twice(data_dir, location_table, "Hospital", "/requests/batch", payload)
+    assert first == second
+    assert first[0] == 200 and first[1][0]["status"] == "created"
+    assert len(repo["requests"]) == before + 1
+
+def test_concurrent_retries_add_inventory_once(data_dir, location_table):
+    before = len(Repository(data_dir=data_dir).load()["inventory"])
+    payload = {"units": [{"blood_type": "O+", "units": 3, "expiry": "2999-01-01"}]}
+    (first, second), repo = run_twice(data_dir, location_table, "Blood Bank", "/inventory/batch", payload)
+    assert first == second
+    assert first[0] == 200 and first[1]["results"][0]["status"] == "created"
+    assert len(repo["inventory"]) == before + 1
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: test\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    return int(raw.split()[1])
+
+def test_server_answers_while_a_session_holds_the_data_lock(data_dir, location_table):
+    repo = Repository(data_dir=data_dir).load()
+    phone = next(phone for phone, user in repo["users"].items() if user.get("role") == "Hospital" and user.get("approved"))
+    api_key = add_key(phone, data_dir)
+    api = ApiServer(BloodHub(repo, location_table), data_dir)
+    held, release = threading.Event(), threading.Event()
+
+    def streamlit_session():
+        with Repository(data_dir=data_dir).locked():
+            held.set()
+            release.wait(5)
+    session = threading.Thread(target=streamlit_session)
+    session.start()
+    held.wait()
+
+    async def main():
+        server = await asyncio.start_server(api.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            start = time.perf_counter()
+            batch = asyncio.create_task(post(port, "/requests/batch", api_key,
+                                             {"requests": [{"blood_type": "B-", "units": 2, "urgency": "Normal"}]}, "lock-1"))
+            await asyncio.sleep(0.2)  # the batch is now waiting for the data lock
+            health = await get(port, "/health")
+            waited = time.perf_counter() - start
+            release.set()
+            return health, waited, await batch
+    health, waited, (status, lines) = asyncio.run(main())
+    session.join()
+    assert health == 200 and waited < 1
+    assert status == 200 and lines[0]["status"] == "created"
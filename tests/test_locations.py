@@ -0,0 +1,25 @@
+import os
+
+from locations import compile_locations, registry_path, DEFAULT_REGISTRY
+from utils import load_data, save_data
+
+PLACES = {"Kollam": {"taluks": ["Kottarakkara"], "villages": {"Kottarakkara": ["Valakom", "Nowhere Yet"]}}}
+
+def test_registry_lives_in_the_data_directory(tmp_path, monkeypatch):
+    data_dir, elsewhere = str(tmp_path / "data"), str(tmp_path / "cwd")
+    os.mkdir(data_dir)
+    os.mkdir(elsewhere)
+    monkeypatch.chdir(elsewhere)
+
+    table = compile_locations(PLACES, registry_path(data_dir))
+    assert os.listdir(elsewhere) == []
+    # A new data directory starts from the shipped IDs, which generated data already uses
+    registry, shipped = load_data(registry_path(data_dir)), load_data(DEFAULT_REGISTRY)
+    assert "Kollam|Kottarakkara|Nowhere Yet" not in shipped
+    assert {path: registry[path] for path in shipped} == shipped
+    assert table["path_ids"]["Kollam|Kottarakkara|Valakom"] == shipped["Kollam|Kottarakkara|Valakom"]
+
+    # From then on its own registry is the one read
+    registry["Kollam|Kottarakkara|Valakom"] = 999999
+    save_data(registry_path(data_dir), registry)
+    assert compile_locations(PLACES, registry_path(data_dir))["path_ids"]["Kollam|Kottarakkara|Valakom"] == 999999
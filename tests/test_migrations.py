@@ -0,0 +1,56 @@
+import base64
+import io
+import os
+
+import pytest
+
+import core.services
+from core import Repository, BloodHub
+from core.constants import MIGRATIONS_VERSION, MIGRATIONS_FILE
+from images import available as images_available
+
+def organization(repo):
+    return next(phone for phone, user in repo["users"].items() if user["role"] == "Organization")
+
+def test_migrations_run_once_per_data_directory(data_dir, location_table):
+    old = Repository(data_dir=data_dir).load()
+    org = organization(old)
+    old["users"][org]["volunteers"] = [{"name": "Embedded Volunteer", "blood_group": "O+"}]
+    old.mark_dirty("users", org)
+    old.flush()
+
+    first = Repository(data_dir=data_dir).load()
+    assert BloodHub(first, location_table).run_migrations()
+    assert first.migration_version() == MIGRATIONS_VERSION
+    assert os.path.exists(os.path.join(data_dir, MIGRATIONS_FILE))
+
+    fresh = Repository(data_dir=data_dir, wal=False).load()
+    assert "volunteers" not in fresh["users"][org]
+    assert [v["name"] for v in fresh["volunteers"] if v["organization"] == org].count("Embedded Volunteer") == 1
+
+    # A later session finds the directory migrated and does no work
+    second = Repository(data_dir=data_dir).load()
+    second["users"][org]["volunteers"] = [{"name": "Left Alone", "blood_group": "A+"}]
+    assert not BloodHub(second, location_table).run_migrations()
+    assert second["users"][org]["volunteers"][0]["name"] == "Left Alone"
+
+@pytest.mark.skipif(not images_available(), reason="needs Pillow")
+def test_unreadable_images_are_not_retried(data_dir, location_table, monkeypatch):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), "red").save(buffer, format="PNG")
+    repo = Repository(data_dir=data_dir).load()
+    hub = BloodHub(repo, location_table)
+    bank = next(phone for phone, user in repo["users"].items() if user["role"] == "Blood Bank")
+    good, bad = (hub.add_inventory("O+", 1, "2099-01-01T00:00:00", bank, test_report=base64.b64encode(raw).decode())
+                 for raw in (buffer.getvalue(), b"not an image"))
+    items = {item["id"]: item for item in repo["inventory"]}
+
+    hub.backfill_image_thumbnails()
+    assert items[good]["test_report_thumbnail"]
+    assert items[bad]["test_report_thumbnail"] is False
+
+    calls = []
+    monkeypatch.setattr(core.services, "process_stored_image", lambda image: calls.append(image))
+    hub.backfill_image_thumbnails()
+    assert calls == []
@@ -0,0 +1,13 @@
+from core import Repository, BloodHub
+from core.rematch import build_shards, match_shards, OPEN_STATUSES
+
+def test_pool_matches_like_in_process(data_dir, location_table):
+    hub = BloodHub(Repository(data_dir=data_dir).load(), location_table)
+    requests = [request for request in hub.repo["requests"] if request.get("status") in OPEN_STATUSES]
+    shards = build_shards(requests, hub.donor_index())
+    assert len(shards) > 1
+
+    def flat(results):
+        return {request_id: [(match["phone"], match["priority"], match.get("volunteer_id")) for match in matches]
+                for request_id, matches in results.items()}
+    assert flat(match_shards(shards, [], workers=2)) == flat(match_shards(shards, []))
@@ -0,0 +1,192 @@
+import os
+
+from core import Repository, BloodHub, changefeed
+from rollups import rebuild_rollups
+
+def on_disk(data_dir):
+    """The store files as they are, without the write-ahead log's help"""
+    return Repository(data_dir=data_dir, wal=False).load()
+
+def hospitals(repo):
+    return [phone for phone, user in repo["users"].items() if user.get("role") == "Hospital" and user.get("approved")]
+
+def test_concurrent_creates_keep_both_requests(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    hub_a, hub_b = BloodHub(a, location_table), BloodHub(b, location_table)
+    a.poll()
+    b.poll()
+    first_hospital, second_hospital = hospitals(a)[:2]
+
+    first = hub_a.create_request(first_hospital, "O+", 2, "Normal")
+    a.flush()
+    second = hub_b.create_request(second_hospital, "A+", 2, "Normal")
+    b.flush()
+
+    assert first["id"] != second["id"]
+    fresh = on_disk(data_dir)
+    ids = [request["id"] for request in fresh["requests"]]
+    assert first["id"] in ids and second["id"] in ids
+    assert len(ids) == len(set(ids))
+    assert fresh["request_counter"] == max(ids)
+    assert fresh["rollups"]["counts"] == rebuild_rollups(fresh["requests"])["counts"]
+
+def test_flush_keeps_other_sessions_record_edits(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    hub_a, hub_b = BloodHub(a, location_table), BloodHub(b, location_table)
+    pending = [request for request in a["requests"] if request["status"] == "Pending"]
+    mine, theirs = pending[0]["id"], pending[1]["id"]
+
+    hub_a.set_request_status(hub_a.get_request(mine), "Cancelled")
+    hub_b.set_request_status(hub_b.get_request(theirs), "Cancelled")
+    b.flush()
+    # a's copy of the second request and of the rollups predates b's flush
+    a.flush()
+
+    fresh = BloodHub(on_disk(data_dir), location_table)
+    assert fresh.get_request(mine)["status"] == "Cancelled"
+    assert fresh.get_request(theirs)["status"] == "Cancelled"
+    assert fresh.repo["rollups"]["counts"] == rebuild_rollups(fresh.repo["requests"])["counts"]
+
+def test_stock_consumed_in_two_sessions(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    first, second = a["inventory"][0]["id"], a["inventory"][1]["id"]
+
+    a["inventory"] = [item for item in a["inventory"] if item["id"] != first]
+    a.mark_dirty("inventory", first)
+    b["inventory"] = [item for item in b["inventory"] if item["id"] != second]
+    b.mark_dirty("inventory", second)
+    a.flush()
+    b.flush()
+
+    ids = {item["id"] for item in on_disk(data_dir)["inventory"]}
+    assert first not in ids and second not in ids
+
+def test_transaction_edits_the_latest_copy_of_a_record(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    hub_a, hub_b = BloodHub(a, location_table), BloodHub(b, location_table)
+    request_id = next(request["id"] for request in a["requests"] if request["status"] == "Pending")
+    first, second = [phone for phone, user in a["users"].items() if user.get("role") == "Donor"][:2]
+
+    hub_b.pledge(hub_b.get_request(request_id), first)
+    b.flush()
+    # a still holds the request as it was before b's pledge
+    with a.transaction():
+        hub_a.pledge(hub_a.get_request(request_id), second)
+
+    pledges = BloodHub(on_disk(data_dir), location_table).get_request(request_id)["pledged_donors"]
+    assert {pledge["phone"] for pledge in pledges} == {first, second}
+
+def test_users_notified_from_two_sessions_keep_both_notices(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    hub_a, hub_b = BloodHub(a, location_table), BloodHub(b, location_table)
+    first_hospital, second_hospital = hospitals(a)[:2]
+
+    # Critical requests match O+ donors state-wide, so both reach the same donors
+    first = hub_a.create_request(first_hospital, "O+", 1, "Critical")
+    second = hub_b.create_request(second_hospital, "O+", 1, "Critical")
+    a.flush()
+    b.flush()
+
+    shared = ({match["phone"] for match in first["matched_donors"] if not match.get("volunteer_id")} &
+              {match["phone"] for match in second["matched_donors"] if not match.get("volunteer_id")})
+    assert shared
+    users = on_disk(data_dir)["users"]
+    for phone in shared:
+        notified = {note.get("request_id") for note in users[phone]["notifications"]}
+        assert {first["id"], second["id"]} <= notified, phone
+
+def test_flush_after_the_feed_rotated_keeps_other_sessions_records(data_dir, location_table, monkeypatch):
+    a = Repository(data_dir=data_dir).load()
+    hub_a = BloodHub(a, location_table)
+    pending = [request for request in a["requests"] if request["status"] == "Pending"]
+    mine, theirs, first = pending[0]["id"], pending[1]["id"], pending[2]["id"]
+    hub_a.set_request_status(hub_a.get_request(first), "Cancelled")
+    a.flush()
+    b = Repository(data_dir=data_dir).load()
+    hub_b = BloodHub(b, location_table)
+
+    hub_b.set_request_status(hub_b.get_request(theirs), "Cancelled")
+    hub_a.set_request_status(hub_a.get_request(mine), "Cancelled")
+    # a's flush starts a new change log, so b can't follow it and has to reread the files
+    monkeypatch.setattr(changefeed, "MAX_LOG_BYTES", 1)
+    a.flush()
+    b.flush()
+
+    fresh = BloodHub(on_disk(data_dir), location_table)
+    assert [fresh.get_request(request_id)["status"] for request_id in (first, mine, theirs)] == ["Cancelled"] * 3
+    assert b["requests"] == fresh.repo["requests"]
+
+def test_notices_publish_only_what_changed(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    hub_a = BloodHub(a, location_table)
+    phone = hospitals(a)[0]
+    certificate = "c" * 100000
+
+    with a.transaction():
+        a["users"][phone]["certificate"] = certificate
+        hub_a.notify_user(phone, {"message": "first"})
+    size = os.path.getsize(a.feed_path())
+    with a.transaction():
+        hub_a.notify_user(phone, {"message": "second"})
+    # Neither the certificate nor the earlier notice goes out again
+    assert os.path.getsize(a.feed_path()) - size < 1000
+
+    b.poll()
+    late = Repository(data_dir=data_dir).load()
+    for repo in (b, late, Repository(data_dir=data_dir, wal=True).load()):
+        user = repo["users"][phone]
+        assert user["certificate"] == certificate
+        assert [note.get("message") for note in user["notifications"]][-2:] == ["first", "second"]
+    # A session that only loaded afterwards can follow the next delta too
+    with a.transaction():
+        hub_a.notify_user(phone, {"message": "third"})
+    late.poll()
+    assert late["users"][phone] == a["users"][phone] == on_disk(data_dir)["users"][phone]
+
+def test_stale_sessions_cannot_fulfil_cancel_or_pledge_twice(data_dir, location_table):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    hub_a, hub_b = BloodHub(a, location_table), BloodHub(b, location_table)
+    banks = [phone for phone, user in a["users"].items() if user.get("role") == "Blood Bank"]
+    donor = next(phone for phone, user in a["users"].items() if user.get("role") == "Donor")
+    pending = [request for request in a["requests"] if request["status"] == "Pending" and request["units"] > 1]
+    fulfilled, pledged = pending[0]["id"], pending[1]["id"]
+    hub_a.add_inventory(pending[0]["blood_type"], 10, "2999-01-01T00:00:00", banks[0])
+    a.flush()
+    b.poll()
+
+    # b still sees both requests as Pending when each transaction starts
+    with a.transaction():
+        assert hub_a.fulfil_from_stock(hub_a.get_request(fulfilled), banks[0])
+        assert hub_a.pledge(hub_a.get_request(pledged), donor)
+    with b.transaction():
+        assert hub_b.fulfil_from_stock(hub_b.get_request(fulfilled), banks[-1]) == 0
+        assert not hub_b.cancel_request(hub_b.get_request(fulfilled))
+        assert not hub_b.pledge(hub_b.get_request(pledged), donor)
+
+    fresh = BloodHub(on_disk(data_dir), location_table)
+    assert fresh.get_request(fulfilled)["status"] in ("Fulfilled", "Partially Fulfilled")
+    assert fresh.get_request(fulfilled)["fulfilled_by"] == banks[0]
+    assert [pledge["phone"] for pledge in fresh.get_request(pledged)["pledged_donors"]].count(donor) == 1
+
+def test_shared_version_follows_the_feed_without_reading_files(data_dir, location_table, monkeypatch):
+    a = Repository(data_dir=data_dir).load()
+    b = Repository(data_dir=data_dir).load()
+    assert a.shared_version("users") == b.shared_version("users")
+    phone = hospitals(a)[0]
+
+    a["users"][phone]["name"] = "Renamed Hospital"
+    a.mark_dirty("users", phone)
+    version = a.shared_version("users")
+    monkeypatch.setattr(Repository, "read_store", lambda self, store: 1 / 0)
+
+    assert b.shared_version("users") == version
+    assert b["users"][phone]["name"] == "Renamed Hospital"
+    assert b.shared_version("users") == a.shared_version("users") == version
+    assert b.shared_version("rollups") == a.shared_version("rollups")
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+from core import Repository, STORE_FILES
+from core import wal
+
+def recovered(data_dir):
+    return Repository(data_dir=data_dir, wal=True).load()
+
+def on_disk(data_dir):
+    return Repository(data_dir=data_dir, wal=False).load()
+
+def assert_stores(repo, expected):
+    for store in STORE_FILES:
+        assert repo[store] == expected[store], store
+
+def award(repo, index, points):
+    """One single-record flush: set the index-th user's points"""
+    phone = list(repo["users"])[index]
+    repo["users"][phone]["points"] = points
+    repo.mark_dirty("users", phone)
+    repo.flush()
+
+def last_segment(repo):
+    directory = repo.recovery_dir()
+    return wal.segment_path(directory, wal.segments(directory)[-1])
+
+def quarantined(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".bad"))
+
+def test_replay_stops_at_a_damaged_frame(tmp_path):
+    directory = str(tmp_path)
+    wal.append(directory, [{"n": 1}, {"n": 2}, {"n": 3}])
+    wal.rotate(directory)
+    wal.append(directory, [{"n": 4}])
+    path = wal.segment_path(directory, 1)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    # Flip a byte in the second frame's body; the third frame is intact
+    second = data.index(wal.FRAME_MAGIC, 1)
+    data[second + wal.FRAME_HEADER.size + 2] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+
+    assert wal.read_frames(path) == ([{"n": 1}], second)
+    assert wal.read_log(directory) == [{"n": 1}]
+    assert wal.read_log(directory, repair=True) == [{"n": 1}]
+    # What followed the damage is set aside, and the log carries on from the last good frame
+    assert os.path.getsize(path) == second
+    assert wal.segments(directory) == [1]
+    assert len(quarantined(directory)) == 2
+    wal.append(directory, [{"n": 5}])
+    assert wal.read_log(directory) == [{"n": 1}, {"n": 5}]
+
+def test_damage_mid_log_recovers_the_committed_files(data_dir):
+    repo = recovered(data_dir)
+    for n in range(3):
+        award(repo, n, 100 + n)
+    path = last_segment(repo)
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    # Frames go flush, commit, flush, commit...: damage the second flush
+    second_flush = data.index(wal.FRAME_MAGIC, data.index(wal.FRAME_MAGIC, 1) + 1)
+    data[second_flush + wal.FRAME_HEADER.size + 2] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+
+    fresh = recovered(data_dir)
+    assert_stores(fresh, repo)
+    assert quarantined(repo.recovery_dir())
+    award(fresh, 3, 103)
+    assert_stores(recovered(data_dir), fresh)
+
+def test_torn_tail_is_cut_off(data_dir):
+    repo = recovered(data_dir)
+    award(repo, 0, 111)
+    path = last_segment(repo)
+    size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(wal.encode_frame({"txn": "torn", "events": []})[:-3])
+
+    fresh = recovered(data_dir)
+    assert os.path.getsize(path) == size
+    assert_stores(fresh, repo)
+    # Later appends follow a good frame and replay
+    award(fresh, 1, 222)
+    assert_stores(recovered(data_dir), fresh)
+    assert_stores(on_disk(data_dir), fresh)
+
+def test_logged_flush_without_commit_is_rolled_forward(data_dir, monkeypatch):
+    repo = recovered(data_dir)
+    award(repo, 0, 111)
+    before = on_disk(data_dir)
+
+    def crash(self, stores, encoded=None):
+        raise SystemExit("killed between the log and the store files")
+    monkeypatch.setattr(Repository, "save_stores", crash)
+    with pytest.raises(SystemExit):
+        award(repo, 1, 222)
+    monkeypatch.undo()
+    assert_stores(on_disk(data_dir), before)
+
+    fresh = recovered(data_dir)
+    assert_stores(fresh, repo)
+    assert fresh["users"][list(fresh["users"])[1]]["points"] == 222
+    # The store files are rewritten from the log
+    assert_stores(on_disk(data_dir), repo)
+
+def test_damaged_snapshot_falls_back_to_the_older_one(data_dir):
+    repo = recovered(data_dir)
+    award(repo, 0, 111)
+    repo.checkpoint()
+    award(repo, 1, 222)
+    repo.checkpoint()
+    award(repo, 2, 333)
+    directory = repo.recovery_dir()
+    older, newest = wal.snapshots(directory)
+    with open(wal.snapshot_path(directory, newest), "r+b") as f:
+        f.seek(wal.SNAPSHOT_HEADER.size + 10)
+        f.write(b"\xff\xff")
+    # Only the older snapshot and the log can rebuild users.json now
+    with open(repo.path("users"), "r+b") as f:
+        f.truncate(100)
+
+    assert wal.read_snapshot(directory, newest) is None
+    assert wal.latest_snapshot(directory)[0] == older
+    assert_stores(recovered(data_dir), repo)
+    assert_stores(on_disk(data_dir), repo)
+
+def test_prune_keeps_the_newest_snapshots_and_the_log_they_need(data_dir):
+    repo = recovered(data_dir)
+    for n in range(4):
+        award(repo, n, 100 + n)
+        repo.checkpoint()
+    award(repo, 4, 104)
+    directory = repo.recovery_dir()
+
+    kept = wal.snapshots(directory)
+    assert len(kept) == wal.KEEP_SNAPSHOTS
+    assert min(wal.segments(directory)) == kept[0]
+    assert_stores(recovered(data_dir), repo)
@@ -1,15 +1,18 @@
 import json
+from serialization import read_file, write_file
+from perf import timed
 
+@timed()
 def load_data(filename, default=None):
     try:
-        with open(filename, 'r') as f:
-            return json.load(f)
+        return read_file(filename)
     except (FileNotFoundError, json.JSONDecodeError):
         return default if default is not None else {}
 
-def save_data(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+@timed()
+def save_data(filename, data, encoded=None):
+    # Compact, streamed and atomically replaced; see serialization.export_readable for a pretty copy
+    return write_file(filename, data, encoded)
 
 def load_locations():
     # Return a default structure if file not found
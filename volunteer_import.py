@@ -0,0 +1,156 @@
+from datetime import datetime
+import pandas as pd
+from location_search import best_match
+
+REQUIRED_COLUMNS = ["name", "age", "address", "district", "taluk", "village",
+                    "blood_group", "height_cm", "weight_kg", "chronic_disease"]
+OPTIONAL_COLUMNS = ["disease_details"]
+
+# Same bounds as the single-volunteer form
+NUMERIC_RANGES = {
+    "age": (18, 100),
+    "height_cm": (140, 220),
+    "weight_kg": (40, 120)
+}
+
+LOCATION_ID_COLUMNS = ["district_id", "taluk_id", "village_id"]
+
+# Rows parsed, validated and committed per batch
+CHUNK_ROWS = 20000
+
+def correct_location_level(chunk, column, parent_path, level, location_table, search_index, notes):
+    """Replace unknown names in one location column with their best fuzzy match.
+
+    Only distinct (name, parent) pairs that fail the exact lookup are searched,
+    so a chunk costs one lookup per distinct misspelling, not per row.
+    """
+    path_ids = location_table["path_ids"]
+    paths = chunk[column] if parent_path is None else parent_path + "|" + chunk[column]
+    unknown = (chunk[column] != "") & paths.map(path_ids).isna()
+    parent_ids = None
+    if parent_path is not None:
+        parent_ids = parent_path.map(path_ids)
+        unknown &= parent_ids.notna()
+    if not unknown.any():
+        return
+
+    keys = chunk.loc[unknown, column]
+    if parent_ids is not None:
+        keys = keys + "|" + parent_ids[unknown].astype(int).astype(str)
+    fixes = {}
+    for key in keys.unique():
+        name, _, parent = key.rpartition("|") if parent_ids is not None else (key, "", "")
+        match = best_match(search_index, name, level=level, parent_id=int(parent) if parent else None)
+        if match is not None:
+            fixes[key] = location_table["names"][match]
+
+    fixed = keys.map(fixes).dropna()
+    if fixed.empty:
+        return
+    notes.loc[fixed.index] += column + " " + chunk.loc[fixed.index, column] + " -> " + fixed + "; "
+    chunk.loc[fixed.index, column] = fixed
+
+def validate_chunk(chunk, location_table, blood_types, search_index=None):
+    """Validate a chunk of raw CSV rows with column-wide checks.
+
+    With a search_index, misspelt district/taluk/village names are corrected
+    to their closest known place before validation.
+
+    Returns (valid, report): valid rows converted to volunteer fields, and a
+    report of rejected and corrected rows with "row", "status" and "error".
+    """
+    for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+        chunk[column] = chunk[column].str.strip()
+
+    notes = pd.Series("", index=chunk.index)
+    if search_index is not None:
+        correct_location_level(chunk, "district", None, "district", location_table, search_index, notes)
+        correct_location_level(chunk, "taluk", chunk["district"], "taluk", location_table, search_index, notes)
+        correct_location_level(chunk, "village", chunk["district"] + "|" + chunk["taluk"], "village",
+                               location_table, search_index, notes)
+
+    checks = []
+    checks.append(("missing name", chunk["name"] == ""))
+    checks.append(("invalid blood group", ~chunk["blood_group"].isin(blood_types)))
+
+    numbers = {}
+    for column, (low, high) in NUMERIC_RANGES.items():
+        numbers[column] = pd.to_numeric(chunk[column], errors="coerce")
+        checks.append((f"{column} must be {low}-{high}", ~numbers[column].between(low, high)))
+
+    # Resolve "District|Taluk|Village" paths to location IDs; unknown paths become NaN
+    path_ids = location_table["path_ids"]
+    district_path = chunk["district"]
+    taluk_path = district_path + "|" + chunk["taluk"]
+    village_path = taluk_path + "|" + chunk["village"]
+    district_id = district_path.map(path_ids)
+    taluk_id = taluk_path.map(path_ids)
+    village_id = village_path.map(path_ids)
+    bad_district = district_id.isna()
+    bad_taluk = ~bad_district & taluk_id.isna()
+    # Village is optional, but must belong to the taluk when given
+    bad_village = ~bad_district & ~bad_taluk & (chunk["village"] != "") & village_id.isna()
+    checks.append(("unknown district", bad_district))
+    checks.append(("taluk not in district", bad_taluk))
+    checks.append(("village not in taluk", bad_village))
+
+    error_text = pd.Series("", index=chunk.index)
+    for message, failed in checks:
+        error_text = error_text.where(~failed, error_text + message + "; ")
+    failed_rows = error_text != ""
+
+    errors = chunk[failed_rows].copy()
+    errors.insert(0, "error", error_text[failed_rows].str.rstrip("; "))
+    errors.insert(0, "status", "rejected")
+    corrected_rows = ~failed_rows & (notes != "")
+    corrected = chunk[corrected_rows].copy()
+    corrected.insert(0, "error", notes[corrected_rows].str.rstrip("; "))
+    corrected.insert(0, "status", "corrected")
+    report = pd.concat([errors, corrected]).sort_index()
+    # +2: one for the header line, one because CSV rows are 1-based
+    report.insert(0, "row", report.index + 2)
+
+    valid = chunk[~failed_rows].copy()
+    for column in NUMERIC_RANGES:
+        valid[column] = numbers[column][~failed_rows].astype(int)
+    valid["district_id"] = district_id[~failed_rows].astype(int)
+    valid["taluk_id"] = taluk_id[~failed_rows].astype(int)
+    valid["village_id"] = [int(v) if v == v else None for v in village_id[~failed_rows]]
+    # Share the table's name strings instead of one copy per row
+    valid["district"] = valid["district_id"].map(location_table["names"])
+    valid["taluk"] = valid["taluk_id"].map(location_table["names"])
+    valid["added_at"] = datetime.now().isoformat()
+    return valid, report
+
+def import_volunteers(csv_file, location_table, blood_types, commit_batch, search_index=None, chunk_rows=CHUNK_ROWS):
+    """Stream a volunteer CSV in chunks, committing valid rows batch by batch.
+
+    commit_batch(records, rows_seen) is called once per chunk with the valid
+    volunteer dicts. Returns (added_count, report) where report is a DataFrame
+    with one line per rejected or auto-corrected row.
+    """
+    reader = pd.read_csv(csv_file, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+    added = 0
+    rows_seen = 0
+    report_chunks = []
+    for chunk in reader:
+        missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+        if missing:
+            report = pd.DataFrame([{"row": 1, "status": "rejected", "error": f"missing columns: {', '.join(missing)}"}])
+            return added, report
+        for column in OPTIONAL_COLUMNS:
+            if column not in chunk.columns:
+                chunk[column] = ""
+
+        valid, report = validate_chunk(chunk, location_table, blood_types, search_index)
+        rows_seen += len(chunk)
+        if not valid.empty:
+            records = valid[REQUIRED_COLUMNS + OPTIONAL_COLUMNS + LOCATION_ID_COLUMNS + ["added_at"]].to_dict("records")
+            commit_batch(records, rows_seen)
+            added += len(records)
+        if not report.empty:
+            report_chunks.append(report)
+
+    if not report_chunks:
+        return added, pd.DataFrame(columns=["row", "status", "error"])
+    return added, pd.concat(report_chunks, ignore_index=True)